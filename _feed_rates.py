@@ -0,0 +1,36 @@
+import math
+
+def turn_angle(a, b, c):
+    """Radians the direction changes by at `b` going a -> b -> c, 0 for a straight line."""
+    v1 = (b[0] - a[0], b[1] - a[1])
+    v2 = (c[0] - b[0], c[1] - b[1])
+    n1, n2 = math.hypot(*v1), math.hypot(*v2)
+    if n1 == 0 or n2 == 0:
+        return 0
+    cos = (v1[0] * v2[0] + v1[1] * v2[1]) / (n1 * n2)
+    return math.acos(max(-1, min(1, cos)))
+
+def segment_feeds(points, feed_min, feed_max, corner_accel, accel, lookahead, step=50):
+    """
+        Feed rate (mm/min) for each segment of a path in mm, segment k going from point k to k + 1.
+
+        A segment's feed is limited by the tightest radius at either of its ends (a turn of angle t between
+        segments of length l is treated as an arc of radius l / t, taken at `corner_accel` mm/s^2), and by
+        how far ahead GRBL can plan, `lookahead` segments like it at `accel` mm/s^2. Feeds are rounded down to
+        `step` so the modal writer doesn't restate F for every segment.
+    """
+    n = len(points) - 1
+    lengths = [math.hypot(points[k + 1][0] - points[k][0], points[k + 1][1] - points[k][1]) for k in range(n)]
+    # Radius at each interior point, infinite on a straight and at the ends, which start and stop anyway
+    radii = [math.inf] * (n + 1)
+    for k in range(1, n):
+        angle = turn_angle(points[k - 1], points[k], points[k + 1])
+        if angle > 0:
+            radii[k] = (lengths[k - 1] + lengths[k]) / 2 / angle
+    feeds = []
+    for k in range(n):
+        radius = min(radii[k], radii[k + 1])
+        speed = min(math.sqrt(corner_accel * radius), math.sqrt(2 * accel * lookahead * lengths[k]))  # mm/s
+        feed = max(feed_min, min(feed_max, speed * 60))
+        feeds.append(max(feed_min, int(feed // step * step)))
+    return feeds
@@ -0,0 +1,61 @@
+from _segment_grid import SegmentGrid
+from util import pt_dist
+
+def _covered(grid, a, b, tolerance, skip):
+    # A segment is covered when every point along it (sampled at half the tolerance) is within tolerance of an earlier one
+    n = max(int(pt_dist(a, b) / (tolerance / 2)), 1)
+    for k in range(n + 1):
+        pt = (a[0] + (b[0] - a[0]) * k / n, a[1] + (b[1] - a[1]) * k / n)
+        if not any(key not in skip for key in grid.near(pt, tolerance)):
+            return False
+    return True
+
+def find_overlaps(paths, tolerance, min_length=None):
+    """
+        Runs of segments that retrace something already peened, in drawing order, as [(path index, first
+        segment, last segment)] where segment k goes from point k to k + 1. Runs shorter than `min_length`
+        (default 4 tolerances) are left alone, splitting a path for them would cost more than it saves.
+    """
+    min_length = 4 * tolerance if min_length is None else min_length
+    grid = SegmentGrid(tolerance)
+    runs = []
+    for i, path in enumerate(paths):
+        recent = []  # This path's own segments closer (along the path) than a couple of line widths, always "overlapping"
+        run_start, run_length = None, 0
+        for k in range(len(path) - 1):
+            a, b = path[k], path[k + 1]
+            while recent and sum(pt_dist(*grid.segments[key]) for key in recent[1:]) > 2 * tolerance:
+                recent.pop(0)
+            if _covered(grid, a, b, tolerance, set(recent)):
+                if run_start is None:
+                    run_start, run_length = k, 0
+                run_length += pt_dist(a, b)
+            elif run_start is not None:
+                if run_length >= min_length:
+                    runs.append((i, run_start, k - 1))
+                run_start = None
+            grid.add((i, k), a, b)
+            recent.append((i, k))
+        if run_start is not None and run_length >= min_length:
+            runs.append((i, run_start, len(path) - 2))
+    return runs
+
+def remove_overlaps(paths, runs):
+    """`paths` with the segments of `runs` taken out, splitting paths where a run was in the middle."""
+    cut = {}
+    for i, first, last in runs:
+        cut.setdefault(i, []).append((first, last))
+    result = []
+    for i, path in enumerate(paths):
+        start = 0
+        for first, last in sorted(cut.get(i, [])):
+            if first > start:
+                result.append(path[start:first + 1])
+            start = last + 1
+        if start < len(path) - 1 or (start == 0 and path):
+            result.append(path[start:])
+    return result
+
+def overlap_segments(paths, runs):
+    """The polylines `runs` cover, for drawing them."""
+    return [paths[i][first:last + 2] for i, first, last in runs]
@@ -0,0 +1,73 @@
+"""
+Compact motion G-code using GRBL's modal state: the motion mode and feed are only written when they change,
+an axis only when it moves, and numbers in their shortest form. Every character saved is RX buffer space the
+character-counting stream can give to the next segment.
+"""
+
+def format_number(value, decimals):
+    """Shortest form GRBL reads back as `value` rounded to `decimals`: no trailing zeros, no leading zero, no -0."""
+    text = f"{value:.{decimals}f}".rstrip("0").rstrip(".")
+    if text in ("", "-", "-0"):
+        return "0"
+    if text.startswith("0."):
+        return text[1:]
+    if text.startswith("-0."):
+        return "-" + text[2:]
+    return text
+
+def step_decimals(steps_per_mm, limit=6):
+    """Digits needed to write any whole number of steps exactly."""
+    for decimals in range(limit):
+        if abs(round(1 / steps_per_mm, decimals) * steps_per_mm - 1) < 1e-9:
+            return decimals
+    return limit
+
+class GcodeWriter:
+    """
+        Writes G0/G1 XY moves for one stream, tracking what GRBL already has modal. Start a new writer (or `reset`)
+        whenever other G-code may have run in between.
+
+        :param decimals: digits kept after the point
+        :param steps_per_mm: (x, y) to snap coordinates to whole steps ($100/$101) instead of rounding to `decimals`,
+            written with as many digits as a step needs (3 for 250 steps/mm)
+    """
+
+    def __init__(self, decimals=2, steps_per_mm=None):
+        self.steps_per_mm = steps_per_mm
+        if steps_per_mm:
+            decimals = max(step_decimals(steps) for steps in steps_per_mm)
+        self.decimals = decimals
+        self.bytes = 0  # Bytes written, counting each line's newline
+        self.reset()
+
+    def reset(self):
+        self.motion = None
+        self.feed = None
+        self.position = [None, None]
+
+    def _quantize(self, axis, value):
+        if self.steps_per_mm:
+            steps = self.steps_per_mm[axis]
+            value = round(value * steps) / steps
+        return round(value, self.decimals)
+
+    def move(self, x, y, feed=None):
+        """A G1 move, or a G0 rapid when `feed` is None. Never empty, a move that goes nowhere still names X."""
+        words = []
+        motion = "G0" if feed is None else "G1"
+        if motion != self.motion:
+            words.append(motion)
+            self.motion = motion
+        for axis, (letter, value) in enumerate((("X", x), ("Y", y))):
+            value = self._quantize(axis, value)
+            if value != self.position[axis]:
+                words.append(letter + format_number(value, self.decimals))
+                self.position[axis] = value
+        if not any(word[0] in "XY" for word in words):
+            words.append("X" + format_number(self.position[0], self.decimals))
+        if feed is not None and feed != self.feed:
+            words.append("F" + format_number(feed, self.decimals))
+            self.feed = feed
+        line = "".join(words)
+        self.bytes += len(line) + 1
+        return line
@@ -0,0 +1,61 @@
+from collections import defaultdict
+
+from util import pt_dist
+
+class EndpointHash:
+    """Path endpoints bucketed on a grid of `tolerance` sized cells, so a lookup only checks the 3x3 cells around a point."""
+
+    def __init__(self, paths, tolerance):
+        self.paths = paths
+        self.tolerance = tolerance
+        self.cells = defaultdict(list)  # (cx, cy) -> [(path index, 0 for its start or -1 for its end)]
+        for i, path in enumerate(paths):
+            for end in (0, -1):
+                self.cells[self._cell(path[end])].append((i, end))
+
+    def _cell(self, pt):
+        return (int(pt[0] // self.tolerance), int(pt[1] // self.tolerance))
+
+    def nearest(self, pt, used):
+        """(path index, end) of the closest endpoint of an unused path within tolerance, None if there isn't one."""
+        cx, cy = self._cell(pt)
+        best, best_dist = None, self.tolerance
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for i, end in self.cells.get((cx + dx, cy + dy), ()):
+                    if i in used:
+                        continue
+                    dist = pt_dist(pt, self.paths[i][end])
+                    if dist <= best_dist:
+                        best, best_dist = (i, end), dist
+        return best
+
+def join_paths(paths, tolerance):
+    """
+        Chain paths whose ends are within `tolerance` of each other into continuous strokes, reversing them as
+        needed. Returns the joined paths, still in the order their first path was drawn.
+    """
+    if tolerance <= 0:
+        return [list(path) for path in paths]
+    endpoints = EndpointHash(paths, tolerance)
+    used = set()
+    joined = []
+    for i, path in enumerate(paths):
+        if i in used:
+            continue
+        used.add(i)
+        chain = list(path)
+        # Grow the end of the chain, then flip it and grow what was its start
+        for _ in range(2):
+            while True:
+                match = endpoints.nearest(chain[-1], used)
+                if match is None:
+                    break
+                j, end = match
+                used.add(j)
+                nxt = paths[j] if end == 0 else paths[j][::-1]
+                # Points that coincide would only be a zero length move
+                chain += nxt[1:] if pt_dist(chain[-1], nxt[0]) == 0 else nxt
+            chain.reverse()
+        joined.append(chain)
+    return joined
@@ -0,0 +1,246 @@
+import math
+import re
+
+# A small model of GRBL's planner: junction deviation cornering, per-axis rate/accel limits and
+# trapezoidal velocity profiles, with a backward/forward pass over the queued blocks.
+# Lengths are in mm, speeds in mm/s and accelerations in mm/s^2.
+
+AXES = "XYZ"
+MIN_JUNCTION_SPEED = 0.0
+
+class GcodeError(ValueError):
+    """A line GRBL would reject, `code` is its error number."""
+
+    def __init__(self, code, msg):
+        super().__init__(msg)
+        self.code = code
+
+_WORD_RE = re.compile(r"([A-Z])\s*([-+]?\d*\.?\d+)")
+
+def parse_words(line):
+    """Split a g-code line into [(letter, value)], dropping comments."""
+    line = re.sub(r"\(.*?\)|;.*$", "", line.upper())
+    return [(letter, float(value)) for letter, value in _WORD_RE.findall(line)]
+
+def vec_sub(a, b):
+    return [a[i] - b[i] for i in range(3)]
+
+def vec_len(v):
+    return math.sqrt(v[0]**2 + v[1]**2 + v[2]**2)
+
+class Block:
+    """One straight move, as GRBL queues it in its planner."""
+
+    def __init__(self, start, target, feed, rapid, settings):
+        self.start = list(start)
+        self.target = list(target)
+        delta = vec_sub(target, start)
+        self.length = vec_len(delta)
+        self.unit = [d / self.length for d in delta] if self.length else [0, 0, 0]
+
+        # The slowest axis in proportion to its share of the move limits the whole move
+        max_rate, accel = math.inf, math.inf
+        for i, axis in enumerate(AXES):
+            if self.unit[i]:
+                max_rate = min(max_rate, settings.get(110 + i, 500) / 60 / abs(self.unit[i]))
+                accel = min(accel, settings.get(120 + i, 10) / abs(self.unit[i]))
+        self.nominal_speed = max_rate if rapid else min(feed / 60, max_rate)
+        self.accel = accel if accel != math.inf else 1
+        self.max_entry_speed = 0
+        self.entry_speed = 0
+        self.exit_speed = 0
+
+    def position_at(self, dist):
+        return [self.start[i] + self.unit[i] * dist for i in range(3)]
+
+def junction_speed(prev, block, junction_deviation):
+    """GRBL's junction deviation cornering speed between two consecutive blocks."""
+    if prev is None or not prev.length or not block.length:
+        return MIN_JUNCTION_SPEED
+    cos_theta = -sum(prev.unit[i] * block.unit[i] for i in range(3))
+    if cos_theta > 0.999999:  # Full reversal
+        return MIN_JUNCTION_SPEED
+    if cos_theta < -0.999999:  # Straight through
+        return min(prev.nominal_speed, block.nominal_speed)
+    sin_theta_d2 = math.sqrt(0.5 * (1 - cos_theta))
+    speed = math.sqrt(block.accel * junction_deviation * sin_theta_d2 / (1 - sin_theta_d2))
+    return min(speed, prev.nominal_speed, block.nominal_speed)
+
+def plan(blocks, entry_speed=None, exit_speed=0.0):
+    """
+        Backward/forward pass over `blocks`, filling in each block's entry and exit speeds.
+
+        `entry_speed` pins the first block's entry (e.g. the speed of a block that is already running).
+    """
+    if not blocks:
+        return blocks
+
+    # Backward pass: every block must be able to slow down for the one after it
+    next_entry = exit_speed
+    for block in reversed(blocks):
+        block.entry_speed = min(block.max_entry_speed, math.sqrt(next_entry**2 + 2 * block.accel * block.length))
+        next_entry = block.entry_speed
+    if entry_speed is not None:
+        blocks[0].entry_speed = min(blocks[0].entry_speed, entry_speed)
+
+    # Forward pass: and must be able to reach it from the one before
+    for i, block in enumerate(blocks):
+        reachable = math.sqrt(block.entry_speed**2 + 2 * block.accel * block.length)
+        block.exit_speed = blocks[i + 1].entry_speed if i + 1 < len(blocks) else exit_speed
+        if block.exit_speed > reachable:
+            block.exit_speed = reachable
+            if i + 1 < len(blocks):
+                blocks[i + 1].entry_speed = reachable
+    return blocks
+
+def profile(length, v_entry, v_nominal, v_exit, accel):
+    """Trapezoid (or triangle) for one block: (peak speed, accel dist, cruise dist, decel dist)."""
+    d_accel = max((v_nominal**2 - v_entry**2) / (2 * accel), 0)
+    d_decel = max((v_nominal**2 - v_exit**2) / (2 * accel), 0)
+    if d_accel + d_decel <= length:
+        return v_nominal, d_accel, length - d_accel - d_decel, d_decel
+    peak = math.sqrt(max((2 * accel * length + v_entry**2 + v_exit**2) / 2, 0))
+    d_accel = max((peak**2 - v_entry**2) / (2 * accel), 0)
+    return peak, d_accel, 0, length - d_accel
+
+def block_time(block):
+    if not block.length:
+        return 0
+    peak, d_accel, d_cruise, d_decel = profile(block.length, block.entry_speed, block.nominal_speed, block.exit_speed, block.accel)
+    t = 0
+    if d_accel:
+        t += (peak - block.entry_speed) / block.accel
+    if d_cruise and peak:
+        t += d_cruise / peak
+    if d_decel:
+        t += (peak - block.exit_speed) / block.accel
+    return t
+
+def distance_at(block, t):
+    """Distance travelled along a planned block `t` seconds after it started."""
+    peak, d_accel, d_cruise, d_decel = profile(block.length, block.entry_speed, block.nominal_speed, block.exit_speed, block.accel)
+    a, vi = block.accel, block.entry_speed
+    t_accel = (peak - vi) / a
+    if t <= t_accel:
+        return vi * t + 0.5 * a * t**2
+    t -= t_accel
+    t_cruise = d_cruise / peak if peak else 0
+    if t <= t_cruise:
+        return d_accel + peak * t
+    t = min(t - t_cruise, (peak - block.exit_speed) / a)
+    return min(d_accel + d_cruise + peak * t - 0.5 * a * t**2, block.length)
+
+def arc_points(start, target, offset, clockwise, tolerance=0.002):
+    """Break a G2/G3 XY arc into the chord endpoints GRBL would use for `tolerance` ($12)."""
+    cx, cy = start[0] + offset[0], start[1] + offset[1]
+    radius = math.hypot(offset[0], offset[1])
+    a0 = math.atan2(start[1] - cy, start[0] - cx)
+    a1 = math.atan2(target[1] - cy, target[0] - cx)
+    sweep = a1 - a0
+    if clockwise and sweep >= -1e-9:
+        sweep -= 2 * math.pi
+    elif not clockwise and sweep <= 1e-9:
+        sweep += 2 * math.pi
+    segments = max(int(abs(sweep) * radius / math.sqrt(tolerance * (2 * radius - tolerance))) if radius > tolerance else 1, 1)
+    points = []
+    for i in range(1, segments):
+        a = a0 + sweep * i / segments
+        points.append([cx + radius * math.cos(a), cy + radius * math.sin(a), start[2] + (target[2] - start[2]) * i / segments])
+    points.append(list(target))
+    return points
+
+class ProgramModel:
+    """Modal g-code state, turns lines into planner blocks."""
+
+    def __init__(self, settings, position=(0, 0, 0)):
+        self.settings = settings
+        self.position = list(position)  # Machine coordinates
+        self.offset = [0, 0, 0]  # G92 offset
+        self.motion = 0
+        self.feed = 0
+        self.absolute = True
+
+    def blocks_for(self, line):
+        """The blocks a line adds, or a ('dwell', seconds) tuple for G4."""
+        words = parse_words(line)
+        if not words:
+            return []
+        g_codes = [v for l, v in words if l == "G"]
+        values = {l: v for l, v in words if l != "G"}
+        if "F" in values:
+            self.feed = values["F"]
+        if 90 in g_codes:
+            self.absolute = True
+        if 91 in g_codes:
+            self.absolute = False
+        if 4 in g_codes:
+            return ("dwell", values.get("P", 0))
+
+        work = [self.position[i] - self.offset[i] for i in range(3)]
+        target_work = list(work)
+        for i, axis in enumerate(AXES):
+            if axis in values:
+                target_work[i] = values[axis] if self.absolute else work[i] + values[axis]
+        if 92 in g_codes:
+            self.offset = [self.position[i] - target_work[i] if AXES[i] in values else self.offset[i] for i in range(3)]
+            return []
+
+        for g in g_codes:
+            if g in (0, 1, 2, 3):
+                self.motion = int(g)
+        if not any(axis in values for axis in AXES):
+            return []
+
+        if self.motion != 0 and not self.feed:
+            raise GcodeError(22, "Feed rate has not yet been set or is undefined")
+
+        target = [target_work[i] + self.offset[i] for i in range(3)]
+        if self.motion in (2, 3):
+            offset = (values.get("I", 0), values.get("J", 0))
+            points = arc_points(self.position, target, offset, self.motion == 2, self.settings.get(12, 0.002))
+        else:
+            points = [target]
+
+        blocks = []
+        start = self.position
+        for pt in points:
+            block = Block(start, pt, self.feed, self.motion == 0, self.settings)
+            if block.length:
+                blocks.append(block)
+            start = pt
+        self.position = list(target)
+        return blocks
+
+def link(prev, block, settings):
+    block.max_entry_speed = junction_speed(prev, block, settings.get(11, 0.01))
+
+def estimate_program_time(lines, settings, position=(0, 0, 0), planner_size=None):
+    """
+        Seconds GRBL would take to run `lines`, assuming the stream always keeps the planner full.
+
+        With `planner_size` the planner only sees that many blocks (the running one included), as GRBL does, and
+        each block runs as planned when it starts, able to stop at the end of the buffer. Without it the whole
+        program is planned at once, which is faster to compute but optimistic for dense paths.
+    """
+    model = ProgramModel(settings, position)
+    total = 0
+    blocks = []
+    entry = None  # Speed the first queued block starts at, fixed once the block before it has run
+    for line in lines:
+        new = model.blocks_for(line)
+        if isinstance(new, tuple):  # Dwell waits for the planner to empty
+            total += sum(block_time(b) for b in plan(blocks, entry))
+            total += new[1]
+            blocks = []
+            entry = None
+            continue
+        for block in new:
+            link(blocks[-1] if blocks else None, block, settings)
+            blocks.append(block)
+            if planner_size and len(blocks) > planner_size:
+                # The buffer is full, the oldest block runs with what's queued behind it and frees a slot
+                plan(blocks[:planner_size], entry)
+                running = blocks.pop(0)
+                total += block_time(running)
+                entry = running.exit_speed
+    return total + sum(block_time(b) for b in plan(blocks, entry))
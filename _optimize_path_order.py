@@ -2,8 +2,7 @@ import json
 from random import shuffle, randint, choice
 from statistics import *
 
-def pt_dist(p1, p2):
-    return ((p2[0] - p1[0])**2 + (p2[1] - p1[1])**2)**0.5
+from util import pt_dist
 
 def get_order_score(order):
     travel_dist = 0
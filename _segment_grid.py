@@ -0,0 +1,84 @@
+from collections import defaultdict
+
+def seg_dist(pt, a, b):
+    """Distance from `pt` to the segment a-b."""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length2 = dx * dx + dy * dy
+    t = 0 if length2 == 0 else max(0, min(1, ((pt[0] - a[0]) * dx + (pt[1] - a[1]) * dy) / length2))
+    x, y = a[0] + t * dx - pt[0], a[1] + t * dy - pt[1]
+    return (x * x + y * y)**0.5
+
+def pt_in_polygon(pt, polygon):
+    """Even-odd rule, `polygon` is a list of points closed back to its first."""
+    x, y = pt
+    inside = False
+    for (x0, y0), (x1, y1) in zip(polygon, polygon[1:] + polygon[:1]):
+        if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+            inside = not inside
+    return inside
+
+def split_path(path, removed):
+    """The pieces of `path` left once segments `removed` (k joins point k to k + 1) are taken out, a lone point goes whole."""
+    if len(path) == 1:
+        return []
+    pieces, current = [], [path[0]]
+    for k in range(len(path) - 1):
+        if k in removed:
+            if len(current) > 1:
+                pieces.append(current)
+            current = [path[k + 1]]
+        else:
+            current.append(path[k + 1])
+    if len(current) > 1:
+        pieces.append(current)
+    return pieces
+
+class SegmentGrid:
+    """
+        Uniform grid of line segments, each listed in every cell its bounding box touches. Keys are whatever
+        the caller uses to name a segment, e.g. (path index, segment index).
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.segments = {}  # key -> (a, b)
+
+    def __len__(self):
+        return len(self.segments)
+
+    def _cells(self, x0, y0, x1, y1):
+        size = self.cell_size
+        for cx in range(int(min(x0, x1) // size), int(max(x0, x1) // size) + 1):
+            for cy in range(int(min(y0, y1) // size), int(max(y0, y1) // size) + 1):
+                yield (cx, cy)
+
+    def add(self, key, a, b):
+        self.segments[key] = (a, b)
+        for cell in self._cells(a[0], a[1], b[0], b[1]):
+            self.cells[cell].add(key)
+
+    def remove(self, key):
+        a, b = self.segments.pop(key)
+        for cell in self._cells(a[0], a[1], b[0], b[1]):
+            self.cells[cell].discard(key)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self.segments.clear()
+
+    def in_rect(self, x0, y0, x1, y1):
+        """Keys of segments whose bounding boxes overlap the rectangle, a superset of those crossing it."""
+        keys = set()
+        for cell in self._cells(x0, y0, x1, y1):
+            keys |= self.cells.get(cell, set())
+        return keys
+
+    def near(self, pt, radius):
+        """Keys of segments within `radius` of `pt`."""
+        return {
+            key for key in self.in_rect(pt[0] - radius, pt[1] - radius, pt[0] + radius, pt[1] + radius)
+            if seg_dist(pt, *self.segments[key]) <= radius
+        }
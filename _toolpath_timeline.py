@@ -0,0 +1,72 @@
+import numpy as np
+
+from _motion_planner import ProgramModel, link, plan, profile
+
+class Timeline:
+    """
+        Where the machine is at every moment of a program, from the planner model. Each planned block is kept as a
+        row of arrays (start, direction, speeds and the times of its accel/cruise/decel phases), so positions for
+        any number of times come out of one vectorized pass. G4 dwells stand for waits with the machine stopped.
+    """
+
+    def __init__(self, lines, settings, position=(0, 0, 0)):
+        model = ProgramModel(settings, position)
+        rows = []  # (start time, block, peening)
+        queued = []
+        t = 0
+
+        def flush(t):
+            # The planner empties before a dwell, so the blocks queued so far end at a standstill
+            for block, peening in zip(plan([b for b, _ in queued]), [p for _, p in queued]):
+                peak, d_accel, d_cruise, d_decel = profile(block.length, block.entry_speed, block.nominal_speed, block.exit_speed, block.accel)
+                t_accel = (peak - block.entry_speed) / block.accel
+                t_cruise = d_cruise / peak if peak else 0
+                t_decel = (peak - block.exit_speed) / block.accel
+                rows.append((t, block.start[:2], block.unit[:2], block.length, block.entry_speed, block.accel, peak, t_accel, t_cruise, t_decel, peening))
+                t += t_accel + t_cruise + t_decel
+            queued.clear()
+            return t
+
+        for line in lines:
+            new = model.blocks_for(line)
+            if isinstance(new, tuple):
+                t = flush(t) + new[1]
+                continue
+            for block in new:
+                link(queued[-1][0] if queued else None, block, settings)
+                queued.append((block, model.motion != 0))
+        self.duration = flush(t)
+
+        columns = list(zip(*rows)) if rows else [()] * 11
+        self.t0, start, unit, self.length, self.v0, self.accel, self.peak, self.t_accel, self.t_cruise, self.t_decel, peening = (
+            np.array(column, dtype=float) for column in columns
+        )
+        self.start = start.reshape(-1, 2)
+        self.unit = unit.reshape(-1, 2)
+        self.end = self.start + self.unit * self.length[:, None]
+        self.peening = peening.astype(bool)
+        self.t1 = self.t0 + self.t_accel + self.t_cruise + self.t_decel
+
+    def __len__(self):
+        return len(self.t0)
+
+    def blocks_done(self, t):
+        """Number of blocks finished by `t`."""
+        return int(np.searchsorted(self.t1, t, side="right"))
+
+    def positions(self, times):
+        """XY (mm) at each of `times`, an (n, 2) array. Between blocks (e.g. in a dwell) it's where the last one ended."""
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        if not len(self):
+            return np.zeros((len(times), 2))
+        k = np.clip(np.searchsorted(self.t0, times, side="right") - 1, 0, len(self) - 1)
+        dt = np.maximum(times - self.t0[k], 0)
+        v0, a, peak = self.v0[k], self.accel[k], self.peak[k]
+        ta = np.minimum(dt, self.t_accel[k])
+        tc = np.clip(dt - self.t_accel[k], 0, self.t_cruise[k])
+        td = np.clip(dt - self.t_accel[k] - self.t_cruise[k], 0, self.t_decel[k])
+        dist = np.minimum(v0 * ta + 0.5 * a * ta**2 + peak * tc + peak * td - 0.5 * a * td**2, self.length[k])
+        return self.start[k] + self.unit[k] * dist[:, None]
+
+    def position(self, t):
+        return self.positions([t])[0]
@@ -0,0 +1,242 @@
+"""
+Headless benchmarks for the design-to-motion pipeline.
+
+Every design goes through the same stages the app runs it through: load, auto-size, simplify
+(smooth), join touching paths, optimize the path order, compile to g-code, render the canvas offscreen and stream the
+g-code to the GRBL emulator. Inputs are designs/*.json plus synthetic designs of a given point
+count. Results are written as JSON and can be compared against an earlier run:
+
+    python benchmark.py --sizes 10000 100000 --out bench.json
+    python benchmark.py --baseline bench.json  # Exits 1 if any stage got slower than the threshold
+"""
+
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import io
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import statistics
+import contextlib
+import subprocess
+
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QImage
+
+import proto_serial
+from canvas import PeenerCanvas
+from machine import Machine
+from mainwindow import MainWindow
+
+STAGES = ("load", "auto_size", "simplify", "join", "optimize", "compile", "render", "stream")
+DESIGNS_GLOB = "designs/*.json"
+SYNTHETIC_DIR = "designs/synthetic"
+POINTS_PER_PATH = 200
+RENDER_SIZE = 800  # px
+
+def make_synthetic_design(n_points, points_per_path=POINTS_PER_PATH, seed=0):
+    """Random-walk strokes inside the tag, in the canvas' -0.5 to 0.5 coordinates."""
+    rng = np.random.default_rng(seed)
+    paths = []
+    remaining = n_points
+    while remaining > 0:
+        n = min(points_per_path, remaining)
+        remaining -= n
+        start = rng.uniform(-0.3, 0.3, 2)
+        heading = np.cumsum(rng.normal(0, 0.3, n))
+        steps = np.stack([np.cos(heading), np.sin(heading)], axis=1) * 0.002
+        pts = start + np.cumsum(steps, axis=0)
+        # Keep every point on the tag
+        radius = np.linalg.norm(pts, axis=1, keepdims=True)
+        pts = np.where(radius > 0.45, pts * 0.45 / radius, pts)
+        paths.append(pts.round(5).tolist())
+    return paths
+
+def synthetic_design_file(n_points):
+    filepath = os.path.join(SYNTHETIC_DIR, f"synthetic_{n_points}.json")
+    if not os.path.isfile(filepath):
+        os.makedirs(SYNTHETIC_DIR, exist_ok=True)
+        with open(filepath, "w+") as out:
+            json.dump(make_synthetic_design(n_points), out)
+    return filepath
+
+class Pipeline:
+    """Runs one design through every stage, each stage's output from its first run feeds the next stage."""
+
+    def __init__(self, canvas, machine, iters, stream_lines):
+        self.canvas = canvas
+        self.machine = machine
+        self.iters = iters
+        self.stream_lines = stream_lines
+        self._homed = False
+
+    def load(self, filepath):
+        with open(filepath) as src:
+            return json.load(src)
+
+    def auto_size(self, paths):
+        self.canvas.set_paths(paths)
+        self.canvas.auto_size_paths()
+        return self.canvas.paths
+
+    def simplify(self, paths):
+        self.canvas.set_paths(paths)
+        self.canvas.smooth_paths()
+        return self.canvas.paths
+
+    def join(self, paths):
+        self.canvas.set_paths(paths)
+        self.canvas.join_paths()
+        return self.canvas.paths
+
+    def optimize(self, paths):
+        self.canvas.set_paths(paths)
+        self.canvas.optimize_path_order(self.iters)
+        return self.canvas.paths
+
+    def compile(self, paths):
+        lines = []
+        for travel, peen in self.machine.compile_paths(paths):
+            lines.append(travel)
+            lines += peen
+        return lines
+
+    def render(self, lines):
+        image = QImage(RENDER_SIZE, RENDER_SIZE, QImage.Format_ARGB32)
+        self.canvas.render(image)
+        return lines
+
+    def stream(self, lines):
+        """Streams to the emulator, returns the controller's virtual seconds so the stats show both clocks."""
+        lines = lines[:self.stream_lines]
+        ser = self.machine.ser
+        if not self._homed:  # Once, so the stage times streaming rather than homing
+            ser.connect("emulator")
+            ser.send([Machine.GRBL_HOME_ALL, Machine.GRBL_SET_TAG_OFFSET, "G21", "G90", Machine.GRBL_TAG_REL_CORRDS], True)
+            self._homed = True
+        start = self.machine.clock.now()
+        ser.send(lines, True)
+        return {"lines": len(lines), "bytes": sum(len(line) + 1 for line in lines), "virtual_seconds": self.machine.clock.now() - start}
+
+def time_stage(func, arg, repeat):
+    runs = []
+    result = None
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):  # The pipeline prints progress, keep the report readable
+            start = time.perf_counter()
+            out = func(arg)
+            runs.append(time.perf_counter() - start)
+        if i == 0:
+            result = out
+    return result, runs
+
+def run_design(pipeline, filepath, repeat):
+    results = []
+    data = filepath
+    for stage in STAGES:
+        out, runs = time_stage(getattr(pipeline, stage), data, repeat if stage != "stream" else 1)  # Streaming moves the machine
+        entry = {
+            "design": os.path.basename(filepath),
+            "stage": stage,
+            "min": min(runs),
+            "median": statistics.median(runs),
+            "runs": runs,
+        }
+        if stage == "load":
+            entry["paths"] = len(out)
+            entry["points"] = sum(len(path) for path in out)
+        if stage == "stream":
+            entry.update(out)
+        else:
+            data = out
+        results.append(entry)
+        print(f"  {stage:<10} {entry['median'] * 1000:10.1f} ms")
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """Prints the median ratio of every stage against the baseline, returns the regressions."""
+    base = {(r["design"], r["stage"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'design':<28} {'stage':<10} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for r in results:
+        b = base.get((r["design"], r["stage"]))
+        if not b or not b["median"]:
+            continue
+        ratio = r["median"] / b["median"]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append((r["design"], r["stage"], ratio))
+            flag = "  SLOWER"
+        print(f"{r['design']:<28} {r['stage']:<10} {b['median'] * 1000:8.1f}ms {r['median'] * 1000:8.1f}ms {ratio:7.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--designs", nargs="*", help=f"Design files, defaults to {DESIGNS_GLOB}")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[10_000, 100_000, 1_000_000], help="Synthetic design point counts")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the median is compared")
+    parser.add_argument("--iters", type=int, default=1000, help="Path order optimization iterations")
+    parser.add_argument("--stream-lines", type=int, default=2000, help="Most g-code lines streamed per design")
+    parser.add_argument("--time-scale", type=float, default=100, help="Emulator speed-up over real time")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed slow-down before a stage counts as a regression")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    proto_serial.DEBUG_PRINT = False
+
+    settings = dict(MainWindow.settings, gpio_backend="sim", serial_backend="emu", time_scale=args.time_scale)
+    canvas = PeenerCanvas(settings)
+    canvas.resize(RENDER_SIZE, RENDER_SIZE)
+    with contextlib.redirect_stdout(io.StringIO()):
+        machine = Machine(None, settings)
+    pipeline = Pipeline(canvas, machine, args.iters, args.stream_lines)
+
+    designs = args.designs if args.designs is not None else sorted(glob.glob(DESIGNS_GLOB))
+    designs += [synthetic_design_file(n) for n in args.sizes]
+
+    results = []
+    try:
+        for filepath in designs:
+            print(filepath)
+            results += run_design(pipeline, filepath, args.repeat)
+    finally:
+        machine.ser.disconnect()
+        machine.loop.stop()
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.out, "w+") as out:
+        json.dump(report, out, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as src:
+            regressions = compare(results, json.load(src), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stage(s) slower than the baseline by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,22 @@
 import os
 import json
+import time
+import itertools
 
-from PyQt5.QtCore import Qt, QRect, QRectF, pyqtSignal, QObject
+from PyQt5.QtCore import Qt, QRect, QRectF, QLineF, QTimer, pyqtSignal, QObject
 from PyQt5.QtWidgets import QWidget
 from PyQt5.QtGui import QPainter, QColor, QPen, QBrush, QImage
-import numpy as np
 
 from _optimize_path_order import optimize_path_order
+from _join_paths import join_paths
+from _find_overlaps import find_overlaps, remove_overlaps, overlap_segments
+from _segment_grid import SegmentGrid, seg_dist, pt_in_polygon, split_path
 from _min_enclosing_circle import make_circle
 from util import *
 
 class PeenerCanvas(QWidget):
     # path_change_event = pyqtSignal(object)
+    preview_time_changed = pyqtSignal(float)
 
     FLIP_X = True
     FLIP_Y = True
@@ -23,11 +28,24 @@ class PeenerCanvas(QWidget):
     CIRCLE_COLOR = "#E1E1E1"
     BORDER_COLOR = "#222222"
     TRACKER_COLOR = "#2222FF"
+    OVERLAP_COLOR = "#E02020"
+    SELECT_COLOR = "#2080E0"
+    PREVIEW_COLOR = "#20A040"
     BLANK_BRUSH = "#ffffff00"
     MARGIN = 20  # px
 
+    TOOLS = ("draw", "erase", "lasso")
+    INDEX_CELL = 0.01  # Segment index cell size, in tag diameters
+    ERASER_WIDTHS = 2  # Eraser radius, in line widths
+    PREVIEW_FPS = 30
+    PREVIEW_SPEEDS = (1, 2, 5, 10, 20, 50, 100)  # Playback speed-ups over machine time
+
     def __init__(self, settings, *args, **kwargs):
         super(PeenerCanvas, self).__init__(*args, **kwargs)
+        # Every path segment is kept in a spatial index for hit-testing, keyed (path id, segment index)
+        self.index = SegmentGrid(self.INDEX_CELL)
+        self._ids = itertools.count()
+        self._path_ids = []
         self.paths = []
         self.redo_paths = []
         self.last_x, self.last_y = None, None
@@ -36,6 +54,19 @@ class PeenerCanvas(QWidget):
         self._canvas_tracking = False
         self._template = None
         self._machine_pos = None
+        self.overlap_preview = []  # Retraced segments found by find_overlaps, drawn over the paths until applied or cleared
+        self._overlap_runs = []
+        self.tool = "draw"
+        self.selection = set()  # Ids of selected paths
+        self._lasso = []
+        self._drag_from = None
+        self.preview = None  # Timeline being played back over the design, see start_preview
+        self.preview_time = 0
+        self.preview_speed = 10
+        self._preview_lines = None
+        self._preview_clock = None
+        self._preview_timer = QTimer(self)
+        self._preview_timer.timeout.connect(self._advance_preview)
         self.clear_canvas()
 
     def update_settings(self, settings):
@@ -57,7 +88,7 @@ class PeenerCanvas(QWidget):
 
     def save_to_file(self, filename):
         json.dump(self.paths, open(filename, "w+"))
-        pixmap = self.grab(QRect((self.width() - self.circle_diam) / 2, (self.height() - self.circle_diam) / 2, self.circle_diam, self.circle_diam))
+        pixmap = self.grab(QRect((self.width() - self.circle_diam) // 2, (self.height() - self.circle_diam) // 2, self.circle_diam, self.circle_diam))
         pixmap.save(filename.replace(".json", ".png"))
         
     def load_from_file(self, filename):
@@ -89,12 +120,12 @@ class PeenerCanvas(QWidget):
             self._set_brush(painter, self.CIRCLE_COLOR)
         outline_size = 2
         self._set_pen(painter, self.BORDER_COLOR, outline_size)
-        painter.drawEllipse(
+        painter.drawEllipse(QRectF(
             (self.width() - self.circle_diam) / 2 - outline_size,
             (self.height() - self.circle_diam) / 2 - outline_size,
             self.circle_diam + 2 * outline_size,
             self.circle_diam + 2 * outline_size
-        )
+        ))
 
         last_x = None
         last_y = None
@@ -102,12 +133,12 @@ class PeenerCanvas(QWidget):
         if self.settings['draw_border']:
             self._set_pen(painter, self.PEN_COLOR, self.pen_width)
             margin = self.settings['border_margin'] / self.mm_per_px
-            painter.drawEllipse(
+            painter.drawEllipse(QRectF(
                 (self.width() - self.circle_diam) / 2 + margin,
                 (self.height() - self.circle_diam) / 2 + margin,
                 self.circle_diam - 2 * margin - self.pen_width,
                 self.circle_diam - 2 * margin - self.pen_width
-            )
+            ))
             last_x = self.width() / 2
             last_y = self.height() / 2 - (self.settings['tag_diam'] / 2 - self.settings['border_margin']) / self.mm_per_px
 
@@ -118,7 +149,7 @@ class PeenerCanvas(QWidget):
 
             if self.settings['show_travel_lines'] and last_x is not None and last_y is not None:
                 self._set_pen(painter, self.TRAVEL_PEN, self.pen_width)
-                painter.drawLine(last_x, last_y, first_x, first_y)
+                painter.drawLine(QLineF(last_x, last_y, first_x, first_y))
 
             last_x = first_x
             last_y = first_y
@@ -127,22 +158,153 @@ class PeenerCanvas(QWidget):
                 self._set_pen(painter, path_color, self.pen_width)
                 x = pt[0] * self.circle_diam + self.width() / 2
                 y = pt[1] * self.circle_diam + self.height() / 2
-                painter.drawLine(last_x, last_y, x, y)
+                painter.drawLine(QLineF(last_x, last_y, x, y))
                 last_x = x
                 last_y = y
 
+        to_px = lambda pt: (pt[0] * self.circle_diam + self.width() / 2, pt[1] * self.circle_diam + self.height() / 2)
+        if self.selection:
+            self._set_pen(painter, self.SELECT_COLOR, self.pen_width)
+            for pid, path in zip(self._path_ids, self.paths):
+                if pid in self.selection:
+                    for a, b in zip(path, path[1:]):
+                        painter.drawLine(QLineF(*to_px(a), *to_px(b)))
+        if self._lasso:
+            self._set_pen(painter, self.SELECT_COLOR, 1)
+            for a, b in zip(self._lasso, self._lasso[1:]):
+                painter.drawLine(QLineF(*to_px(a), *to_px(b)))
+
+        if self.overlap_preview:
+            self._set_pen(painter, self.OVERLAP_COLOR, self.pen_width)
+            for segment in self.overlap_preview:
+                for a, b in zip(segment, segment[1:]):
+                    painter.drawLine(QLineF(*to_px(a), *to_px(b)))
+
+        if self.preview is not None:
+            self._paint_preview(painter)
+
         if self.settings['show_machine_pos'] and self._machine_pos:
             self._set_brush(painter, self.TRACKER_COLOR)
             self._set_pen(painter, self.TRACKER_COLOR, 1)
-            painter.drawEllipse(
+            painter.drawEllipse(QRectF(
                 (self.width() - self.circle_diam) / 2 + self._machine_pos[0],
                 (self.height() - self.circle_diam) / 2 + self._machine_pos[1],
                 self.pen_width * 2,
                 self.pen_width * 2
-            )
+            ))
         
         painter.end()
 
+    @property
+    def paths(self):
+        return self._paths
+
+    @paths.setter
+    def paths(self, paths):
+        self._paths = paths
+        self._reindex()
+
+    # Segment index
+
+    def _segments(self, pos):
+        # A single point path is indexed as a zero length segment so it can still be hit
+        pid, path = self._path_ids[pos], self._paths[pos]
+        for k in range(max(len(path) - 1, 1)):
+            yield (pid, k), path[k], path[min(k + 1, len(path) - 1)]
+
+    def _index_path(self, pos):
+        for key, a, b in self._segments(pos):
+            self.index.add(key, a, b)
+
+    def _unindex_path(self, pos):
+        for key, _, _ in self._segments(pos):
+            self.index.remove(key)
+
+    def _reindex(self):
+        self.index.clear()
+        self._path_ids = [next(self._ids) for _ in self._paths]
+        self.selection = set()
+        for pos in range(len(self._paths)):
+            self._index_path(pos)
+
+    def paths_near(self, pt, radius):
+        """Ids of paths with a segment within `radius` of `pt`, in tag diameters."""
+        pids = set()
+        for pid, k in self.index.in_rect(pt[0] - radius, pt[1] - radius, pt[0] + radius, pt[1] + radius):
+            if pid not in pids and seg_dist(pt, *self.index.segments[(pid, k)]) <= radius:
+                pids.add(pid)
+        return pids
+
+    def paths_in_rect(self, x0, y0, x1, y1):
+        """Ids of paths with a point inside the rectangle."""
+        pids = set()
+        for pid, k in self.index.in_rect(x0, y0, x1, y1):
+            if pid not in pids and any(x0 <= p[0] <= x1 and y0 <= p[1] <= y1 for p in self.index.segments[(pid, k)]):
+                pids.add(pid)
+        return pids
+
+    def paths_in_polygon(self, polygon):
+        """Ids of paths with a point inside `polygon`."""
+        xs, ys = [p[0] for p in polygon], [p[1] for p in polygon]
+        pids = set()
+        for pid, k in self.index.in_rect(min(xs), min(ys), max(xs), max(ys)):
+            if pid not in pids and any(pt_in_polygon(p, polygon) for p in self.index.segments[(pid, k)]):
+                pids.add(pid)
+        return pids
+
+    # Tools
+
+    def set_tool(self, tool):
+        self.tool = tool
+        self._lasso = []
+        if tool != "lasso":
+            self.selection = set()
+        self.update()
+
+    def erase_at(self, pt, radius):
+        """Erase every segment within `radius` of `pt`, splitting the paths they were in. Returns how many were erased."""
+        hits = {}
+        for pid, k in self.index.near(pt, radius):
+            hits.setdefault(pid, set()).add(k)
+        if not hits:
+            return 0
+        paths, ids = [], []
+        for pos, pid in enumerate(self._path_ids):
+            if pid not in hits:
+                paths.append(self._paths[pos])
+                ids.append(pid)
+                continue
+            self._unindex_path(pos)
+            for piece in split_path(self._paths[pos], hits[pid]):
+                paths.append(piece)
+                ids.append(next(self._ids))
+        new = set(ids) - set(self._path_ids)
+        self._paths, self._path_ids = paths, ids
+        for pos, pid in enumerate(ids):
+            if pid in new:
+                self._index_path(pos)
+        self.selection -= set(hits)
+        self.update()
+        return sum(len(ks) for ks in hits.values())
+
+    def move_selection(self, dx, dy):
+        for pos, pid in enumerate(self._path_ids):
+            if pid in self.selection:
+                self._unindex_path(pos)
+                self._paths[pos] = [[p[0] + dx, p[1] + dy] for p in self._paths[pos]]
+                self._index_path(pos)
+        self.update()
+
+    def delete_selection(self):
+        keep = [pos for pos, pid in enumerate(self._path_ids) if pid not in self.selection]
+        for pos, pid in enumerate(self._path_ids):
+            if pid in self.selection:
+                self._unindex_path(pos)
+        self._paths = [self._paths[pos] for pos in keep]
+        self._path_ids = [self._path_ids[pos] for pos in keep]
+        self.selection = set()
+        self.update()
+
     def set_paths(self, paths):
         self.paths = paths
         # self.path_change_event.emit(self.paths)
@@ -181,13 +343,15 @@ class PeenerCanvas(QWidget):
 
     def undo_path(self):
         if len(self.paths) > 0:
+            self._unindex_path(len(self.paths) - 1)
+            self.selection.discard(self._path_ids.pop())
             self.redo_paths.append(self.paths.pop())
             self.update()
             # self.path_change_event.emit(self.paths)
 
     def redo_path(self):
         if len(self.redo_paths) > 0:
-            self.paths.append(self.redo_paths.pop())
+            self.add_path(self.redo_paths.pop())
             self.update()
             # self.path_change_event.emit(self.paths)
 
@@ -198,11 +362,19 @@ class PeenerCanvas(QWidget):
         # self.path_change_event.emit(self.paths)
 
     def add_path(self, *paths):
-        self.paths += paths
+        for path in paths:
+            self._paths.append(path)
+            self._path_ids.append(next(self._ids))
+            self._index_path(len(self._paths) - 1)
         # self.path_change_event.emit(self.paths)
 
     def add_path_pt(self, pt, path_index=-1):
-        self.paths[path_index].append(pt)
+        pos = path_index % len(self._paths)
+        path, pid = self._paths[pos], self._path_ids[pos]
+        if len(path) == 1:
+            self.index.remove((pid, 0))  # No longer a lone point
+        path.append(pt)
+        self.index.add((pid, len(path) - 2), path[-2], path[-1])
         # self.path_change_event.emit(self.paths)
 
     def optimize_path_order(self, iters=1e5):
@@ -211,6 +383,36 @@ class PeenerCanvas(QWidget):
         self.update()
         # self.path_change_event.emit(self.paths)
 
+    def join_paths(self):
+        """Chain strokes whose ends touch (within a line width) into single paths, returns how many stops that removed."""
+        print("Joining Paths")
+        tolerance = self.settings['line_width'] / self.settings['tag_diam']  # Paths are in tag diameters
+        n_paths = len(self.paths)
+        self.paths = join_paths(self.paths, tolerance)
+        self.update()
+        print(f"Joined {n_paths} paths into {len(self.paths)}")
+        return n_paths - len(self.paths)
+
+    def find_overlaps(self):
+        """Find segments that retrace earlier ones (within a line width) and preview them, returns the runs found."""
+        print("Finding Overlaps")
+        tolerance = self.settings['line_width'] / self.settings['tag_diam']
+        self._overlap_runs = find_overlaps(self.paths, tolerance)
+        self.overlap_preview = overlap_segments(self.paths, self._overlap_runs)
+        self.update()
+        print(f"Found {len(self._overlap_runs)} retraced runs")
+        return self._overlap_runs
+
+    def remove_overlaps(self):
+        """Remove the previewed overlaps."""
+        self.paths = remove_overlaps(self.paths, self._overlap_runs)
+        self.clear_overlap_preview()
+
+    def clear_overlap_preview(self):
+        self._overlap_runs = []
+        self.overlap_preview = []
+        self.update()
+
     def auto_size_paths(self):
         print("Auto Sizing Paths")
         (circle_x, circle_y, circle_r) = make_circle(sum(self.paths, []))
@@ -251,6 +453,92 @@ class PeenerCanvas(QWidget):
         self.redo_paths = []
         self.last_x, self.last_y = None, None
 
+    # Toolpath Preview
+
+    def start_preview(self, timeline):
+        """Play `timeline` (in tag mm, e.g. from Machine.preview_timeline) back over the design from its start."""
+        self.preview = timeline
+        self._preview_lines = None
+        self.set_preview_time(0)
+        self.play_preview()
+
+    def stop_preview(self):
+        self.pause_preview()
+        self.preview = None
+        self._preview_lines = None
+        self.update()
+
+    def play_preview(self):
+        if self.preview is None:
+            return
+        if self.preview_time >= self.preview.duration:
+            self.set_preview_time(0)
+        self._preview_clock = time.monotonic()
+        self._preview_timer.start(1000 // self.PREVIEW_FPS)
+
+    def pause_preview(self):
+        self._preview_timer.stop()
+
+    @property
+    def preview_playing(self):
+        return self._preview_timer.isActive()
+
+    def set_preview_time(self, t):
+        if self.preview is None:
+            return
+        self.preview_time = min(max(t, 0), self.preview.duration)
+        self.preview_time_changed.emit(self.preview_time)
+        self.update()
+
+    def set_preview_speed(self, speed):
+        self.preview_speed = speed
+
+    def _advance_preview(self):
+        # Steps by the wall time since the last frame, so a late timer doesn't slow playback down
+        now = time.monotonic()
+        t = self.preview_time + (now - self._preview_clock) * self.preview_speed
+        self._preview_clock = now
+        if t >= self.preview.duration:
+            self.pause_preview()
+        self.set_preview_time(t)
+
+    def _preview_px(self, pts):
+        # Tag mm to widget pixels, undoing get_paths' flips
+        import numpy as np  # Only needed once there's a preview, keeps it out of start-up
+        scale = self.circle_diam / self.settings['tag_diam']
+        flip = np.array([-scale if self.FLIP_X else scale, -scale if self.FLIP_Y else scale])
+        return pts * flip + (self.width() / 2, self.height() / 2)
+
+    def _paint_preview(self, painter):
+        import numpy as np
+        preview = self.preview
+        key = (self.width(), self.height(), self.settings['tag_diam'])
+        if self._preview_lines is None or self._preview_lines[0] != key:
+            # Every block's line in pixels, rebuilt only on resize so a frame just slices off the ones done
+            rows = np.hstack((self._preview_px(preview.start), self._preview_px(preview.end))).tolist()
+            lines = [QLineF(*row) for row in rows]
+            peen_lines = [line for line, peening in zip(lines, preview.peening) if peening]
+            travel_lines = [line for line, peening in zip(lines, preview.peening) if not peening]
+            self._preview_lines = key, peen_lines, travel_lines, np.concatenate(([0], np.cumsum(preview.peening)))
+        _, peen_lines, travel_lines, peened = self._preview_lines
+
+        done = preview.blocks_done(self.preview_time)
+        self._set_pen(painter, self.TRAVEL_PEN, 1)
+        if done > peened[done]:
+            painter.drawLines(travel_lines[:done - peened[done]])
+        self._set_pen(painter, self.PREVIEW_COLOR, self.pen_width)
+        if peened[done]:
+            painter.drawLines(peen_lines[:peened[done]])
+
+        head = self._preview_px(preview.positions([self.preview_time]))[0]
+        if done < len(preview) and preview.t0[done] <= self.preview_time:  # The block under way, up to the head
+            if not preview.peening[done]:
+                self._set_pen(painter, self.TRAVEL_PEN, 1)
+            painter.drawLine(QLineF(*self._preview_px(preview.start[done]), *head))
+        self._set_brush(painter, self.PREVIEW_COLOR)
+        self._set_pen(painter, self.PREVIEW_COLOR, 1)
+        painter.drawEllipse(QRectF(head[0] - self.pen_width, head[1] - self.pen_width, self.pen_width * 2, self.pen_width * 2))
+
     def _set_pen(self, painter, color, width):
         pen = QPen()
         pen.setWidth(int(width))
@@ -273,17 +561,42 @@ class PeenerCanvas(QWidget):
     def _event_in_circle(self, pt):
         return self._pt_dist(pt) < (self.getCircleDiam() / 2)
     
+    def _event_pt(self, e):
+        return (
+            (e.x() -  self.width() / 2) / self.circle_diam,
+            (e.y() -  self.height() / 2) / self.circle_diam
+        )
+
+    def _tool_radius(self):
+        return self.ERASER_WIDTHS * self.settings['line_width'] / self.settings['tag_diam']
+
     def mousePressEvent(self, e):
-        if self._event_in_circle(e):
+        if self.preview is None and self._event_in_circle(e):
             self._canvas_tracking = True
-            self.redo_paths = []
+            pt = self._event_pt(e)
+            if self.tool == "erase":
+                self.erase_at(pt, self._tool_radius())
+            elif self.tool == "lasso":
+                if self.selection & self.paths_near(pt, self._tool_radius()):
+                    self._drag_from = pt  # Dragging the selection
+                else:
+                    self._lasso = [pt]
+            else:
+                self.redo_paths = []
 
     def mouseMoveEvent(self, e):
-        if self._canvas_tracking:
-            pt = (
-                (e.x() -  self.width() / 2) / self.circle_diam,
-                (e.y() -  self.height() / 2) / self.circle_diam
-            )
+        if self._canvas_tracking and self.tool == "erase":
+            self.erase_at(self._event_pt(e), self._tool_radius())
+        elif self._canvas_tracking and self.tool == "lasso":
+            pt = self._event_pt(e)
+            if self._drag_from is not None:
+                self.move_selection(pt[0] - self._drag_from[0], pt[1] - self._drag_from[1])
+                self._drag_from = pt
+            else:
+                self._lasso.append(pt)
+                self.update()
+        elif self._canvas_tracking:
+            pt = self._event_pt(e)
             if self.last_x == e.x() and self.last_y == e.y():
                 return
             elif self.last_x is None or self.last_y is None:  # If path not started
@@ -302,6 +615,11 @@ class PeenerCanvas(QWidget):
             self.update()
 
     def mouseReleaseEvent(self, e):
+        if self.tool == "lasso" and self._lasso:
+            self.selection = self.paths_in_polygon(self._lasso) if len(self._lasso) > 2 else set()
+            self._lasso = []
+            self.update()
+        self._drag_from = None
         self.last_x = None
         self.last_y = None
         self._canvas_tracking = False
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+from concurrent.futures import Future, CancelledError, TimeoutError
+
+class DialogRequest:
+    """A single dialog posted by the machine worker, answered by the UI (or a scripted responder)."""
+
+    def __init__(self, dialog, args=(), kwargs=None, wait=True):
+        self.dialog = dialog
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.wait = wait  # False for notifications nobody is waiting on
+        self.future = Future()
+
+    def respond(self, response):
+        # Late answers to a request that already timed out or was cancelled are dropped.
+        if not self.future.done():
+            self.future.set_result(response)
+
+    def cancel(self):
+        return self.future.cancel()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+class DialogChannel:
+    """
+        Request/response channel between the machine worker thread and whatever answers its dialogs.
+
+        `post` delivers a DialogRequest to the UI (e.g. a queued Qt signal's `emit`), which must call
+        `request.respond(...)` once the operator has answered. When a `responder` is set the request is
+        answered synchronously instead, so routines can run headless.
+    """
+
+    def __init__(self, post=None, responder=None):
+        self.post = post
+        self.responder = responder
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def notify(self, dialog, *args, **kwargs):
+        request = DialogRequest(dialog, args, kwargs, wait=False)
+        if self.responder is not None:
+            self.responder(request)
+        elif self.post is not None:
+            self.post(request)
+        return request
+
+    def ask(self, dialog, *args, timeout=None, **kwargs):
+        """
+            Post a dialog and block until it is answered.
+
+            :raises DialogTimeout: if nobody answers within `timeout` seconds.
+            :raises DialogCancelled: if the request was cancelled (e.g. by an e-stop).
+        """
+        request = self._open(dialog, args, kwargs)
+        try:
+            self._post(request)
+            return request.result(timeout)
+        except TimeoutError:
+            request.cancel()
+            raise DialogTimeout(f"No response to dialog after {timeout}s")
+        except CancelledError:
+            raise DialogCancelled()
+        finally:
+            self._close(request)
+
+    async def ask_async(self, dialog, *args, timeout=None, **kwargs):
+        """Awaitable version of `ask` for routines running on an asyncio loop."""
+        request = self._open(dialog, args, kwargs)
+        try:
+            self._post(request)
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(request.future)), timeout)
+        except asyncio.TimeoutError:
+            raise DialogTimeout(f"No response to dialog after {timeout}s")
+        except asyncio.CancelledError:
+            if not request.future.cancelled():
+                raise  # The awaiting task was cancelled, not the dialog
+            raise DialogCancelled()
+        finally:
+            request.cancel()
+            self._close(request)
+
+    def _open(self, dialog, args, kwargs):
+        request = DialogRequest(dialog, args, kwargs)
+        with self._lock:
+            self._pending.add(request)
+        return request
+
+    def _close(self, request):
+        with self._lock:
+            self._pending.discard(request)
+
+    def _post(self, request):
+        if self.responder is not None:
+            request.respond(self.responder(request))
+        elif self.post is not None:
+            self.post(request)
+        else:
+            raise DialogCancelled("No dialog responder attached")
+
+    def cancel_all(self):
+        with self._lock:
+            pending = list(self._pending)
+        for request in pending:
+            request.cancel()
+        return len(pending)
+
+class ScriptedResponder:
+    """
+        Answers dialogs from a fixed list of responses, then with `default`, recording every request it was given.
+        Without a `default` a dialog past the end of the script is cancelled, as if the operator never answered.
+    """
+
+    def __init__(self, responses=(), default=None):
+        self.responses = list(responses)
+        self.default = default
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        if not request.wait:
+            return None
+        if self.responses:
+            return self.responses.pop(0)
+        if self.default is None:
+            raise DialogCancelled("Scripted responses ran out")
+        return self.default
+
+class DialogTimeout(Exception):
+    pass
+
+class DialogCancelled(Exception):
+    pass
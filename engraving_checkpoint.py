@@ -0,0 +1,64 @@
+import os
+import json
+
+class EngravingCheckpoint:
+    """
+        How far an engraving got: the path being drawn, the first of its peening lines that may not have run yet
+        and the peener speed at the time. Saved when a routine is interrupted so it can be resumed on the same tag.
+    """
+
+    VERSION = 1
+
+    def __init__(self, paths, path=0, line=0, peener=0, border_done=False):
+        self.paths = paths
+        self.path = path  # Index of the path being drawn, len(paths) once every path is done
+        self.line = line  # Peening lines of that path known to have run
+        self.peener = peener
+        self.border_done = border_done
+
+    @property
+    def done(self):
+        return self.path >= len(self.paths)
+
+    def start_path(self, path, line=0):
+        self.path = path
+        self.line = line
+
+    def interrupted(self, start, acked, planner_blocks):
+        """
+            Record where a path's stream stopped. `acked` lines after `start` were acknowledged, but GRBL acks a
+            line when it's planned rather than run, so the last planner's worth is assumed not to have run.
+        """
+        self.line = start + max(acked - planner_blocks, 0)
+
+    def to_dict(self):
+        return {
+            "_version": self.VERSION,
+            "paths": self.paths,
+            "path": self.path,
+            "line": self.line,
+            "peener": self.peener,
+            "border_done": self.border_done,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("_version") != cls.VERSION:
+            return None
+        return cls(data["paths"], data["path"], data["line"], data["peener"], data["border_done"])
+
+    def save(self, filepath):
+        with open(filepath, "w+") as out:
+            json.dump(self.to_dict(), out)
+
+    @classmethod
+    def load(cls, filepath):
+        if not filepath or not os.path.isfile(filepath):
+            return None
+        with open(filepath) as src:
+            return cls.from_dict(json.load(src))
+
+    @staticmethod
+    def clear(filepath):
+        if filepath and os.path.isfile(filepath):
+            os.remove(filepath)
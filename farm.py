@@ -0,0 +1,332 @@
+"""
+Drives several peeners from one host: a shared job queue and a scheduler that hands tags to idle machines.
+
+Each machine is a full Machine with its own port, pin map, serial link and event loop. Jobs are
+estimated with the motion planner model, and the longest waiting job always goes to the next idle
+machine (longest-processing-time-first), which keeps the machines finishing at about the same time.
+
+    python farm.py --emulate 3 --time-scale 50 designs/*.json  # Three emulated controllers
+"""
+
+import sys
+import glob
+import json
+import time
+import asyncio
+import argparse
+import threading
+import itertools
+
+from PyQt5.QtCore import Qt
+
+from machine import Machine
+from port_discovery import discovery
+from _motion_planner import estimate_program_time
+from gcode_stream import GcodeStream
+from serial_metrics import PLANNER_BLOCKS
+from grbl_settings_sync import load_profile
+from engraving_checkpoint import EngravingCheckpoint
+
+class FarmJob:
+    _ids = itertools.count(1)
+
+    def __init__(self, paths=None, name=None, gcode=None):
+        self.id = next(self._ids)
+        self.name = name or f"Job {self.id}"
+        self.paths = paths
+        self.gcode = gcode.splitlines() if isinstance(gcode, str) else gcode  # A compiled program or G-code file instead of paths
+        self.estimate = None  # Seconds, filled in when queued
+        self.machine = None
+        self.state = "queued"  # queued, running, done, interrupted, failed
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def __repr__(self):
+        return f"<FarmJob {self.id} {self.name!r} {self.state}>"
+
+class FarmMachine:
+    """One machine in the farm and what it's doing."""
+
+    def __init__(self, name, machine):
+        self.name = name
+        self.machine = machine
+        self.state = "idle"  # idle, busy, external, faulted or disabled
+        self.job = None
+        self.completed = 0
+        self.busy_seconds = 0
+
+    def __repr__(self):
+        return f"<FarmMachine {self.name} {self.state}>"
+
+class MachineFarm:
+    JOB_OVERHEAD = 60  # Seconds of homing, loading, lifting, parking and dispensing per tag, on top of the motion
+
+    def __init__(self, machine_settings, base_settings=None, responder=None):
+        """
+            :param machine_settings: {name: settings overrides}, e.g. each machine's port and pin map, or {name: Machine}
+            :param base_settings: shared defaults every machine starts from
+            :param responder: answers every machine's dialogs, for running unattended
+        """
+        self.machines = {}
+        self.queue = []
+        self.jobs = []
+        self.on_change = []  # Called with (event, job or machine) whenever something changes
+        self._lock = threading.RLock()
+
+        base_settings = dict(base_settings or {})
+        # A machine set to "auto" must never pick a port another machine is set to, held ports are skipped anyway
+        ports = {
+            name: (overrides.settings if isinstance(overrides, Machine) else dict(base_settings, **overrides)).get('port')
+            for name, overrides in machine_settings.items()
+        }
+        for name, overrides in machine_settings.items():
+            if isinstance(overrides, Machine):
+                machine = overrides  # e.g. the GUI's own machine
+            else:
+                settings = dict(base_settings, **overrides)
+                settings.setdefault('checkpoint_fp', f"checkpoint_{name}.json")
+                settings.setdefault('port_exclude', [port for other, port in ports.items() if other != name and port not in (None, Machine.AUTO_PORT)])
+                machine = Machine(None, settings)
+            if responder is not None:
+                machine.dialogs.responder = responder
+            farm_machine = self.machines[name] = FarmMachine(name, machine)
+            # Routines started outside the farm (e.g. from the GUI) keep the machine off the schedule while they run
+            machine.routine_started.connect(lambda _, m=farm_machine: self._external(m, True), Qt.DirectConnection)
+            machine.routine_finished.connect(lambda _, m=farm_machine: self._external(m, False), Qt.DirectConnection)
+        self._check_pins()
+
+    def _check_pins(self):
+        # Machines on the Pi's own GPIO share a single header, so no two may claim the same pin
+        claimed = {}
+        for farm_machine in self.machines.values():
+            if farm_machine.machine.settings.get('gpio_backend', 'auto') == "sim":
+                continue
+            for pin_name, pin in farm_machine.machine.pin_map().items():
+                if pin in claimed:
+                    raise ValueError(f"GPIO {pin} is used by both {claimed[pin]} and {farm_machine.name} ({pin_name})")
+                claimed[pin] = f"{farm_machine.name} ({pin_name})"
+
+    def _notify(self, event, item):
+        for callback in self.on_change:
+            callback(event, item)
+
+    # Jobs
+
+    def estimate(self, job, machine=None):
+        """
+            Seconds a tag should take, the planner's motion time plus a fixed overhead. A program that can only be
+            read once (e.g. from a generator) is left for the machine, so it's just the overhead.
+        """
+        machine = machine or next(iter(self.machines.values())).machine
+        settings = machine.grbl.settings or load_profile(machine.GRBL_SETTINGS_FP)
+        lines = [machine.GRBL_TRAVEL_XY(*machine.ENTRY_POINT)]
+        if job.gcode is not None:
+            stream = GcodeStream.of(job.gcode)
+            if not stream.reopenable:
+                return self.JOB_OVERHEAD
+            lines = itertools.chain(lines, stream)  # Files are read lazily rather than loaded
+        else:
+            for travel, peen in machine.compile_paths(job.paths):
+                lines.append(travel)
+                lines += peen
+        return estimate_program_time(lines, settings, planner_size=PLANNER_BLOCKS) + self.JOB_OVERHEAD
+
+    def submit(self, paths=None, name=None, gcode=None):
+        """Queue a design, as paths or as a compiled program."""
+        job = FarmJob(paths, name, gcode)
+        job.estimate = self.estimate(job)
+        with self._lock:
+            self.jobs.append(job)
+            self.queue.append(job)
+        self._notify("queued", job)
+        self._dispatch()
+        return job
+
+    def cancel(self, job):
+        with self._lock:
+            if job in self.queue:
+                self.queue.remove(job)
+                job.state = "cancelled"
+                return True
+        return False
+
+    # Scheduling
+
+    def _dispatch(self):
+        started = []
+        with self._lock:
+            for farm_machine in self.machines.values():
+                if not self.queue:
+                    break
+                if farm_machine.state != "idle":
+                    continue
+                job = max(self.queue, key=lambda j: j.estimate)  # Longest job first
+                self.queue.remove(job)
+                job.machine, job.state, job.started_at = farm_machine.name, "running", time.time()
+                farm_machine.state, farm_machine.job = "busy", job
+                started.append((farm_machine, job))
+        for farm_machine, job in started:
+            self._notify("started", job)
+            if job.gcode is not None:
+                self._run(farm_machine, farm_machine.machine.do_gcode_routine, job.gcode)
+            else:
+                self._run(farm_machine, farm_machine.machine.do_engraving_routine, job.paths)
+
+    def _run(self, farm_machine, routine, *args):
+        future = routine(*args)
+        if asyncio.iscoroutine(future):
+            # Dispatched from a finishing routine's callback on this machine's own loop thread
+            future = farm_machine.machine.loop.submit(future)
+        future.add_done_callback(lambda f: self._finished(farm_machine, not f.cancelled() and f.exception() is None and bool(f.result())))
+        return future
+
+    def _finished(self, farm_machine, succeeded):
+        # Tag routines return True once the tag is dispensed, errors and cancellations end with None
+        with self._lock:
+            job = farm_machine.job
+            job.finished_at = time.time()
+            farm_machine.busy_seconds += job.finished_at - job.started_at
+            if farm_machine.machine.checkpoint is not None:
+                # A half-peened tag stays on its machine until an operator resumes or clears it
+                job.state = "interrupted"
+                farm_machine.state = "faulted"
+            elif not succeeded:
+                # Nothing to resume, but whatever failed (homing, lifting, dispensing) needs an operator first
+                job.state = "failed"
+                farm_machine.state = "faulted"
+            else:
+                job.state = "done"
+                farm_machine.state = "idle" if farm_machine.state == "busy" else farm_machine.state
+                farm_machine.job = None
+                farm_machine.completed += 1
+        self._notify(job.state, job)
+        self._dispatch()
+
+    def _external(self, farm_machine, running):
+        with self._lock:
+            if running and farm_machine.state == "idle":
+                farm_machine.state = "external"
+            elif not running and farm_machine.state == "external":
+                farm_machine.state = "idle"
+            else:
+                return
+        self._notify(farm_machine.state, farm_machine)
+        if not running:
+            self._dispatch()
+
+    # Machine control
+
+    def resume(self, name):
+        """Resume a faulted machine's interrupted tag once its fault has been cleared."""
+        with self._lock:
+            farm_machine = self.machines[name]
+            if farm_machine.state != "faulted" or farm_machine.job.state != "interrupted":
+                return None
+            farm_machine.state = "busy"
+            farm_machine.job.state = "running"
+            farm_machine.job.started_at = time.time()
+        return self._run(farm_machine, farm_machine.machine.resume_engraving_routine)
+
+    def clear_fault(self, name):
+        """Give up on a faulted machine's tag (it has been removed by hand) and put the machine back to work."""
+        with self._lock:
+            farm_machine = self.machines[name]
+            if farm_machine.state != "faulted":
+                return
+            farm_machine.machine.checkpoint = None
+            EngravingCheckpoint.clear(farm_machine.machine.settings.get('checkpoint_fp'))
+            if farm_machine.job.state == "interrupted":
+                farm_machine.job.state = "scrapped"
+            farm_machine.job = None
+            farm_machine.state = "idle"
+        self._dispatch()
+
+    def set_enabled(self, name, enabled):
+        with self._lock:
+            farm_machine = self.machines[name]
+            if not enabled and farm_machine.state == "idle":
+                farm_machine.state = "disabled"
+            elif enabled and farm_machine.state == "disabled":
+                farm_machine.state = "idle"
+        self._dispatch()
+
+    def e_stop(self, name=None):
+        """Stop one machine, or every machine."""
+        for farm_machine in ([self.machines[name]] if name else self.machines.values()):
+            farm_machine.machine.e_stop()
+
+    def status(self):
+        with self._lock:
+            return {
+                "machines": {
+                    name: {"state": m.state, "job": m.job.name if m.job else None, "completed": m.completed}
+                    for name, m in self.machines.items()
+                },
+                "queued": [job.name for job in self.queue],
+                "queued_seconds": sum(job.estimate for job in self.queue),
+            }
+
+    def wait(self, timeout=None):
+        """Block until the queue is empty and no machine is busy, returns whether that happened."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            with self._lock:
+                if not self.queue and not any(m.state == "busy" for m in self.machines.values()):
+                    return True
+            time.sleep(0.1)
+        return False
+
+    def shutdown(self):
+        for farm_machine in self.machines.values():
+            farm_machine.machine.ser.disconnect()
+            farm_machine.machine.loop.stop()
+            discovery.release(farm_machine.machine)
+
+def add_machine_arguments(parser):
+    """The machine options shared by the farm's command line tools, see farm_from_args."""
+    parser.add_argument("--emulate", type=int, help="Run N emulated controllers instead of --config")
+    parser.add_argument("--config", help='JSON {name: settings} for each machine, e.g. {"a": {"port": "/dev/ttyUSB0", "pins": {...}}}')
+    parser.add_argument("--time-scale", type=float, default=1, help="Speed-up for emulated machines")
+
+def farm_from_args(parser, args):
+    """A MachineFarm for the add_machine_arguments options. Nobody is at a screen, so every question is answered yes."""
+    from PyQt5.QtWidgets import QMessageBox
+    from dialog_channel import ScriptedResponder
+    from mainwindow import MainWindow
+
+    base = dict(MainWindow.settings)
+    if args.emulate:
+        base.update(gpio_backend="sim", serial_backend="emu", time_scale=args.time_scale, port="emulator")
+        machines = {f"emu{i + 1}": {} for i in range(args.emulate)}
+    elif args.config:
+        with open(args.config) as src:
+            machines = json.load(src)
+    else:
+        parser.error("one of --emulate or --config is required")
+    return MachineFarm(machines, base, responder=ScriptedResponder(default=QMessageBox.Yes))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run designs across several machines")
+    parser.add_argument("designs", nargs="*", default=sorted(glob.glob("designs/*.json")))
+    add_machine_arguments(parser)
+    args = parser.parse_args()
+
+    farm = farm_from_args(parser, args)
+    farm.on_change.append(lambda event, item: print(f"{time.strftime('%H:%M:%S')} {event:<11} {item.name} on {item.machine}"))
+    start = time.monotonic()
+    try:
+        for filepath in args.designs:
+            with open(filepath) as src:
+                job = farm.submit(json.load(src), filepath)
+            print(f"Queued {filepath}, estimated {job.estimate:.0f}s")
+        farm.wait()
+    finally:
+        farm.shutdown()
+    print(f"Done in {time.monotonic() - start:.1f}s")
+    for name, m in farm.machines.items():
+        print(f"  {name}: {m.completed} tag(s), busy {m.busy_seconds:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import os
+import re
+
+COMMENT = re.compile(r"\([^)]*\)|;.*")
+
+def clean_line(line):
+    """A line as GRBL needs it: comments, whitespace and % program markers removed, empty when nothing is left."""
+    line = COMMENT.sub("", line)
+    return "".join(line.split()).strip("%")
+
+class GcodeStream:
+    """
+        Cleaned lines of a program, produced lazily so nothing but the current line is held in memory.
+        `offset` counts the source characters consumed so far, `fraction` is how far through the program
+        that is when the size is known.
+    """
+
+    def __init__(self, lines, size=None):
+        self.source = lines
+        self.size = size
+        self.offset = 0
+        self.lines = 0  # Cleaned lines produced
+
+    @classmethod
+    def of(cls, gcode):
+        """
+            A stream of program text, a sequence of lines, any other iterable of lines, or a file as a GcodeFile or
+            os.PathLike path. A str is always program text, never opened as a path, since programs arrive as text over
+            the job API.
+        """
+        if isinstance(gcode, cls):
+            return gcode
+        if isinstance(gcode, os.PathLike):
+            return GcodeFile(gcode)
+        if isinstance(gcode, str):
+            return cls(gcode.splitlines(), len(gcode))
+        if isinstance(gcode, (list, tuple)):
+            return cls(gcode, sum(len(line) + 1 for line in gcode))
+        return cls(gcode)
+
+    @property
+    def reopenable(self):
+        """Whether the program can be read again, a stream over a generator or open file is used up by one pass."""
+        return isinstance(self.source, (list, tuple))
+
+    @property
+    def fraction(self):
+        if self.size is None:
+            return None
+        return min(self.offset / self.size, 1) if self.size else 1
+
+    def _raw_lines(self):
+        for line in self.source:
+            self.offset += len(line) + 1
+            yield line
+
+    def __iter__(self):
+        self.offset = self.lines = 0
+        for line in self._raw_lines():
+            line = clean_line(line)
+            if line:
+                self.lines += 1
+                yield line
+
+class GcodeFile(GcodeStream):
+    """A G-code file (.nc, .gcode, ...) read a line at a time, `offset` is in bytes."""
+
+    def __init__(self, filepath):
+        super().__init__(None, os.path.getsize(filepath))
+        self.filepath = filepath
+
+    @property
+    def reopenable(self):
+        return True
+
+    def _raw_lines(self):
+        with open(self.filepath, "rb") as src:
+            for raw in src:
+                self.offset += len(raw)
+                yield raw.decode("ascii", errors="replace")
@@ -0,0 +1,116 @@
+from proto_serial import ProtoSerial
+from grbl_settings_sync import SettingsSync
+
+class GrblConnection:
+    """
+        Keeps the GRBL port open across routines and tracks the controller's state from everything it sends back,
+        so a reset or unlock is only issued when the controller actually needs one.
+    """
+
+    UNLOCK = "$X"
+    SLEEP = "$SLP"
+    IDLE_HOLD_ON = "$1=255"
+    IDLE_HOLD_OFF = "$1=10"
+    IDLE_HOLD_DELAY = 255  # $1 value that keeps the steppers energized
+
+    def __init__(self, ser: ProtoSerial):
+        self.ser = ser
+        self.ser.listeners.append(self.on_line)
+        self.port = None
+        self.settings = None  # Cached GrblSettings from the last `$$`, kept across resets since they live in EEPROM
+        self._sync = SettingsSync(ser)
+        self._clear_state()
+
+    def _clear_state(self):
+        self.state = None  # Last state from a status report, e.g. "Idle", "Run", "Alarm"
+        self.alarm = None  # Code of the last ALARM:n message
+        self.locked = False  # Alarm lock, cleared by $X or homing
+        self.sleeping = False
+        self.reset_required = False
+        self.idle_hold = None  # Unknown until we set it ourselves
+
+    def on_line(self, line):
+        if line.startswith(ProtoSerial.BANNER_PREFIX):
+            # A reset keeps the EEPROM settings, but clears everything else
+            idle_hold = self.idle_hold
+            self._clear_state()
+            self.idle_hold = idle_hold
+        elif line.startswith("ALARM:"):
+            self.alarm = line.split(":", 1)[1]
+            self.locked = True
+        elif line.startswith("<"):
+            self.state = line[1:].split("|")[0].split(":")[0]
+            self.locked = self.state == "Alarm"  # Homing or $X shows up as the lock clearing
+            if self.state == "Sleep":
+                self.sleeping = True
+        elif "to unlock" in line:
+            self.locked = True
+        elif "Caution: Unlocked" in line:
+            self.locked = False
+            self.alarm = None
+        elif "Reset to continue" in line:
+            self.reset_required = True
+        elif "Sleeping" in line:
+            self.sleeping = True
+
+    def is_ready(self, port):
+        return self.ser.is_connected() and port == self.port
+
+    def ensure_ready(self, port, unlock=True):
+        """Open the port if needed, then reset and unlock only if the controller's state requires it."""
+        if not self.is_ready(port):
+            self.port = port
+            self.settings = None
+            self._clear_state()
+            self.ser.connect(port)
+        elif self.sleeping or self.reset_required:
+            self.reset()
+
+        if unlock and self.locked:
+            self.ser.send(self.UNLOCK, True)
+            self.locked = False
+            self.alarm = None
+
+    def reset(self):
+        self.ser.reset()
+        self.reset_required = False
+        self.sleeping = False
+
+    def set_idle_hold(self, hold):
+        """Keep the steppers energized while idle, only writes the setting when it changes."""
+        if self.idle_hold is None and self.settings is not None and 1 in self.settings.values:
+            self.idle_hold = self.settings[1] == self.IDLE_HOLD_DELAY
+        if self.idle_hold != hold:
+            if not self.ser.command(self.IDLE_HOLD_ON if hold else self.IDLE_HOLD_OFF):
+                return  # Not written (e.g. stopped by an e-stop), so the next call tries again
+            self.idle_hold = hold
+            if self.settings is not None:
+                self.settings.values[1] = self.IDLE_HOLD_DELAY if hold else int(self.IDLE_HOLD_OFF.split("=")[1])
+
+    def forget_idle_hold(self):
+        """After an e-stop a `$1=` write may have landed without its ack, so the next set_idle_hold always writes."""
+        self.idle_hold = None
+        if self.settings is not None:
+            self.settings.values.pop(1, None)
+
+    def read_settings(self, refresh=False):
+        """The controller's `$$` table, read once per connection and cached."""
+        if self.settings is None or refresh:
+            self.settings = self._sync.read()
+        return self.settings
+
+    def sync_settings(self, profile):
+        """Write only the settings that differ from `profile`, returns ({n: value} written, {n: (read back, wanted)} failed)."""
+        self.settings, written, failed = self._sync.sync(profile, self.read_settings())
+        self.idle_hold = None  # Re-derive from the verified table
+        return written, failed
+
+    def sleep(self):
+        self.ser.send(self.SLEEP, True)
+        self.sleeping = True  # Only a reset wakes GRBL up again
+
+    def disconnect(self):
+        self.ser.disconnect()
+        self.port = None
+        self.settings = None  # The next port may be a different controller, so its `$$` is read again
+        self._clear_state()
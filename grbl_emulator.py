@@ -0,0 +1,434 @@
+"""
+GRBL 1.1 emulator for running and benchmarking Machine without a controller.
+
+It has pyserial's interface so it can be handed straight to ProtoSerial, or it can sit behind a pty with
+`attach_pty()` for tools that want a real device path. It models the 128 byte RX buffer and the wire's
+baud rate, the 15 block planner (via _motion_planner), homing cycles, `?` status reports, feed hold,
+resets, alarms and the `$` commands Machine uses, all against a clock that can run faster than real time.
+
+    python grbl_emulator.py --scale 10  # Prints a pty path to point the app's port setting at
+"""
+
+import os
+import tty
+import time
+import traceback
+import threading
+import collections
+
+from hardware import Clock, VirtualClock
+from grbl_settings_sync import load_profile, format_setting, SETTING_TYPES
+from _motion_planner import ProgramModel, GcodeError, link, plan, block_time, distance_at
+
+DEFAULT_PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grbl_settings")
+
+class GrblEmulator:
+    VERSION = "1.1h"
+    BANNER = f"Grbl {VERSION} ['$' for help]"
+    RX_BUFFER_SIZE = 128
+    PLANNER_SIZE = 15
+    TICK = 0.0005  # Real seconds between emulator steps
+
+    def __init__(self, settings=None, clock=None, baudrate=115200):
+        self.settings = dict(settings if settings is not None else load_profile(DEFAULT_PROFILE))
+        self.clock = clock or Clock()
+
+        # pyserial interface
+        self.port = None
+        self.baudrate = baudrate
+        self.timeout = None
+        self.is_open = False
+
+        self.stats = collections.Counter()  # rx_overflows, lines, blocks, errors, alarms
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pty_fd = None
+        self._boot()
+
+    # pyserial interface
+
+    def open(self):
+        with self._cond:
+            self.is_open = True
+            self._boot()
+            self._reply(self.BANNER)
+            self._startup_messages()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="grbl-emulator", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+        if self._pty_fd is not None:
+            os.close(self._pty_fd)
+            self._pty_fd = None
+
+    @property
+    def in_waiting(self):
+        return sum(len(e) for e in self._tx)
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._tx.clear()
+
+    def write(self, data):
+        with self._cond:
+            now = self.clock.now()
+            buffered = bytearray()
+            for byte in data:
+                char = chr(byte)
+                if char == "?":
+                    self._reply(self._status(now))
+                elif char == "!":
+                    self._feed_hold(now)
+                elif char == "~":
+                    self._cycle_start(now)
+                elif char == "\x18":
+                    self._soft_reset(now)
+                else:
+                    buffered.append(byte)
+            if buffered:
+                # Bytes take 10 bit times each on the wire before they land in GRBL's RX buffer
+                arrival = max(now, self._wire_free_at) + len(buffered) * 10 / self.baudrate
+                self._wire_free_at = arrival
+                self._wire.append((arrival, bytes(buffered)))
+            self._cond.notify_all()
+        return len(data)
+
+    def readline(self):
+        deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        with self._cond:
+            while not self._tx:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return b""
+                self._cond.wait(remaining)
+            return self._tx.popleft()
+
+    def attach_pty(self):
+        """Serve the emulator on a pseudo-terminal, returns the device path to connect to."""
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        self._pty_fd = master
+        self.open()
+
+        def pump_in():
+            while self.is_open:
+                try:
+                    data = os.read(master, 1024)
+                except OSError:
+                    break
+                if data:
+                    self.write(data)
+
+        def pump_out():
+            self.timeout = 0.1
+            while self.is_open:
+                line = self.readline()
+                if line:
+                    os.write(master, line)
+
+        threading.Thread(target=pump_in, name="grbl-emulator-pty-in", daemon=True).start()
+        threading.Thread(target=pump_out, name="grbl-emulator-pty-out", daemon=True).start()
+        return os.ttyname(slave)
+
+    # State
+
+    def _boot(self):
+        self.state = "Alarm" if self.settings.get(22) else "Idle"
+        self.alarm = None
+        self._tx = collections.deque()
+        self._wire = collections.deque()  # (arrival time, bytes) still in flight
+        self._wire_free_at = 0
+        self._rx = bytearray()
+        self._planner = collections.deque()
+        self._line_blocks = collections.deque()  # Blocks of the line being parsed that didn't fit yet
+        self._block = None
+        self._block_started = 0
+        self._block_duration = 0
+        self._busy_until = None  # Homing or dwell, the parser waits until then
+        self._busy_done = None
+        self._hold_started = None
+        self.position = list(getattr(self, "position", [0, 0, 0]))  # Where the machine actually is
+        self.model = ProgramModel(self.settings, self.position)  # Where the parser has planned up to
+
+    def _startup_messages(self):
+        if self.state == "Alarm":
+            self._reply("[MSG:'$H'|'$X' to unlock]")
+
+    def _reply(self, line):
+        self._tx.append(f"{line}\r\n".encode())
+        self._cond.notify_all()
+
+    def _position(self, now):
+        if self._block is None:
+            return list(self.position)
+        elapsed = (self._hold_started if self._hold_started is not None else now) - self._block_started
+        return self._block.position_at(distance_at(self._block, elapsed))
+
+    def _status(self, now):
+        pos = self._position(now)
+        state = "Hold:0" if self._hold_started is not None else self.state
+        speed = 0
+        if self._block is not None and self._hold_started is None:
+            speed = self._block.nominal_speed * 60
+        planner_free = self.PLANNER_SIZE - len(self._planner) - (self._block is not None)
+        rx_free = self.RX_BUFFER_SIZE - len(self._rx)
+        buffers = f"|Bf:{planner_free},{rx_free}" if int(self.settings.get(10, 0)) & 2 else ""  # Only with $10 bit 1
+        return f"<{state}|MPos:{pos[0]:.3f},{pos[1]:.3f},{pos[2]:.3f}{buffers}|FS:{speed:.0f},0>"
+
+    def _raise_alarm(self, code):
+        self.state = "Alarm"
+        self.alarm = code
+        self.stats["alarms"] += 1
+        self._reply(f"ALARM:{code}")
+
+    # Realtime commands
+
+    def _feed_hold(self, now):
+        if self._block is not None and self._hold_started is None:
+            self._hold_started = now
+            self.state = "Hold"
+
+    def _cycle_start(self, now):
+        if self._hold_started is not None:
+            self._block_started += now - self._hold_started
+            self._hold_started = None
+            self.state = "Run"
+
+    def _soft_reset(self, now):
+        moving = self._block is not None or self._busy_until is not None
+        self.position = self._position(now)
+        self._boot()
+        if moving:
+            # Position is lost when a reset interrupts motion
+            self._raise_alarm(3)
+        self._reply(self.BANNER)
+        self._startup_messages()
+
+    # Emulator loop
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self.is_open:
+                    break
+                now = self.clock.now()
+                try:
+                    self._receive(now)
+                    self._advance(now)
+                    self._parse(now)
+                except Exception:
+                    # Keep the port alive so the host sees the alarm instead of hanging on an ack
+                    traceback.print_exc()
+                    self._rx.clear()
+                    self._planner.clear()
+                    self._line_blocks.clear()
+                    self._block = self._busy_until = None
+                    self._raise_alarm(1)
+            time.sleep(self.TICK)
+
+    def _receive(self, now):
+        while self._wire and self._wire[0][0] <= now:
+            _, data = self._wire.popleft()
+            room = self.RX_BUFFER_SIZE - len(self._rx)
+            if len(data) > room:
+                self.stats["rx_overflows"] += len(data) - room
+            self._rx += data[:max(room, 0)]
+
+    def _advance(self, now):
+        if self._hold_started is not None:
+            return
+        while self._block is not None and now >= self._block_started + self._block_duration:
+            finished_at = self._block_started + self._block_duration
+            exit_speed = self._block.exit_speed
+            self.position = list(self._block.target)
+            self._block = None
+            self._start_next_block(finished_at, exit_speed)
+        if self._block is None and self._busy_until is None and self.state == "Run":
+            self.state = "Idle"
+        if self._busy_until is not None and now >= self._busy_until:
+            self._busy_until = None
+            done, self._busy_done = self._busy_done, None
+            if done:
+                done()
+
+    def _start_next_block(self, at, entry_speed=0.0):
+        if not self._planner:
+            return
+        plan(list(self._planner), entry_speed)
+        self._block = self._planner.popleft()
+        self._block_started = at
+        self._block_duration = block_time(self._block)
+        self.stats["blocks"] += 1
+        if self.state == "Idle":
+            self.state = "Run"
+
+    def _parse(self, now):
+        while True:
+            if self._busy_until is not None:
+                return
+            if self._line_blocks:
+                if not self._queue_blocks(now):
+                    return
+                self._reply("ok")
+                continue
+            if b"\n" not in self._rx:
+                return
+            raw, _, rest = bytes(self._rx).partition(b"\n")
+            self._rx = bytearray(rest)
+            line = raw.decode(errors="replace").strip()
+            self.stats["lines"] += 1
+            if self.state == "Sleep":
+                continue
+            self._execute(line, now)
+
+    def _queue_blocks(self, now):
+        """Move the current line's blocks into the planner, False while it's full."""
+        while self._line_blocks:
+            if len(self._planner) + (self._block is not None) >= self.PLANNER_SIZE:
+                return False
+            block = self._line_blocks.popleft()
+            link(self._planner[-1] if self._planner else self._block, block, self.settings)
+            self._planner.append(block)
+            if self._block is None and self._hold_started is None:
+                self._start_next_block(now)
+        return True
+
+    def _error(self, code):
+        self.stats["errors"] += 1
+        self._reply(f"error:{code}")
+
+    def _is_idle(self):
+        return self._block is None and not self._planner and self._busy_until is None
+
+    def _execute(self, line, now):
+        if not line:
+            self._reply("ok")
+        elif line.startswith("$"):
+            self._execute_system(line.upper(), now)
+        elif self.state == "Alarm":
+            self._error(9)  # G-code locked out during alarm
+        else:
+            try:
+                blocks = self.model.blocks_for(line)
+            except GcodeError as ex:
+                return self._error(ex.code)
+            except ValueError:
+                return self._error(2)
+            if isinstance(blocks, tuple):  # G4 dwell, waits for the planner to empty first
+                remaining = sum(block_time(b) for b in self._planner)
+                if self._block is not None:
+                    remaining += self._block_started + self._block_duration - now
+                self._busy(now + max(remaining, 0) + blocks[1], lambda: self._reply("ok"))
+                return
+            if not self._soft_limits_ok():
+                return
+            self._line_blocks.extend(blocks)
+            if self._queue_blocks(now):
+                self._reply("ok")
+
+    def _soft_limits_ok(self):
+        # This machine homes to its origin and works in positive machine space (0 to $13x)
+        if not self.settings.get(20):
+            return True
+        for i in range(3):
+            if not -0.001 <= self.model.position[i] <= self.settings.get(130 + i, 0) + 0.001:
+                self._raise_alarm(2)
+                self._planner.clear()
+                self._line_blocks.clear()
+                return False
+        return True
+
+    def _busy(self, until, done=None):
+        self._busy_until = until
+        self._busy_done = done
+
+    def _execute_system(self, line, now):
+        if line == "$$":
+            for num in sorted(self.settings):
+                self._reply(format_setting(num, self.settings[num]))
+            self._reply("ok")
+        elif line == "$X":
+            if self.state == "Alarm":
+                self._reply("[MSG:Caution: Unlocked]")
+                self.state = "Idle"
+                self.alarm = None
+            self._reply("ok")
+        elif line.startswith("$H"):
+            self._home(line[2:] or "ZXY", now)
+        elif line == "$SLP":
+            self._reply("ok")
+            self._reply("[MSG:Sleeping]")
+            self.state = "Sleep"
+        elif line == "$G":
+            motion = f"G{self.model.motion}"
+            dist = "G90" if self.model.absolute else "G91"
+            self._reply(f"[GC:{motion} G54 G17 G21 {dist} G94 M5 M9 T0 F{self.model.feed:g} S0]")
+            self._reply("ok")
+        elif line == "$#":
+            offset = self.model.offset
+            self._reply("[G54:0.000,0.000,0.000]")
+            self._reply(f"[G92:{offset[0]:.3f},{offset[1]:.3f},{offset[2]:.3f}]")
+            self._reply("ok")
+        elif line == "$I":
+            self._reply(f"[VER:{self.VERSION}.emulated:]")
+            self._reply("[OPT:V,15,128]")
+            self._reply("ok")
+        elif "=" in line:
+            num, _, value = line[1:].partition("=")
+            try:
+                num, value = int(num), float(value)
+            except ValueError:
+                return self._error(3)
+            if num not in SETTING_TYPES:
+                return self._error(3)
+            if not self._is_idle():
+                return self._error(8)
+            kind = SETTING_TYPES[num][1]
+            self.settings[num] = bool(value) if kind is bool else int(value) if kind is int else value
+            self._reply("ok")
+        else:
+            self._error(3)
+
+    def _home(self, axes, now):
+        if not self.settings.get(22):
+            return self._error(5)  # Homing not enabled
+        if not self._is_idle():
+            return self._error(8)
+        self.state = "Home"
+        duration = 0
+        seek, feed = self.settings.get(25, 500) / 60, self.settings.get(24, 25) / 60
+        pull_off = self.settings.get(27, 1)
+        for axis in axes:
+            i = "XYZ".index(axis)
+            # Seek to the switch, pull off, locate slowly, pull off again
+            duration += abs(self.position[i]) / seek + 3 * pull_off / feed + self.settings.get(26, 250) / 1000
+
+        def done():
+            for axis in axes:
+                self.position["XYZ".index(axis)] = 0
+                self.model.position["XYZ".index(axis)] = 0
+            self.state = "Idle"
+            self._reply("ok")
+        self._busy(now + duration, done)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve an emulated GRBL controller on a pty.")
+    parser.add_argument("--scale", type=float, default=1, help="Virtual time speed-up")
+    parser.add_argument("--settings", default=DEFAULT_PROFILE, help="GRBL settings profile to boot with")
+    args = parser.parse_args()
+
+    emulator = GrblEmulator(load_profile(args.settings), VirtualClock(args.scale))
+    print(f"Emulated GRBL on {emulator.attach_pty()} (x{args.scale:g} time)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.close()
+
+if __name__ == "__main__":
+    main()
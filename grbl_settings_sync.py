@@ -0,0 +1,143 @@
+import re
+
+# GRBL 1.1 settings: number -> (name, type)
+SETTING_TYPES = {
+    0: ("step_pulse_us", int),
+    1: ("step_idle_delay_ms", int),
+    2: ("step_port_invert_mask", int),
+    3: ("direction_port_invert_mask", int),
+    4: ("step_enable_invert", bool),
+    5: ("limit_pins_invert", bool),
+    6: ("probe_pin_invert", bool),
+    10: ("status_report_mask", int),
+    11: ("junction_deviation_mm", float),
+    12: ("arc_tolerance_mm", float),
+    13: ("report_inches", bool),
+    20: ("soft_limits", bool),
+    21: ("hard_limits", bool),
+    22: ("homing_cycle", bool),
+    23: ("homing_dir_invert_mask", int),
+    24: ("homing_feed_mm_min", float),
+    25: ("homing_seek_mm_min", float),
+    26: ("homing_debounce_ms", int),
+    27: ("homing_pull_off_mm", float),
+    30: ("max_spindle_rpm", float),
+    31: ("min_spindle_rpm", float),
+    32: ("laser_mode", bool),
+    100: ("x_steps_per_mm", float),
+    101: ("y_steps_per_mm", float),
+    102: ("z_steps_per_mm", float),
+    110: ("x_max_rate_mm_min", float),
+    111: ("y_max_rate_mm_min", float),
+    112: ("z_max_rate_mm_min", float),
+    120: ("x_accel_mm_s2", float),
+    121: ("y_accel_mm_s2", float),
+    122: ("z_accel_mm_s2", float),
+    130: ("x_max_travel_mm", float),
+    131: ("y_max_travel_mm", float),
+    132: ("z_max_travel_mm", float),
+}
+AXES = "xyz"
+
+_SETTING_RE = re.compile(r"^\$(\d+)\s*=\s*([-+]?[\d.]+)")
+
+def parse_settings(lines):
+    """Parse `$n=value` lines (from a `$$` report or a profile file) into {n: value}, ignoring everything else."""
+    values = {}
+    for line in lines:
+        match = _SETTING_RE.match(line.strip())
+        if match:
+            num = int(match.group(1))
+            kind = SETTING_TYPES.get(num, (None, float))[1]
+            value = float(match.group(2))
+            values[num] = bool(value) if kind is bool else kind(value) if kind is int else value
+    return values
+
+def load_profile(filepath):
+    with open(filepath) as src:
+        return parse_settings(src.readlines())
+
+def format_setting(num, value):
+    if isinstance(value, float):
+        return f"${num}={value:.3f}"
+    return f"${num}={int(value)}"
+
+def values_equal(a, b):
+    # GRBL reports floats to 3 decimal places
+    return round(float(a), 3) == round(float(b), 3)
+
+class GrblSettings:
+    """Typed, read-only view of a parsed `$$` table, shared with anything that needs machine limits."""
+
+    def __init__(self, values):
+        self.values = dict(values)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.number(key)
+        return self.values[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    @staticmethod
+    def number(name):
+        for num, (setting_name, _) in SETTING_TYPES.items():
+            if setting_name == name:
+                return num
+        raise KeyError(name)
+
+    def steps_per_mm(self, axis):
+        return self.values[100 + AXES.index(axis.lower())]
+
+    def max_rate(self, axis):
+        return self.values[110 + AXES.index(axis.lower())]
+
+    def accel(self, axis):
+        return self.values[120 + AXES.index(axis.lower())]
+
+    def max_travel(self, axis):
+        return self.values[130 + AXES.index(axis.lower())]
+
+    def diff(self, profile):
+        """{n: (current, wanted)} for every profile setting that doesn't match this table."""
+        return {
+            num: (self.values.get(num), wanted)
+            for num, wanted in profile.items()
+            if num not in self.values or not values_equal(self.values[num], wanted)
+        }
+
+class SettingsSync:
+    """Reads `$$` once, writes only the settings that differ from a profile, then verifies them."""
+
+    READ_SETTINGS = "$$"
+
+    def __init__(self, ser):
+        self.ser = ser
+
+    def read(self):
+        resps = self.ser.send(self.READ_SETTINGS, True)
+        return GrblSettings(parse_settings(resps or []))
+
+    def sync(self, profile, current=None):
+        """
+            Bring the controller in line with `profile`.
+
+            :returns: (settings, written, failed) - the verified table, {n: value} written, {n: (read back, wanted)} that didn't stick
+        """
+        current = current or self.read()
+        changes = current.diff(profile)
+        written = {num: wanted for num, (_, wanted) in changes.items()}
+        if not written:
+            return current, {}, {}
+
+        # GRBL stalls (and can drop serial bytes) while each one is burnt to EEPROM, so they go one per ok
+        for num, value in written.items():
+            self.ser.send(format_setting(num, value), True)
+        verified = self.read()
+        failed = {num: (verified.get(num), wanted) for num, wanted in written.items()
+                  if verified.get(num) is None or not values_equal(verified[num], wanted)}
+        return verified, written, failed
@@ -0,0 +1,389 @@
+"""
+Hardware backends for the GPIO, PWM and serial the Machine drives.
+
+Backends share RPi.GPIO's interface (setmode/setup/output/input/PWM) so Machine doesn't care which one it has.
+"sim" records every pin edge and PWM change against a clock that can run faster than real time.
+The peener's PWM can instead come from the Pi's PWM peripheral through the kernel's sysfs interface, see SysfsPwm.
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+import collections
+
+class Clock:
+    """Real time."""
+    scale = 1
+
+    def now(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    async def sleep_async(self, seconds):
+        await asyncio.sleep(seconds)
+
+class VirtualClock(Clock):
+    """
+        Runs `scale` times faster than real time, `now()` and every sleep are in virtual seconds.
+
+        Timestamps stay accurate to the host's scheduling jitter multiplied by `scale`, so keep
+        the scale modest when profiling sub-millisecond events like tray steps.
+    """
+
+    def __init__(self, scale=1.0):
+        self.scale = float(scale)
+        self._start = time.monotonic()
+
+    def now(self):
+        return (time.monotonic() - self._start) * self.scale
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.scale)
+
+    async def sleep_async(self, seconds):
+        await asyncio.sleep(seconds / self.scale)
+
+class GpioBackend:
+    BCM = "BCM"
+    BOARD = "BOARD"
+    IN = "IN"
+    OUT = "OUT"
+    HIGH = 1
+    LOW = 0
+
+    def setmode(self, mode):
+        raise NotImplementedError()
+
+    def setup(self, pin, direction):
+        raise NotImplementedError()
+
+    def output(self, pin, value):
+        raise NotImplementedError()
+
+    def input(self, pin):
+        raise NotImplementedError()
+
+    def PWM(self, pin, frequency):
+        raise NotImplementedError()
+
+    def cleanup(self):
+        pass
+
+class RpiGpioBackend(GpioBackend):
+    """The Pi's GPIO through RPi.GPIO, only importable on a Pi."""
+
+    def __init__(self):
+        import RPi.GPIO
+        self._gpio = RPi.GPIO
+        self.BCM, self.BOARD = RPi.GPIO.BCM, RPi.GPIO.BOARD
+        self.IN, self.OUT = RPi.GPIO.IN, RPi.GPIO.OUT
+        self.HIGH, self.LOW = RPi.GPIO.HIGH, RPi.GPIO.LOW
+
+    def setmode(self, mode):
+        self._gpio.setmode(mode)
+
+    def setup(self, pin, direction):
+        self._gpio.setup(pin, direction)
+
+    def output(self, pin, value):
+        self._gpio.output(pin, value)
+
+    def input(self, pin):
+        return self._gpio.input(pin)
+
+    def PWM(self, pin, frequency):
+        return self._gpio.PWM(pin, frequency)
+
+    def cleanup(self):
+        self._gpio.cleanup()
+
+class SimulatedGpioBackend(GpioBackend):
+    """Records every pin edge and PWM change as (time, pin, kind, value) against `clock`."""
+
+    def __init__(self, clock=None, max_events=1_000_000):
+        self.clock = clock or Clock()
+        self.events = collections.deque(maxlen=max_events)
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.inputs = {}  # pin -> value, or callable(time) -> value
+        self._lock = threading.Lock()
+
+    def _record(self, pin, kind, value):
+        with self._lock:
+            self.events.append((self.clock.now(), pin, kind, value))
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction):
+        self.directions[pin] = direction
+        self._record(pin, "setup", direction)
+
+    def output(self, pin, value):
+        value = int(bool(value))
+        if self.levels.get(pin) != value:
+            self.levels[pin] = value
+            self._record(pin, "edge", value)
+
+    def input(self, pin):
+        value = self.inputs.get(pin, self.HIGH)
+        return value(self.clock.now()) if callable(value) else value
+
+    def set_input(self, pin, value):
+        self.inputs[pin] = value
+
+    def PWM(self, pin, frequency):
+        return SimulatedPwm(self, pin, frequency)
+
+    def edges(self, pin):
+        return [(t, value) for t, p, kind, value in self.events if p == pin and kind == "edge"]
+
+    def pwm_changes(self, pin):
+        return [(t, value) for t, p, kind, value in self.events if p == pin and kind.startswith("pwm")]
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+
+    def save(self, filepath):
+        with open(filepath, "w+") as out:
+            json.dump([list(e) for e in self.events], out)
+
+class SimulatedPwm:
+    def __init__(self, gpio, pin, frequency):
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = None
+        self.gpio._record(pin, "pwm_freq", frequency)
+
+    def start(self, duty):
+        self.ChangeDutyCycle(duty)
+
+    def ChangeDutyCycle(self, duty):
+        if duty != self.duty:
+            self.duty = duty
+            self.gpio._record(self.pin, "pwm_duty", duty)
+
+    def ChangeFrequency(self, frequency):
+        if frequency != self.frequency:
+            self.frequency = frequency
+            self.gpio._record(self.pin, "pwm_freq", frequency)
+
+    def stop(self):
+        self.ChangeDutyCycle(0)
+
+class SysfsPwm:
+    """
+        Hardware PWM through the kernel's sysfs interface, with RPi.GPIO's PWM interface on top.
+
+        Needs the PWM overlay (e.g. `dtoverlay=pwm,pin=12,func=4` in /boot/config.txt) so the pin is routed to
+        the PWM peripheral. The duty cycle is timed in hardware, unlike RPi.GPIO's software PWM thread it doesn't
+        jitter under CPU load.
+    """
+
+    ROOT = "/sys/class/pwm"
+    EXPORT_TIMEOUT = 1  # Seconds to wait for udev to make a freshly exported channel writable
+
+    def __init__(self, chip, channel, frequency, root=ROOT):
+        self.path = os.path.join(root, f"pwmchip{chip}", f"pwm{channel}")
+        if not os.path.isdir(self.path):
+            self._write(os.path.join(root, f"pwmchip{chip}", "export"), channel)
+            deadline = time.monotonic() + self.EXPORT_TIMEOUT
+            while not os.access(os.path.join(self.path, "period"), os.W_OK) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.frequency = None
+        self.duty = 0
+        self.enabled = False
+        self.ChangeFrequency(frequency)
+
+    @staticmethod
+    def _write(filepath, value):
+        with open(filepath, "w") as out:
+            out.write(str(value))
+
+    def _set(self, attr, value):
+        self._write(os.path.join(self.path, attr), value)
+
+    def _period(self):
+        return round(1e9 / self.frequency)  # ns
+
+    def start(self, duty):
+        self.ChangeDutyCycle(duty)
+        if not self.enabled:
+            self._set("enable", 1)
+            self.enabled = True
+
+    def ChangeDutyCycle(self, duty):
+        self.duty = duty
+        self._set("duty_cycle", round(self._period() * duty / 100))
+
+    def ChangeFrequency(self, frequency):
+        if frequency == self.frequency:
+            return
+        # The kernel refuses a period shorter than the current duty cycle, so clear it first
+        self._set("duty_cycle", 0)
+        self.frequency = frequency
+        self._set("period", self._period())
+        self.ChangeDutyCycle(self.duty)
+
+    def stop(self):
+        self._set("enable", 0)
+        self.enabled = False
+
+class SimulatedSerial:
+    """
+        Minimal in-process stand-in for a GRBL port with pyserial's interface.
+
+        Acks every line, answers status queries as Idle and prints the banner on open and on reset.
+    """
+
+    BANNER = "Grbl 1.1h ['$' for help]"
+
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
+        self.port = None
+        self.baudrate = 115200
+        self.timeout = None
+        self.is_open = False
+        self.log = []  # (time, direction, data)
+        self._out = collections.deque()
+        self._lock = threading.Condition()
+
+    def open(self):
+        self.is_open = True
+        self._reply(self.BANNER)
+
+    def close(self):
+        self.is_open = False
+
+    @property
+    def in_waiting(self):
+        return sum(len(e) for e in self._out)
+
+    def reset_input_buffer(self):
+        with self._lock:
+            self._out.clear()
+
+    def write(self, data):
+        self.log.append((self.clock.now(), "tx", data))
+        text = data.decode()
+        for char in text:
+            if char == "\x18":
+                self._reply(self.BANNER)
+            elif char == "?":
+                self._reply("<Idle|MPos:0.000,0.000,0.000|FS:0,0>")
+        for realtime in "\x18?!~":
+            text = text.replace(realtime, "")
+        for line in text.splitlines():
+            if line.strip():
+                self._reply("ok")
+        return len(data)
+
+    def _reply(self, line):
+        with self._lock:
+            self._out.append((line + "\r\n").encode())
+            self._lock.notify_all()
+
+    def readline(self):
+        with self._lock:
+            if not self._out:
+                self._lock.wait(self.timeout)
+            if not self._out:
+                return b""
+            line = self._out.popleft()
+        self.log.append((self.clock.now(), "rx", line))
+        return line
+
+GPIO_BACKENDS = ("auto", "rpi", "sim")
+SERIAL_BACKENDS = ("auto", "serial", "sim", "emu", "replay")
+PWM_BACKENDS = ("auto", "gpio", "sysfs")
+
+HARDWARE_PWM_CHANNELS = {12: (0, 0), 18: (0, 0), 13: (0, 1), 19: (0, 1)}  # BCM pin -> (pwmchip, channel)
+
+def resolve_gpio_backend(backend):
+    """'auto' picks the Pi's GPIO when RPi.GPIO is importable, otherwise the simulator."""
+    if backend not in GPIO_BACKENDS:
+        raise ValueError(f"Unknown GPIO backend: {backend}")
+    if backend == "auto":
+        try:
+            import RPi.GPIO
+            return "rpi"
+        except (ImportError, RuntimeError):
+            return "sim"
+    return backend
+
+def resolve_serial_backend(backend):
+    """'auto' is a real serial port, the controller can be plugged into any host."""
+    if backend not in SERIAL_BACKENDS:
+        raise ValueError(f"Unknown serial backend: {backend}")
+    return "serial" if backend == "auto" else backend
+
+def pin_function(pin):
+    """
+        What BCM `pin` is muxed to as reported by `pinctrl` (or `raspi-gpio` on older images), e.g.
+        "GPIO12 = PWM0_0", None when neither tool is there to ask.
+    """
+    import subprocess
+    for command in (["pinctrl", "get", str(pin)], ["raspi-gpio", "get", str(pin)]):
+        try:
+            return subprocess.run(command, capture_output=True, text=True, timeout=2, check=True).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            continue
+    return None
+
+def resolve_pwm_backend(backend, gpio_backend, pin):
+    """
+        'auto' picks hardware PWM on a Pi when `pin` has a PWM channel the kernel has exposed and the pin is muxed
+        to it, otherwise the GPIO backend's own PWM. A pwmchip alone isn't enough, audio and other overlays expose
+        one too, and with the pin still a GPIO the peener would never run. The simulated GPIO backend stands in for both.
+    """
+    if backend not in PWM_BACKENDS:
+        raise ValueError(f"Unknown PWM backend: {backend}")
+    if gpio_backend == "sim":
+        return "gpio"
+    if backend == "auto":
+        chip = HARDWARE_PWM_CHANNELS.get(pin, (None,))[0]
+        if chip is None or not os.path.isdir(os.path.join(SysfsPwm.ROOT, f"pwmchip{chip}")):
+            return "gpio"
+        return "sysfs" if "PWM" in (pin_function(pin) or "") else "gpio"
+    if backend == "sysfs" and pin not in HARDWARE_PWM_CHANNELS:
+        raise ValueError(f"BCM {pin} has no hardware PWM channel")
+    return backend
+
+def make_clock(gpio_backend, serial_backend, time_scale=1):
+    if (gpio_backend == "sim" or serial_backend in ("sim", "emu", "replay")) and time_scale != 1:
+        return VirtualClock(time_scale)
+    return Clock()
+
+def make_gpio(backend, clock=None):
+    return RpiGpioBackend() if backend == "rpi" else SimulatedGpioBackend(clock)
+
+def make_pwm(backend, gpio, pin, frequency):
+    """The PWM output on `pin`, the GPIO backend's when `backend` is 'gpio' (the caller sets the pin up as an output)."""
+    if backend == "sysfs":
+        return SysfsPwm(*HARDWARE_PWM_CHANNELS[pin], frequency)
+    return gpio.PWM(pin, frequency)
+
+def make_serial(backend, clock=None, replay_fp=None, record_dir=None):
+    """The transport for `backend`, wrapped to record every session into `record_dir` when given."""
+    if backend == "serial":
+        import serial
+        transport = serial.Serial()
+    elif backend == "emu":
+        from grbl_emulator import GrblEmulator
+        transport = GrblEmulator(clock=clock)
+    elif backend == "replay":
+        from serial_session import ReplaySerial
+        transport = ReplaySerial(replay_fp, clock)
+    else:
+        transport = SimulatedSerial(clock)
+    if record_dir:
+        from serial_session import RecordingSerial
+        transport = RecordingSerial(transport, record_dir, clock)
+    return transport
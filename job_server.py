@@ -0,0 +1,318 @@
+"""
+Local HTTP/WebSocket API for submitting jobs to a MachineFarm and watching them run.
+
+    GET    /status      Machines, their last progress/status/position and the queue
+    GET    /jobs        Every job this server has seen
+    GET    /jobs/<id>
+    POST   /jobs        {"name": ..., "paths": [[[x, y], ...], ...]} or {"gcode": "..."}, or a text/plain program
+    DELETE /jobs/<id>   Cancel a job that hasn't started
+    GET    /events      WebSocket of {"type": ..., "machine": ..., ...} events
+
+The server runs its own asyncio loop on its own thread, Machine's signals are handed over with
+call_soon_threadsafe and slow WebSocket clients lose their oldest events rather than holding anything up.
+It binds to localhost only, there's no authentication.
+
+    python job_server.py --emulate 2 --port 8765  # Headless, against emulated controllers
+"""
+
+import sys
+import json
+import base64
+import struct
+import asyncio
+import hashlib
+import argparse
+import threading
+import traceback
+
+from PyQt5.QtCore import Qt
+
+from farm import add_machine_arguments, farm_from_args
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_BODY = 64 * 1024 * 1024  # A million point design is about 40 MB of JSON
+CLIENT_QUEUE = 256  # Events buffered per WebSocket client before the oldest are dropped
+
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def job_info(job):
+    return {
+        "id": job.id,
+        "name": job.name,
+        "state": job.state,
+        "machine": job.machine,
+        "estimate": job.estimate,
+        "queued_at": job.queued_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+def parse_design(body, content_type):
+    """(paths, gcode, name) from a request body, exactly one of paths or gcode is set."""
+    if content_type.startswith("text/plain"):
+        return None, body.decode(), None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HttpError(400, "Body is not JSON")
+    if isinstance(data, list):  # A design file as saved by the canvas
+        data = {"paths": data}
+    if not isinstance(data, dict):
+        raise HttpError(400, "Expected a design object")
+    paths, gcode = data.get("paths"), data.get("gcode")
+    if (paths is None) == (gcode is None):
+        raise HttpError(400, "Give either paths or gcode")
+    if paths is not None:
+        if not paths or not all(
+            isinstance(path, list) and path and all(isinstance(pt, list) and len(pt) == 2 for pt in path)
+            for path in paths
+        ):
+            raise HttpError(400, "paths must be a list of non-empty lists of [x, y] points")
+    elif not isinstance(gcode, (str, list)):
+        raise HttpError(400, "gcode must be a string or a list of lines")
+    return paths, gcode, data.get("name")
+
+class _Client:
+    def __init__(self):
+        self.queue = asyncio.Queue(CLIENT_QUEUE)
+
+    def put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()  # Drop the oldest, a live view only cares about the latest
+        self.queue.put_nowait(message)
+
+class JobServer:
+    def __init__(self, farm, host="127.0.0.1", port=8765):
+        self.farm = farm
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.machine_state = {name: {} for name in farm.machines}  # Last progress/status/position of each machine
+        self._clients = set()
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+        for name, farm_machine in farm.machines.items():
+            # Direct connections, _publish is thread safe and there may be no Qt event loop to queue to
+            machine = farm_machine.machine
+            machine.report_routine_progress.connect(lambda v, n=name: self._publish("progress", n, progress=v), Qt.DirectConnection)
+            machine.report_routine_status.connect(lambda v, n=name: self._publish("status", n, status=v), Qt.DirectConnection)
+            machine.report_machine_position.connect(lambda v, n=name: self._publish("position", n, position=list(v)), Qt.DirectConnection)
+        farm.on_change.append(self._on_farm_change)
+
+    # Lifecycle
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="job-server", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port, limit=MAX_BODY))
+        self._ready.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        if self.loop is None:
+            return
+        async def close():
+            self._server.close()
+            await self._server.wait_closed()
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(5)
+
+    # Events, called from machine and farm threads
+
+    def _publish(self, kind, machine, **data):
+        message = dict(type=kind, machine=machine, **data)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._broadcast, message)
+
+    def _on_farm_change(self, event, item):
+        if hasattr(item, "paths"):
+            self._publish("job", item.machine, event=event, job=job_info(item))
+        else:
+            self._publish("machine", item.name, event=event)
+
+    def _broadcast(self, message):
+        if message["type"] in ("progress", "status", "position"):
+            self.machine_state.setdefault(message["machine"], {})[message["type"]] = message[message["type"]]
+        text = json.dumps(message)
+        for client in self._clients:
+            client.put(text)
+
+    # HTTP
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, headers = await self._read_head(reader)
+            if path == "/events" and headers.get("upgrade", "").lower() == "websocket":
+                await self._websocket(reader, writer, headers)
+                return
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY:
+                raise HttpError(413, "Body too large")
+            body = await reader.readexactly(length) if length else b""
+            status, result = await self._try_route(method, path, body, headers.get("content-type", "application/json"))
+        except HttpError as ex:
+            status, result = ex.status, {"error": str(ex)}
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            writer.close()
+            return
+        self._respond(writer, status, result)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _read_head(self, reader):
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        method, path, _ = head[0].split(" ", 2)
+        headers = {}
+        for line in head[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        return method, path.split("?")[0].rstrip("/") or "/", headers
+
+    def _respond(self, writer, status, result):
+        body = json.dumps(result).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+
+    async def _try_route(self, method, path, body, content_type):
+        # Errors become JSON responses, the connection is only dropped when the request itself can't be read
+        try:
+            return await self._route(method, path, body, content_type)
+        except HttpError as ex:
+            return ex.status, {"error": str(ex)}
+        except (ValueError, TypeError, KeyError) as ex:
+            return 400, {"error": f"{type(ex).__name__}: {ex}"}  # e.g. a design the farm couldn't compile
+        except Exception as ex:
+            traceback.print_exc()
+            return 500, {"error": f"{type(ex).__name__}: {ex}"}
+
+    async def _route(self, method, path, body, content_type):
+        parts = path.strip("/").split("/")
+        if parts == ["status"] and method == "GET":
+            status = self.farm.status()
+            for name, state in self.machine_state.items():
+                status["machines"].get(name, {}).update(state)
+            return 200, status
+        if parts == ["jobs"]:
+            if method == "GET":
+                return 200, [job_info(job) for job in self.farm.jobs]
+            if method == "POST":
+                paths, gcode, name = parse_design(body, content_type)
+                # Estimating a large design takes a while, keep it off the server's loop
+                job = await self.loop.run_in_executor(None, lambda: self.farm.submit(paths, name, gcode))
+                return 201, job_info(job)
+            raise HttpError(405, "Use GET or POST")
+        if len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            job = next((j for j in self.farm.jobs if j.id == int(parts[1])), None)
+            if job is None:
+                raise HttpError(404, "No such job")
+            if method == "GET":
+                return 200, job_info(job)
+            if method == "DELETE":
+                if not self.farm.cancel(job):
+                    raise HttpError(400, f"Job is {job.state}, only queued jobs can be cancelled")
+                return 200, job_info(job)
+            raise HttpError(405, "Use GET or DELETE")
+        raise HttpError(404, "Not found")
+
+    # WebSocket
+
+    async def _websocket(self, reader, writer, headers):
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WS_GUID).encode()).digest()).decode()
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode()
+        )
+        client = _Client()
+        client.put(json.dumps({"type": "snapshot", "machines": self.machine_state, **self.farm.status()}))
+        self._clients.add(client)
+        receiver = asyncio.ensure_future(self._ws_receive(reader, writer))
+        try:
+            while not receiver.done():
+                getter = asyncio.ensure_future(client.queue.get())
+                done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    break
+                self._ws_send(writer, 0x1, getter.result().encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(client)
+            receiver.cancel()
+            writer.close()
+
+    async def _ws_receive(self, reader, writer):
+        # Clients only ever need to ping or close, anything they send otherwise is ignored
+        try:
+            await self._ws_read_frames(reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # Gone without a close frame
+
+    async def _ws_read_frames(self, reader, writer):
+        while True:
+            head = await reader.readexactly(2)
+            opcode, length = head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await reader.readexactly(8))[0]
+            mask = await reader.readexactly(4) if head[1] & 0x80 else b"\0\0\0\0"
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+            if opcode == 0x8:
+                self._ws_send(writer, 0x8, payload[:2])
+                return
+            if opcode == 0x9:
+                self._ws_send(writer, 0xA, payload)
+
+    def _ws_send(self, writer, opcode, payload):
+        n = len(payload)
+        if n < 126:
+            head = struct.pack("!BB", 0x80 | opcode, n)
+        elif n < 1 << 16:
+            head = struct.pack("!BBH", 0x80 | opcode, 126, n)
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+        writer.write(head + payload)
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless job API")
+    parser.add_argument("--port", type=int, default=8765)
+    add_machine_arguments(parser)
+    args = parser.parse_args()
+
+    farm = farm_from_args(parser, args)
+    server = JobServer(farm, port=args.port).start()
+    print(f"Listening on http://{server.host}:{server.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        farm.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Job telemetry: every routine run is recorded to a local SQLite database, with a reporting CLI.
+
+    python job_telemetry.py                        # Everything recorded so far
+    python job_telemetry.py --since 2026-10-01 --until 2026-10-08 --slowest 10
+"""
+
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import datetime
+
+DEFAULT_DB = "jobs.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    routine TEXT NOT NULL,
+    started REAL NOT NULL,       -- Unix time
+    finished REAL NOT NULL,      -- Unix time
+    duration REAL NOT NULL,      -- Seconds on the machine's clock
+    outcome TEXT NOT NULL,       -- completed, cancelled or error
+    design_hash TEXT,
+    n_paths INTEGER,
+    n_points INTEGER,
+    lines INTEGER,
+    errors INTEGER,
+    alarms INTEGER,
+    prompts INTEGER,
+    prompt_wait REAL,
+    settings TEXT
+);
+CREATE TABLE IF NOT EXISTS phases (
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    seq INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_started ON jobs(started);
+"""
+
+def design_hash(paths):
+    return hashlib.sha1(json.dumps(paths, separators=(",", ":")).encode()).hexdigest()[:12]
+
+class JobRecord:
+    """Collects one run as it happens, timed on `clock` so simulated runs record virtual durations."""
+
+    def __init__(self, routine, clock, settings=None, counters=None):
+        self.routine = routine
+        self.clock = clock
+        self.started = time.time()
+        self.start = clock.now()
+        self.finished = None
+        self.duration = None
+        self.outcome = "completed"
+        self.settings = dict(settings or {})
+        self.design_hash = None
+        self.n_paths = None
+        self.n_points = None
+        self.prompts = 0
+        self.prompt_wait = 0
+        self.phases = []  # [name, start, duration]
+        self._counters = dict(counters or {})  # Serial counters when the job started
+        self.lines = self.errors = self.alarms = 0
+
+    def set_design(self, paths):
+        self.design_hash = design_hash(paths)
+        self.n_paths = len(paths)
+        self.n_points = sum(len(path) for path in paths)
+
+    def phase(self, name):
+        """Start a new phase, ending the previous one."""
+        now = self.clock.now()
+        self._end_phase(now)
+        self.phases.append([name, now, None])
+
+    def _end_phase(self, now):
+        if self.phases and self.phases[-1][2] is None:
+            self.phases[-1][2] = now - self.phases[-1][1]
+
+    def prompt_waited(self, seconds):
+        self.prompts += 1
+        self.prompt_wait += seconds
+
+    def finish(self, counters=None):
+        now = self.clock.now()
+        self._end_phase(now)
+        self.duration = now - self.start
+        self.finished = time.time()
+        counters = counters or {}
+        self.lines = counters.get("lines_tx", 0) - self._counters.get("lines_tx", 0)
+        self.errors = counters.get("errors", 0) - self._counters.get("errors", 0)
+        self.alarms = counters.get("alarms", 0) - self._counters.get("alarms", 0)
+
+class JobStore:
+    def __init__(self, filepath=DEFAULT_DB):
+        self.filepath = filepath
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        # A connection per call, jobs finish on the machine loop while reports run anywhere else
+        return sqlite3.connect(self.filepath)
+
+    def save(self, record):
+        with self._connect() as db:
+            cur = db.execute(
+                "INSERT INTO jobs (routine, started, finished, duration, outcome, design_hash, n_paths, n_points,"
+                " lines, errors, alarms, prompts, prompt_wait, settings) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (record.routine, record.started, record.finished, record.duration, record.outcome, record.design_hash,
+                 record.n_paths, record.n_points, record.lines, record.errors, record.alarms,
+                 record.prompts, record.prompt_wait, json.dumps(record.settings, default=str))
+            )
+            db.executemany(
+                "INSERT INTO phases (job_id, seq, name, duration) VALUES (?,?,?,?)",
+                [(cur.lastrowid, i, name, duration) for i, (name, _, duration) in enumerate(record.phases)]
+            )
+            return cur.lastrowid
+
+    # Reports
+
+    def _range(self, since, until):
+        return (since or 0, until or float("inf"))
+
+    def summary(self, since=None, until=None, routine="Engraving Routine"):
+        """Counts by outcome and tags per hour, both of machine time and of the wall clock span."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT outcome, COUNT(*), SUM(duration), MIN(started), MAX(finished) FROM jobs"
+                " WHERE routine = ? AND started >= ? AND started < ? GROUP BY outcome",
+                (routine, *self._range(since, until))
+            ).fetchall()
+        outcomes = {outcome: count for outcome, count, *_ in rows}
+        busy = sum(row[2] or 0 for row in rows)
+        first = min((row[3] for row in rows), default=None)
+        last = max((row[4] for row in rows), default=None)
+        completed = outcomes.get("completed", 0)
+        return {
+            "jobs": sum(outcomes.values()),
+            "outcomes": outcomes,
+            "busy_hours": busy / 3600,
+            "tags_per_busy_hour": completed / (busy / 3600) if busy else None,
+            "tags_per_hour": completed / ((last - first) / 3600) if first is not None and last > first else None,
+        }
+
+    def phase_breakdown(self, since=None, until=None, routine="Engraving Routine"):
+        """[(phase, jobs, mean seconds, total seconds)], longest total first."""
+        with self._connect() as db:
+            return db.execute(
+                "SELECT p.name, COUNT(DISTINCT p.job_id), AVG(p.duration), SUM(p.duration) FROM phases p"
+                " JOIN jobs j ON j.id = p.job_id WHERE j.routine = ? AND j.started >= ? AND j.started < ?"
+                " GROUP BY p.name ORDER BY SUM(p.duration) DESC",
+                (routine, *self._range(since, until))
+            ).fetchall()
+
+    def slowest_designs(self, since=None, until=None, limit=10, routine="Engraving Routine"):
+        """[(design hash, runs, mean seconds, mean points, mean prompt wait)] of completed runs, slowest first."""
+        with self._connect() as db:
+            return db.execute(
+                "SELECT design_hash, COUNT(*), AVG(duration), AVG(n_points), AVG(prompt_wait) FROM jobs"
+                " WHERE routine = ? AND outcome = 'completed' AND design_hash IS NOT NULL"
+                " AND started >= ? AND started < ? GROUP BY design_hash ORDER BY AVG(duration) DESC LIMIT ?",
+                (routine, *self._range(since, until), limit)
+            ).fetchall()
+
+def _parse_date(value):
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+def main():
+    parser = argparse.ArgumentParser(description="Engraving throughput report")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--since", type=_parse_date, help="ISO date or datetime, inclusive")
+    parser.add_argument("--until", type=_parse_date, help="ISO date or datetime, exclusive")
+    parser.add_argument("--routine", default="Engraving Routine")
+    parser.add_argument("--slowest", type=int, default=5, help="How many of the slowest designs to list")
+    args = parser.parse_args()
+
+    store = JobStore(args.db)
+    summary = store.summary(args.since, args.until, args.routine)
+    print(f"{summary['jobs']} job(s): " + ", ".join(f"{n} {outcome}" for outcome, n in sorted(summary["outcomes"].items())))
+    if summary["tags_per_hour"] is not None:
+        print(f"Tags per hour: {summary['tags_per_hour']:.1f} over the range, {summary['tags_per_busy_hour']:.1f} while running")
+
+    phases = store.phase_breakdown(args.since, args.until, args.routine)
+    if phases:
+        total = sum(row[3] for row in phases) or 1
+        print(f"\n{'phase':<16} {'jobs':>5} {'mean s':>9} {'share':>7}")
+        for name, jobs, mean, phase_total in phases:
+            print(f"{name:<16} {jobs:>5} {mean:9.1f} {phase_total / total:7.1%}")
+
+    designs = store.slowest_designs(args.since, args.until, args.slowest, args.routine)
+    if designs:
+        print(f"\n{'design':<14} {'runs':>5} {'mean s':>9} {'points':>8} {'prompt s':>9}")
+        for design, runs, mean, points, prompt_wait in designs:
+            print(f"{design:<14} {runs:>5} {mean:9.1f} {points or 0:8.0f} {prompt_wait or 0:9.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
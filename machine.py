@@ -1,18 +1,30 @@
 
-import time
-import platform
+import re
+import math
+import asyncio
+import functools
 import traceback
-import multiprocessing
-
-if any([e in platform.platform().lower() for e in ["macos", "windows"]]):
-    import FakeGPIO as GPIO
-else:
-    import RPi.GPIO as GPIO
+import threading
 
 from PyQt5.QtCore import QObject, pyqtSignal
 from PyQt5.QtWidgets import QMessageBox
 
 from proto_serial import ProtoSerial
+from grbl_connection import GrblConnection
+from port_discovery import discovery
+from hardware import resolve_gpio_backend, resolve_serial_backend, resolve_pwm_backend, make_clock, make_gpio, make_pwm, make_serial
+from grbl_settings_sync import load_profile, format_setting
+from dialog_channel import DialogChannel, DialogTimeout, DialogCancelled
+from machine_loop import MachineLoop, machine_task
+from tracing import Tracer, traced
+from job_telemetry import JobRecord, JobStore
+from engraving_checkpoint import EngravingCheckpoint
+from serial_metrics import serve_metrics, PLANNER_BLOCKS
+from gcode_stream import GcodeStream
+from serial_session import encode_arg
+from _motion_planner import parse_words, estimate_program_time
+from _gcode_writer import GcodeWriter
+from _feed_rates import segment_feeds
 from util import *
 
 class Machine(QObject):
@@ -23,10 +35,12 @@ class Machine(QObject):
     report_routine_status = pyqtSignal(object)
     report_machine_position = pyqtSignal(object)
 
-    routine_dialog_event = pyqtSignal(object, object, object)
+    routine_dialog_event = pyqtSignal(object)
 
     # General Settings
     DWELL = 0.1  # General wait time, mostly used after changing speed.
+    AUTO_PORT = "auto"  # Port setting value that picks the GRBL controller automatically
+    DIALOG_TIMEOUT = None  # Seconds to wait for an operator response, None waits forever.
 
     # Coordinates
     WORK_OFFSET = (65, 162)  # Offset to center of tag
@@ -36,12 +50,17 @@ class Machine(QObject):
     # Peener Settings
     PEEN_LOW = 20  # % Speed for travel moves
     PEEN_HIGH = 50  # % Speed for peening moves
+    SPINDLE_MAX = 1000  # GRBL's default $30, the S word of a full speed peener command
     PULSE_DELAY = 0.3 # Seconds to turn motor on when trying to lift
+    PEENER_PWM_FREQ = 1000  # Hz
+    PEENER_RAMP = 0.2  # Seconds to ramp the peener between stopped and full speed, changes take their share of it
+    PEENER_RAMP_STEP = 0.01  # Seconds between duty cycle steps while ramping
 
     # Gantry Settings
     GANTRY_PARK_POS = (-WORK_OFFSET[0], -WORK_OFFSET[1], 0)
     GANTRY_TRAVEL_SPEED = 800
-    GANTRY_PEEN_SPEED = 500
+    GANTRY_PEEN_SPEED = 500  # Also the slowest adaptive feed
+    FEED_CORNER_ACCEL = 100  # mm/s^2 of sideways acceleration allowed on curves with adaptive feeds
 
     # Clamp Settings
     CLAMP_OPEN_POS = 0
@@ -53,6 +72,13 @@ class Machine(QObject):
     TRAY_DIR_PIN = 16
     TRAY_STEP_PIN = 20
     TRAY_LIMIT_PIN = 21
+    TAG_SENSOR_PIN = None  # Switch that closes when a tag is in the clamp, None asks the operator instead
+    PEENER_UP_PIN = None  # Switch that closes when the peener is lifted, None asks the operator instead
+
+    # Sensors
+    SENSOR_ACTIVE = 0  # Switches pull their pin to ground when triggered, like the tray limit
+    SENSOR_SETTLE = 0.02  # Seconds a switch has to read the same twice to be believed
+    SENSOR_ATTEMPTS = 3  # Automatic tries before falling back to asking the operator
 
     # Tray Movement
     TRAY_REV_DIST = 3200  # Number of steps for 1 revolution (200 steps/rev * 16 microstepping)
@@ -61,6 +87,9 @@ class Machine(QObject):
     TRAY_SPEED = 1000  # Step Freqeuncy Hz
     TRAY_HOME_SPEED = 500   # Step Freqeuncy Hz
 
+    # GRBL Settings Profile
+    GRBL_SETTINGS_FP = "grbl_settings"
+
     # GRBL Commands
     GRBL_RESET = chr(24)
     GRBL_ENABLE = "$X"
@@ -84,76 +113,247 @@ class Machine(QObject):
     GRBL_TRAVEL_Y = lambda self, y: f"G0 Y{y}"  # F{self.GANTRY_TRAVEL_SPEED}"
     GRBL_TRAVEL_Z = lambda self, z: f"G0 Z{z}"  # F{self.GANTRY_TRAVEL_SPEED}"
     GRBL_PEEN_XY = lambda self, x, y: f"G1 X{x} Y{y} F{self.GANTRY_PEEN_SPEED}"  # f"G0 X{x} Y{y}"
+    GCODE_SPINDLE_WORDS = re.compile(r"M0*[345](?![0-9])|S[-+]?[0-9.]+")  # Spindle words in a program switch the peener
 
     def __init__(self, window, settings):
         QObject.__init__(self)
         self.window = window
         self.settings = settings
 
+        # A per-machine pin map, e.g. {"peener": 13}, overrides the BCM pin constants so several machines can share a host
+        for name, pin in settings.get('pins', {}).items():
+            setattr(self, self.pin_attr(name), pin)
+
         # Init Util Variables
         self._routine_name = "GRBL"
         self._routine_progress = 0
 
-        # Init Serial Connection Manager
-        self.ser = ProtoSerial()
+        # Dialogs are posted to the GUI thread through a queued signal and answered through the request's future.
+        self.dialogs = DialogChannel(self.routine_dialog_event.emit)
+
+        # All routines run as coroutines on a single machine event loop, e_stop cancels them from any thread.
+        self.loop = MachineLoop()
+        self._abort = threading.Event()
+
+        # Hardware backends are picked by settings, "sim" records everything and can run in accelerated time
+        gpio_backend = resolve_gpio_backend(settings.get('gpio_backend', 'auto'))
+        serial_backend = resolve_serial_backend(settings.get('serial_backend', 'auto'))
+        self.clock = make_clock(gpio_backend, serial_backend, settings.get('time_scale', 1))
+        self.gpio = make_gpio(gpio_backend, self.clock)
+
+        # Each machine traces on its own clock, so simulated jobs trace in virtual time and farm machines don't mix
+        self.tracer = Tracer(self.clock)
+        self.tracer.enable(settings.get('tracing', False))
+
+        # Init Serial Connection Manager, the port is held open across routines
+        self.ser = ProtoSerial(make_serial(
+            serial_backend, self.clock, settings.get('serial_replay_fp'), settings.get('serial_record_dir')
+        ), self.tracer)
+        self.grbl = GrblConnection(self.ser)
+
+        # Link metrics are always collected, a port setting also serves them as text on localhost
+        metrics_port = settings.get('metrics_port')
+        self.metrics_server = serve_metrics(self.ser.metrics, metrics_port) if metrics_port else None
+
+        # Every routine run is recorded to the telemetry database, None disables it
+        self._job = None
+
+        # Progress of the current (or last interrupted) engraving, for resuming on the same tag
+        self.checkpoint = None
 
         # Init GPIO to GBCM Pin Mode - use IO numbers, not physical pin numbers
         # https://community.element14.com/cfs-file/__key/telligent-evolution-components-attachments/13-153-00-00-00-01-74-28/pi3_5F00_gpio.png
-        GPIO.setmode(GPIO.BCM)
+        self.gpio.setmode(self.gpio.BCM)
 
-        # Setup Peener motor PWM Output
-        GPIO.setup(self.PEENER_PIN, GPIO.OUT)
-        self.pwm = GPIO.PWM(self.PEENER_PIN, 1000)
-        self.set_peener_speed(0)
+        # Setup Peener motor PWM Output, in hardware when the kernel exposes the pin's PWM channel
+        pwm_backend = resolve_pwm_backend(settings.get('pwm_backend', 'auto'), gpio_backend, self.PEENER_PIN)
+        if pwm_backend == "gpio":
+            self.gpio.setup(self.PEENER_PIN, self.gpio.OUT)  # Would take the pin away from the PWM peripheral
+        self.pwm = make_pwm(pwm_backend, self.gpio, self.PEENER_PIN, settings.get('peener_pwm_freq', self.PEENER_PWM_FREQ))
+        self.peener_duty = 0
+        self.stop_peener()
 
         # Setup Pizza Tray Pins
-        GPIO.setup(self.TRAY_LIMIT_PIN, GPIO.IN)
-        GPIO.setup(self.TRAY_DIR_PIN, GPIO.OUT)
-        GPIO.setup(self.TRAY_STEP_PIN, GPIO.OUT)
-        GPIO.output(self.TRAY_DIR_PIN, 1)
+        self.gpio.setup(self.TRAY_LIMIT_PIN, self.gpio.IN)
+        self.gpio.setup(self.TRAY_DIR_PIN, self.gpio.OUT)
+        self.gpio.setup(self.TRAY_STEP_PIN, self.gpio.OUT)
+        self.gpio.output(self.TRAY_DIR_PIN, 1)
+
+        # Setup optional verification switches
+        for pin in (self.TAG_SENSOR_PIN, self.PEENER_UP_PIN):
+            if pin is not None:
+                self.gpio.setup(pin, self.gpio.IN)
+
+    @classmethod
+    def pin_attr(cls, name):
+        attr = f"{name.upper()}_PIN"
+        if not hasattr(cls, attr):
+            raise ValueError(f"Unknown pin: {name}")
+        return attr
+
+    def pin_map(self):
+        return {attr[:-4].lower(): getattr(self, attr) for attr in dir(self) if attr.endswith("_PIN") and getattr(self, attr) is not None}
 
     def update_settings(self, settings):
         self.settings = settings
+        self.tracer.enable(settings.get('tracing', False))
 
-    def _connect(self, enable=True):
-        self._was_connected = self.ser.is_connected()
-        if not self._was_connected:
+    def compile_paths(self, paths, writer=None):
+        """G-code for each path as (travel move to its first point, [peening moves along the rest])."""
+        # Path points are between -0.5 and 0.5 represnting +/- 50% of engraveable area, multiple by the tag diameter to scale up.
+        # The writer rounds them (to 2 decimal places, or to whole steps) and leaves out whatever GRBL already has modal.
+        scale = self.settings['tag_diam']
+        writer = writer or self.gcode_writer()
+        compiled = []
+        for path in paths:
+            travel = writer.move(path[0][0] * scale, path[0][1] * scale)
+            feeds = self.path_feeds(path)
+            compiled.append((travel, [writer.move(x * scale, y * scale, feed) for (x, y), feed in zip(path[1:], feeds)]))
+        return compiled
+
+    def path_feeds(self, path):
+        """
+            Feed rate of each peening move along a path: GANTRY_PEEN_SPEED, or with 'adaptive_feed' as fast as the
+            path's curvature and segment lengths allow, up to 'feed_max' (None for the controller's $110/$111).
+        """
+        if not self.settings.get('adaptive_feed') or len(path) < 2:
+            return [self.GANTRY_PEEN_SPEED] * (len(path) - 1)
+        values = self._grbl_values()
+        feed_max = self.settings.get('feed_max') or min(values[110], values[111])
+        scale = self.settings['tag_diam']
+        return segment_feeds(
+            [(x * scale, y * scale) for x, y in path],
+            self.GANTRY_PEEN_SPEED, feed_max,
+            self.settings.get('feed_corner_accel', self.FEED_CORNER_ACCEL),
+            min(values[120], values[121]), PLANNER_BLOCKS
+        )
+
+    def peen_speed(self, path):
+        """Peener speed for a path, scaled with its mean feed when 'peen_scale_with_feed' is on so dot spacing stays the same."""
+        if not self.settings.get('peen_scale_with_feed') or len(path) < 2:
+            return self.PEEN_HIGH
+        scale = self.settings['tag_diam']
+        lengths = [math.dist(a, b) * scale for a, b in zip(path, path[1:])]
+        feeds = self.path_feeds(path)
+        mean_feed = sum(f * l for f, l in zip(feeds, lengths)) / sum(lengths) if sum(lengths) else self.GANTRY_PEEN_SPEED
+        return min(100, self.PEEN_HIGH * mean_feed / self.GANTRY_PEEN_SPEED)
+
+    def border_gcode(self):
+        """(move to the border's edge, arc around it) when a border is drawn, else None."""
+        border_rad = self.settings['tag_diam']/2 - self.settings['border_margin']
+        if not self.settings['draw_border'] or border_rad <= 0:
+            return None
+        return f"G0 X0 Y{-border_rad}", f"G2 X0 Y{-border_rad} I0 J{border_rad} F{self.GANTRY_PEEN_SPEED}"
+
+    def preview_program(self, paths):
+        """
+            The moves an engraving of `paths` makes from the tag's entry point, with the waits for the peener to
+            change speed written as G4 dwells, for Timeline.
+        """
+        dwell = lambda speed: f"G4 P{self.peener_ramp_time(self.PEEN_LOW, speed):.3f}"
+        lines = [self.GRBL_TRAVEL_XY(*self.ENTRY_POINT)]
+        border = self.border_gcode()
+        if border:
+            lines += [border[0], dwell(self.PEEN_HIGH), border[1], dwell(self.PEEN_HIGH)]
+        for path, (travel, peen) in zip(paths, self.compile_paths(paths)):
+            speed = self.peen_speed(path)
+            lines += [travel, dwell(speed), *peen, dwell(speed)]
+        return lines
+
+    def preview_timeline(self, paths):
+        """Timeline of an engraving of `paths`, in tag coordinates (mm)."""
+        from _toolpath_timeline import Timeline  # NumPy, only when previewing
+        return Timeline(self.preview_program(paths), self._grbl_values(), (*self.PRE_ENTRY_POINT, 0))
+
+    def _grbl_values(self):
+        # The controller's $$ table once it's been read, the profile it's synced to until then
+        return self.grbl.settings.values if self.grbl.settings else load_profile(self.GRBL_SETTINGS_FP)
+
+    def gcode_writer(self):
+        """A GcodeWriter for compiling paths, snapping to the controller's steps/mm when 'gcode_quantize' is on."""
+        steps_per_mm = None
+        if self.settings.get('gcode_quantize'):
+            values = self._grbl_values()
+            steps_per_mm = (values[100], values[101])
+        return GcodeWriter(steps_per_mm=steps_per_mm)
+
+    def estimate_paths_time(self, paths):
+        """
+            Seconds to engrave `paths`: each path's motion from a standstill, since the routine waits for idle
+            between them, plus its ramps up to peening speed and back.
+        """
+        values = self._grbl_values()
+        scale = self.settings['tag_diam']
+        position = (*self.ENTRY_POINT, 0)
+        total = 0
+        for path in paths:
+            travel, peen = self.compile_paths([path])[0]
+            ramps = 2 * self.peener_ramp_time(self.PEEN_LOW, self.peen_speed(path))
+            total += estimate_program_time([travel, *peen], values, position, PLANNER_BLOCKS) + ramps
+            position = (path[-1][0] * scale, path[-1][1] * scale, 0)
+        return total
+
+    def gcode_bytes(self, paths):
+        """(bytes as compiled, bytes with every word on every line) of a design's paths."""
+        writer = self.gcode_writer()
+        self.compile_paths(paths, writer)
+        scale = self.settings['tag_diam']
+        scale_pt = lambda pt: [round(e * scale, 2) for e in pt]
+        verbose = sum(
+            len(self.GRBL_TRAVEL_XY(*scale_pt(path[0]))) + 1 + sum(len(self.GRBL_PEEN_XY(*scale_pt(pt))) + 1 for pt in path[1:])
+            for path in paths
+        )
+        return writer.bytes, verbose
+
+    async def _connect(self, enable=True):
+        port = self.settings['port']
+        if port == self.AUTO_PORT:
+            # Keep whichever port was found last time, only probe again once it's gone
+            port = self.grbl.port if self.ser.is_connected() else None
+        if not self.grbl.is_ready(port):
             self._set_status("Connecting GRBL")
-            self.ser.connect(self.settings['port'])
-
-            self._set_status("Initializing GRBL")
-            self.ser.send(self.GRBL_RESET)
-            self.ser.send(self.GRBL_PRINT_SETTINGS)
-            self.ser.send(self.GRBL_IDLE_HOLD_OFF)
-            if(enable):
-                self.ser.send(self.GRBL_ENABLE)
-            time.sleep(self.DWELL)
+            # Ports other machines hold (or are set to) are never probed, so auto machines don't share or reset one
+            port = await self.loop.blocking(discovery.claim, self, port, self.settings.get('port_exclude', ()))
+        await self.loop.serial(self.grbl.ensure_ready, port, enable)
         
     def _disconnect(self):
-        if self.ser.is_connected():
-            self.ser.disconnect()
-        self._was_connected = False
-
-    def _disconnect_if_wasnt(self):
-        if self.ser.is_connected() and not self._was_connected:
-            self.ser.disconnect()
+        self.grbl.disconnect()
+        discovery.release(self)
     
-    def _sleep(self):
+    async def _sleep(self):
         if self.ser.is_connected():
             self._set_status("Putting GRBL to Sleep")
-            self.ser.send(self.GRBL_SLEEP)
+            await self.loop.serial(self.grbl.sleep)
+
+    async def _set_idle_hold(self, hold):
+        await self.loop.serial(self.grbl.set_idle_hold, hold)
+
+    async def _dwell(self, seconds):
+        with self.tracer.span("dwell", seconds=seconds):
+            await self.clock.sleep_async(seconds)
+
+    async def _send(self, gcode, wait_for_resp=False, keep_oks=True):
+        return await self.loop.serial(self.ser.send, gcode, wait_for_resp, keep_oks)
         
     def __func_to_name(self, func_name):
         return func_name.replace("_", " ").title()[(3 if func_name[:3] == "do_" else 0):]
 
     # GUI Event Functions    
     
-    def get_dialog_response(self, dialog, *args, **kwargs):
-        self._dialog_resp = None
-        self.routine_dialog_event.emit(dialog, args, kwargs)
-        while self._dialog_resp is None:
-            time.sleep(0.5)
-        return self._dialog_resp
+    async def get_dialog_response(self, dialog, *args, timeout=DIALOG_TIMEOUT, **kwargs):
+        # A dialog that times out or is cancelled (e.g. by an e-stop) is treated as the operator pressing Cancel.
+        asked = self.clock.now()
+        answer = QMessageBox.Cancel
+        try:
+            with self.tracer.span("dialog", dialog=getattr(dialog, "__name__", str(dialog))):
+                answer = await self.dialogs.ask_async(dialog, *args, timeout=timeout, **kwargs)
+        except (DialogTimeout, DialogCancelled) as ex:
+            print(f"Dialog aborted: {type(ex).__name__}")
+        finally:
+            if self._job:
+                self._job.prompt_waited(self.clock.now() - asked)
+            self._annotate("dialog", answer=answer)
+        return answer
 
     def _reset_progress(self, status="Ready"):
         self._set_progress(0, status)
@@ -167,6 +367,44 @@ class Machine(QObject):
         if status:
             self._set_status(status)
 
+    def _phase(self, name):
+        if self._job:
+            self._job.phase(name)
+
+    def _record_job(self):
+        job, self._job = self._job, None
+        job.finish(self.ser.metrics.counters)
+        db = self.settings.get('telemetry_db')
+        if db:
+            try:
+                JobStore(db).save(job)
+            except Exception:
+                traceback.print_exc()  # Telemetry must never take a routine down with it
+
+    def _save_checkpoint(self):
+        """Persist an unfinished engraving's checkpoint, returns whether there was one."""
+        if self.checkpoint is None or self.checkpoint.done:
+            return False
+        filepath = self.settings.get('checkpoint_fp')
+        if filepath:
+            self.checkpoint.save(filepath)
+        return True
+
+    def _annotate(self, kind, **data):
+        # Notes in the serial recording, so a replay can run the same routines with the same answers
+        annotate = getattr(self.ser.ser, "annotate", None)
+        if annotate is not None:
+            annotate(kind, **data)
+
+    def _note_call(self, func, args, kwargs):
+        # Every routine and manual action started from outside the loop, with arguments typed for replaying
+        if getattr(self.ser.ser, "annotate", None) is None:
+            return
+        self._annotate(
+            "call", name=getattr(func, "routine_name", func.__name__), method=func.__name__,
+            args=[encode_arg(arg) for arg in args], kwargs={key: encode_arg(value) for key, value in kwargs.items()}
+        )
+
     def _set_status(self, status):
         self._routine_status = status
         status_str = f"{self._routine_name}: {self._routine_status}"
@@ -177,347 +415,608 @@ class Machine(QObject):
 
     def __as_routine(name):
         def wrapper(func):
-            def inner(self, *args, **kwargs):
+            @functools.wraps(func)
+            async def inner(self, *args, **kwargs):
                 self._routine_name = name
                 self._set_progress(0, f"Starting")
                 self.routine_started.emit(name)
-                result = func(self, *args, **kwargs)
+                self.tracer.begin_job(name)
+                self._job = JobRecord(name, self.clock, self.settings, self.ser.metrics.counters)
+                try:
+                    with self.tracer.span(name, "routine"):
+                        result = await func(self, *args, **kwargs)
+                except asyncio.CancelledError:
+                    # Still tell the UI the routine is over, then let the cancellation reach whoever awaits it
+                    self.routine_finished.emit(None)
+                    self._routine_name = "GRBL"
+                    raise
+                finally:
+                    self.tracer.end_job(self.settings.get('trace_dir'))
+                    self._record_job()
                 self.routine_finished.emit(result)
-                self.routine_dialog_event.emit(
-                    QMessageBox.information, [
-                        f"{self._routine_name} Finished",
-                        f"{self._routine_name} has finished!",
-                        QMessageBox.Ok
-                    ], {}
+                self.dialogs.notify(
+                    QMessageBox.information,
+                    f"{self._routine_name} Finished",
+                    f"{self._routine_name} has finished!",
+                    QMessageBox.Ok
                 )
                 self._routine_name = "GRBL"
                 return result
+            inner.routine_name = name  # For _note_call, functools.wraps carries it through the other decorators
             return inner
         return wrapper
     
     def __with_connection(func):
-        def wrapper(self, *args, **kwargs):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
             self._reset_progress()
+            self._clear_abort()
             result = None
             try:
                 self._set_progress(1, "Connecting")
-                self._connect()
-
-                self._set_progress(2, "Resetting GRBL")
-                self.ser.send(self.GRBL_RESET)
+                self._phase("connect")
+                with self.tracer.span("connect", "connection"):
+                    await self._connect()
 
                 self._set_progress(5, "GRBL Ready")
-                result = func(self, *args, **kwargs)
-            except _CancelRoutineExpcetion as ex:
+                result = await func(self, *args, **kwargs)
+            except (_CancelRoutineExpcetion, asyncio.CancelledError) as ex:
                 self._set_status("Cancelled")
-                # result = ex
+                if self._job:
+                    self._job.outcome = "cancelled"
+                self._save_checkpoint()
+                if isinstance(ex, asyncio.CancelledError):
+                    raise
             except Exception as ex:
                 traceback.print_exc()
 
                 self._set_status("Error")
-                self.e_stop()
-                self.routine_dialog_event.emit(QMessageBox.critical, [
-                    "Error While Peening", 
+                if self._job:
+                    self._job.outcome = "error"
+                self._halt()
+                await self._recover_from_stop()
+                resumable = self._save_checkpoint()
+                self.dialogs.notify(
+                    QMessageBox.critical,
+                    "Error While Peening",
                     "An Error occured while Peening. Machine has been stopped for safety."
-                ], {})
+                    + (" Clear the fault, then use Resume Engraving to finish this tag." if resumable else "")
+                )
 
                 # result = ex
             finally:
-                self.set_peener_speed(0)
-                self.ser.send(self.GRBL_IDLE_HOLD_OFF)
-                self._sleep()
-                self._disconnect_if_wasnt()
+                self.stop_peener()
+                with self.tracer.span("release", "connection"):
+                    await self._set_idle_hold(False)
                 if result is not None:
                     self._set_progress(100, "Done")
             return result
         return wrapper
 
     def e_stop(self):
+        """Stop the machine immediately, safe to call from the GUI thread while a routine is running."""
         print("E-Stop")
-        self.set_peener_speed(0, 0)
-        self._connect(False)
-        self.ser.send(self.GRBL_CYCLEHOLD, False)
-        self.ser.send(self.GRBL_IDLE_HOLD_OFF)
-        self.ser.send(self.GRBL_SLEEP)
-
-    def get_machine_status(self):
-        self._connect(False)
-        status =  self.ser.send(self.GRBL_STATUS)
-        self._disconnect_if_wasnt()
-        return status
-
-    def _wait_for_idle(self):
+        self._halt()
+        self.loop.cancel_all()
+        return self.loop.submit(self._recover_from_stop())
+
+    def _halt(self):
+        # Everything here is synchronous so it takes effect before the routine's next await.
+        self._abort.set()
+        self.ser.abort()
+        if self.ser.is_connected():
+            self.ser.write_realtime(self.GRBL_CYCLEHOLD)
+        self.stop_peener()
+        self.dialogs.cancel_all()
+        self.grbl.reset_required = True  # Flush the planner rather than ever resuming the held motion
+        self.grbl.forget_idle_hold()  # So recovery releases the steppers whatever the stopped routine managed to write
+
+    def _clear_abort(self):
+        self._abort.clear()
+        self.ser.clear_abort()
+
+    async def _recover_from_stop(self):
+        # The cancelled routine's serial and GPIO work keeps running until it sees the abort, so hold it until then
+        await self.loop.drain()
+        self._clear_abort()
+        await self._connect(False)
+        await self._set_idle_hold(False)
+        await self._sleep()
+
+    async def get_machine_status(self):
+        await self._connect(False)
+        return await self._send(self.GRBL_STATUS)
+
+    @traced("wait_for_idle", "grbl")
+    async def _wait_for_idle(self):
         print("Waiting for Idle")
         status = []
         while not any(["Idle" in e for e in status]):
-            time.sleep(0.25)
-            status = self.get_machine_status()
+            await self.clock.sleep_async(0.25)
+            status = await self.get_machine_status()
+            if self.grbl.state == "Alarm":
+                raise MachineAlarm(f"GRBL alarm {self.grbl.alarm}")
     
     # Tray Util Functions
 
-    def spin_tray(self, revolutions=1, direction=TRAY_CCW):
+    @machine_task
+    async def spin_tray(self, revolutions=1, direction=TRAY_CCW):
         print(f"Spinning Tray revs={revolutions} dir={direction}")
-        GPIO.output(self.TRAY_DIR_PIN, direction)
-        for _ in range(int(self.TRAY_REV_DIST * revolutions)):
-            GPIO.output(self.TRAY_STEP_PIN, GPIO.HIGH)
-            time.sleep(1 / self.TRAY_SPEED)
-            GPIO.output(self.TRAY_STEP_PIN, GPIO.LOW)
-            time.sleep(1 / self.TRAY_SPEED)
-
-    def home_tray(self, direction=TRAY_CCW):
-        print("Homing Tray")
-        GPIO.output(self.TRAY_DIR_PIN, direction)
-        while GPIO.input(self.TRAY_LIMIT_PIN):
-            GPIO.output(self.TRAY_STEP_PIN, GPIO.HIGH)
-            time.sleep(1 / self.TRAY_HOME_SPEED)
-            GPIO.output(self.TRAY_STEP_PIN, GPIO.LOW)
-            time.sleep(1 / self.TRAY_HOME_SPEED)
-
-    def load_tag(self, err_on_cancel=True):
-        print("Loading Tag")
-        self.spin_tray(1, self.TRAY_CCW)
-
-        resp = self.get_dialog_response(
-            QMessageBox.question,
-            'Loading Tag', 
-            'Did the tag load correctly?',
-            QMessageBox.No | QMessageBox.Yes | QMessageBox.Cancel,
-            QMessageBox.No
-        )
-        if resp == QMessageBox.Cancel:
-            if err_on_cancel:
-                raise _CancelRoutineExpcetion()
-            else:
-                return False
-        elif resp == QMessageBox.No:
-            self.load_tag()
-        else:
-            return True
+        with self.tracer.span("spin_tray", "tray", revolutions=revolutions, direction=direction):
+            await self.loop.blocking(self._step_tray, direction, self.TRAY_SPEED, int(self.TRAY_REV_DIST * revolutions))
 
-    def dispense_tag(self):
+    @machine_task
+    async def home_tray(self, direction=TRAY_CCW):
+        print("Homing Tray")
+        with self.tracer.span("home_tray", "tray", direction=direction):
+            await self.loop.blocking(self._step_tray, direction, self.TRAY_HOME_SPEED, until_limit=True)
+
+    def _step_tray(self, direction, speed, steps=None, until_limit=False):
+        # Bit-banged on an executor thread, checks the abort flag every step so an e-stop stops the tray mid-spin.
+        self.gpio.output(self.TRAY_DIR_PIN, direction)
+        step = 0
+        while (steps is None or step < steps) and not self._abort.is_set():
+            if until_limit and not self.gpio.input(self.TRAY_LIMIT_PIN):
+                break
+            self.gpio.output(self.TRAY_STEP_PIN, self.gpio.HIGH)
+            self.clock.sleep(1 / speed)
+            self.gpio.output(self.TRAY_STEP_PIN, self.gpio.LOW)
+            self.clock.sleep(1 / speed)
+            step += 1
+        return step
+
+    async def load_tag(self, err_on_cancel=True):
+        async def spin():
+            print("Loading Tag")
+            await self.spin_tray(1, self.TRAY_CCW)
+        return await self._until_verified(spin, self.TAG_SENSOR_PIN, 'Loading Tag', 'Did the tag load correctly?', err_on_cancel)
+
+    async def dispense_tag(self):
         print("Dispensing Tag")
-        self.spin_tray(0.25, self.TRAY_CCW)  # Spin tray 1/4 rev CCW to dispense tag
-        time.sleep(self.DWELL)
-        self.spin_tray(0.25, self.TRAY_CW)  # Spin tray 1/4 rev CW to park tray
-        time.sleep(self.DWELL)
+        await self.spin_tray(0.25, self.TRAY_CCW)  # Spin tray 1/4 rev CCW to dispense tag
+        await self._dwell(self.DWELL)
+        await self.spin_tray(0.25, self.TRAY_CW)  # Spin tray 1/4 rev CW to park tray
+        await self._dwell(self.DWELL)
 
     # Peener Util Functions
 
-    def set_peener_speed(self, speed, dwell=None):
+    async def set_peener_speed(self, speed, dwell=None):
+        """Ramps the peener to `speed` %, then holds it there for `dwell` seconds if given."""
         if not self.settings['dry_run_only']:
-            self.pwm.start(speed)
-            time.sleep(self.DWELL if dwell is None else dwell)
-
-    def pulse_peener(self):
+            with self.tracer.span("set_peener_speed", "peener", speed=speed):
+                start, ramp = self.peener_duty, self.peener_ramp_time(self.peener_duty, speed)
+                steps = max(round(ramp / self.PEENER_RAMP_STEP), 1)
+                for k in range(1, steps + 1):
+                    if ramp:
+                        await self.clock.sleep_async(ramp / steps)
+                    self._set_peener_duty(start + (speed - start) * k / steps)
+                if dwell:
+                    await self.clock.sleep_async(dwell)
+
+    def peener_ramp_time(self, start, end):
+        """Seconds a peener speed change from `start` % to `end` % ramps over."""
+        return abs(end - start) / 100 * self.settings.get('peener_ramp', self.PEENER_RAMP)
+
+    def _set_peener_duty(self, duty):
+        self.pwm.start(duty)
+        self.peener_duty = duty
+
+    def stop_peener(self):
+        self._set_peener_duty(0)
+
+    @machine_task
+    async def pulse_peener(self):
         print("Pulsing Peener")
-        self.set_peener_speed(self.PEEN_HIGH, self.PULSE_DELAY) # Briefly turn on peener motor
-        self.set_peener_speed(0, self.PULSE_DELAY * 2)  # Wait for deceleration
+        await self.set_peener_speed(self.PEEN_HIGH, self.PULSE_DELAY) # Briefly turn on peener motor
+        await self.set_peener_speed(0, self.PULSE_DELAY * 2)  # Wait for deceleration
 
-    def pulse_peener_until_up(self, err_on_cancel=True):
-        self.pulse_peener()
-        resp = self.get_dialog_response(
-            QMessageBox.question,
-            'Stopping Peener', 
-            'Is the peener lifted off the tag?',
-            QMessageBox.No | QMessageBox.Yes | QMessageBox.Cancel,
-            QMessageBox.No
+    @machine_task
+    async def pulse_peener_until_up(self, err_on_cancel=True):
+        return await self._until_verified(
+            self.pulse_peener, self.PEENER_UP_PIN, 'Stopping Peener', 'Is the peener lifted off the tag?', err_on_cancel
         )
-        if resp == QMessageBox.Cancel:
-            if err_on_cancel:
-                raise _CancelRoutineExpcetion()
-            else:
+
+    # Verification
+
+    async def read_sensor(self, pin):
+        """Whether the switch on `pin` is triggered, once it reads the same twice SENSOR_SETTLE apart."""
+        value = self.gpio.input(pin)
+        while True:
+            await self.clock.sleep_async(self.SENSOR_SETTLE)
+            settled, value = value, self.gpio.input(pin)
+            if settled == value:
+                return value == self.SENSOR_ACTIVE
+
+    async def _until_verified(self, action, pin, title, question, err_on_cancel):
+        """
+            Repeat `action` until the switch on `pin` triggers, asking the operator after each attempt past
+            'sensor_attempts' and after every attempt when there's no sensor (`pin` None). The operator answering
+            Yes counts as verified, No tries again and Cancel (or any other answer) raises or returns False when
+            `err_on_cancel` is off.
+        """
+        attempts = 0
+        while True:
+            await action()
+            attempts += 1
+            if pin is not None:
+                with self.tracer.span("verify", "sensor", pin=pin, attempt=attempts):
+                    triggered = await self.read_sensor(pin)
+                if triggered:
+                    return True
+                if attempts < self.settings.get('sensor_attempts', self.SENSOR_ATTEMPTS):
+                    print(f"  {title}: GPIO {pin} not triggered, retrying ({attempts})")
+                    continue
+            resp = await self.get_dialog_response(
+                QMessageBox.question,
+                title,
+                question if pin is None else f"{question} GPIO {pin} still isn't triggered after {attempts} tries.",
+                QMessageBox.No | QMessageBox.Yes | QMessageBox.Cancel,
+                QMessageBox.No
+            )
+            if resp == QMessageBox.Yes:
+                return True
+            if resp != QMessageBox.No:
+                if err_on_cancel:
+                    raise _CancelRoutineExpcetion()
                 return False
-        elif resp == QMessageBox.No:
-            self.pulse_peener_until_up()
-        else:
-            return True
 
     # Routines
 
+    @machine_task
     @__as_routine("Connect & Sleep Routine")
     @__with_connection
-    def connect_and_sleep(self):
+    async def connect_and_sleep(self):
         self._set_progress(10, "Putting GRBL to Sleep")
-        self._sleep()
+        await self._sleep()
         self._set_progress(100, "Done")
         return self.ser.is_connected()
 
+    @machine_task
     @__as_routine("Homing Routine")
     @__with_connection
-    def do_homing_routine(self):
+    async def do_homing_routine(self):
         self._set_progress(10, "Homing Clamp (Z)")
-        self.ser.send(self.GRBL_HOME_Z)
-        self._wait_for_idle()
+        await self._send(self.GRBL_HOME_Z)
+        await self._wait_for_idle()
         self._set_progress(25, "Clamp Homed")
-        time.sleep(1)
+        await self._dwell(1)
 
         self._set_progress(30, "Homing X Axis")
-        self.ser.send(self.GRBL_HOME_X)
-        self._wait_for_idle()
+        await self._send(self.GRBL_HOME_X)
+        await self._wait_for_idle()
         self._set_progress(50, "X Axis Homed")
-        time.sleep(1)
+        await self._dwell(1)
 
         self._set_progress(55, "Homing Y Axis")
-        self.ser.send(self.GRBL_HOME_Y)
-        self._wait_for_idle()
+        await self._send(self.GRBL_HOME_Y)
+        await self._wait_for_idle()
         self._set_progress(75, "Y Axis Homed")
-        time.sleep(1)
+        await self._dwell(1)
 
         # self._set_progress(80, "Homing Tray")
-        # self.home_tray()
+        # await self.home_tray()
         self._set_progress(100, "Homing Done")
-        time.sleep(1)
+        await self._dwell(1)
         return True
 
+    @machine_task
     @__as_routine("Engraving Routine")
     @__with_connection
-    def do_engraving_routine(self, paths):
+    async def do_engraving_routine(self, paths):
+        self.checkpoint = EngravingCheckpoint(paths)
+        EngravingCheckpoint.clear(self.settings.get('checkpoint_fp'))
+        self._job.set_design(paths)
+        if self.tracer.enabled:
+            compiled, verbose = self.gcode_bytes(paths)
+            self.tracer.instant("design_gcode", "gcode", bytes=compiled, verbose_bytes=verbose)
+
+        await self._prepare_tag()
+        self._phase("load_tag")
+        self._set_progress(10, "Loading Tag")
+        await self.load_tag()
+        await self._engrave(self.checkpoint)
+        return await self._finish_tag()
+
+    @machine_task
+    @__as_routine("Resume Engraving Routine")
+    @__with_connection
+    async def resume_engraving_routine(self):
+        """Re-home and continue an interrupted engraving on the tag that's still in the machine."""
+        checkpoint = self.checkpoint or EngravingCheckpoint.load(self.settings.get('checkpoint_fp'))
+        if checkpoint is None or checkpoint.done:
+            self.dialogs.notify(QMessageBox.information, "Nothing to Resume", "There is no interrupted engraving to resume.")
+            return None
+        self.checkpoint = checkpoint
+        self._job.set_design(checkpoint.paths)
+
+        # Homing Z opens the clamp, so only the gantry is homed and the part-peened tag stays clamped
+        await self._home(self.GRBL_HOME_X, self.GRBL_HOME_Y)
+        await self._setup_motion()
+        self._phase("load_tag")
+        self._set_progress(10, "Checking Tag")
+        resp = await self.get_dialog_response(
+            QMessageBox.question,
+            'Resume Engraving',
+            f'Resume from path #{checkpoint.path + 1} of {len(checkpoint.paths)}? The part-peened tag must still be in the clamp.',
+            QMessageBox.Yes | QMessageBox.Cancel,
+            QMessageBox.Cancel
+        )
+        if resp != QMessageBox.Yes:
+            raise _CancelRoutineExpcetion()
+        await self._engrave(checkpoint)
+        return await self._finish_tag()
+
+    @machine_task
+    @__as_routine("G-code Routine")
+    @__with_connection
+    async def do_gcode_routine(self, gcode):
+        """
+            Engrave a program in tag coordinates, `M3 S<speed>` (on GRBL's $30 spindle scale) and `M5` switch the
+            peener. `gcode` is program text,
+            lines, a GcodeStream or a GcodeFile (a str is text, not a path), and is streamed lazily so files of any size
+            run in constant memory.
+        """
+        stream = GcodeStream.of(gcode)
+        lines = iter(stream)
+        spindle_max = self._grbl_values().get(30) or self.SPINDLE_MAX
+
+        await self._prepare_tag()
+        self._phase("load_tag")
+        self._set_progress(10, "Loading Tag")
+        await self.load_tag()
+        await self._enter_tag()
+
+        self._phase("paths")
+        self._set_progress(20, "Streaming Program")
+
+        def until_peener(switch):
+            # Lines up to the next peener command, which is left in `switch`. Runs on the serial thread.
+            for line in lines:
+                speed, rest = self._split_peener_command(line, spindle_max)
+                if speed is not None:
+                    switch += [speed, rest]
+                    return
+                yield line
+                self._stream_progress(stream)
+
+        while True:
+            switch = []
+            await self._send(until_peener(switch), True, keep_oks=False)
+            await self._wait_for_idle()
+            if not switch or self.ser.is_aborted():
+                break
+            # The peener isn't on GRBL, so motion has to finish before it changes speed
+            speed, rest = switch
+            await self.set_peener_speed(speed)
+            if rest:
+                await self._send(rest)
+        return await self._finish_tag()
+
+    def _stream_progress(self, stream):
+        fraction = stream.fraction
+        if fraction is None:
+            return
+        progress = int(20 + 60 * fraction)
+        if progress != self._routine_progress:
+            self._set_progress(progress, f"Streaming Program ({stream.offset // 1024} of {stream.size // 1024} kB)")
+
+    def _split_peener_command(self, line, spindle_max=SPINDLE_MAX):
+        """
+            (peener speed %, rest of the line) for a cleaned line holding a spindle command (M3/M4 [S<speed>] or M5),
+            (None, line) for anything else. S is on the 0 to `spindle_max` ($30) scale and clamped to it.
+        """
+        words = parse_words(line.upper())
+        spindle = [value for letter, value in words if letter == "M" and value in (3, 4, 5)]
+        if not spindle:
+            return None, line
+        speeds = [value for letter, value in words if letter == "S"]
+        if spindle[-1] == 5:
+            speed = 0
+        elif speeds:
+            speed = min(max(speeds[0] / spindle_max * 100, 0), 100)
+        else:
+            speed = self.PEEN_HIGH
+        return speed, self.GCODE_SPINDLE_WORDS.sub("", line.upper())
+
+    async def _prepare_tag(self):
+        # Homing and the work offset for a fresh tag
+        await self._home(self.GRBL_HOME_ALL)
+        await self._setup_motion()
+
+    async def _home(self, *commands):
+        self._phase("homing")
         self._set_progress(6, "Homing Machine")
 
-        self.ser.send(self.GRBL_IDLE_HOLD_ON)
-        self.ser.send(self.GRBL_HOME_ALL)
-        self._wait_for_idle()
+        await self._set_idle_hold(True)
+        for command in commands:
+            await self._send(command)
+            await self._wait_for_idle()
         self._set_progress(7, "Homing Done")
 
+    async def _setup_motion(self):
+        self._phase("setup")
         self._set_progress(9, "Initializing Motion")
-        self.ser.send([
+        await self._send([
             self.GRBL_SET_TAG_OFFSET,
             "G17",  # XY Plane
             "G21",  # mm mode
             "G90",  # Absolute coord mode
             self.GRBL_TAG_REL_CORRDS,
-            self.GRBL_ENABLE,
             # self.GRBL_TRAVEL_Z(1)  # Move clamp up a litte (really just to activate servos to let tray spin)
         ])
-        time.sleep(self.DWELL)
-
-        self._set_progress(10, "Loading Tag")
-        self.load_tag()
+        await self._dwell(self.DWELL)
 
+    async def _enter_tag(self):
+        self._phase("clamp")
         self._set_progress(12, "Clamping Tag")
-        self.ser.send(self.GRBL_TRAVEL_Z(self.CLAMP_CLOSE_POS))
-        self._wait_for_idle()
+        await self._send(self.GRBL_TRAVEL_Z(self.CLAMP_CLOSE_POS))
+        await self._wait_for_idle()
 
+        self._phase("approach")
         self._set_progress(15, "Moving To Tag")
-        self.ser.send([
+        await self._send([
             self.GRBL_TRAVEL_XY(*self.PRE_ENTRY_POINT),  # Move towards tag
             self.GRBL_TRAVEL_XY(*self.ENTRY_POINT)  # Move into tag area
         ])
 
-        # Path points are between -0.5 and 0.5 represnting +/- 50% of engraveable area, multiple by the tag diameter to scale up.
-        # Also round to 2 decimal places to clean it up.
-        scale = self.settings['tag_diam']
-        scale_pt = lambda pts: [round(e * scale, 2) for e in pts] 
+    async def _engrave(self, checkpoint):
+        await self._enter_tag()
 
-        if self.settings['draw_border']:
-            border_rad = self.settings['tag_diam']/2 - self.settings['border_margin']
-            if border_rad > 0:
-                self._set_progress(18, "Drawing Border")
-                self.ser.send(f"G0 X0 Y{-border_rad}")  # Move to outer edge of border
-                self._wait_for_idle()
+        border = self.border_gcode()
+        if border and not checkpoint.border_done:
+            self._phase("border")
+            self._set_progress(18, "Drawing Border")
+            await self._send(border[0])  # Move to outer edge of border
+            await self._wait_for_idle()
 
-                print("  Setting Peener to High Speed")
-                self.set_peener_speed(self.PEEN_HIGH)  # Set Peener to peen speed
+            print("  Setting Peener to High Speed")
+            await self.set_peener_speed(self.PEEN_HIGH)  # Set Peener to peen speed
+            checkpoint.peener = self.PEEN_HIGH
 
-                self.ser.send(f"G2 X0 Y{-border_rad} I0 J{border_rad}")  # Draw outer circle
-                self._wait_for_idle()
-                self._set_progress(20, "Done Border")
+            await self._send(border[1])  # Draw outer circle
+            await self._wait_for_idle()
+            checkpoint.border_done = True
+            self._set_progress(20, "Done Border")
 
-                print("  Setting Peener to Low Speed")
-                self.set_peener_speed(self.PEEN_LOW)  # Set Peener to travel speed
+            print("  Setting Peener to Low Speed")
+            await self.set_peener_speed(self.PEEN_LOW)  # Set Peener to travel speed
+            checkpoint.peener = self.PEEN_LOW
 
+        self._phase("paths")
+        paths = checkpoint.paths
         num_paths = len(paths)
         prog_after_paths = 80
-        prog_per_path = min((prog_after_paths - self._routine_progress) / num_paths, 1)
-        for i, path in enumerate(paths):
+        prog_per_path = min((prog_after_paths - self._routine_progress) / max(num_paths - checkpoint.path, 1), 1)
+        for i in range(checkpoint.path, num_paths):
+            # A resumed path re-enters with a travel move to the last point known to have been peened
+            start = checkpoint.line if i == checkpoint.path else 0
+            checkpoint.start_path(i, start)
+            travel, peen = self.compile_paths([paths[i][start:]])[0]
+
             self._increment_progress(prog_per_path - 1, f"Starting Path #{i + 1} of {num_paths}")
-            self.ser.send(self.GRBL_TRAVEL_XY(*scale_pt(path[0])))  # Move to first position
-            self._wait_for_idle()
+            await self._send(travel)  # Move to first position
+            await self._wait_for_idle()
 
             print("  Setting Peener to High Speed")
-            self.set_peener_speed(self.PEEN_HIGH)  # Set Peener to peen speed
+            peen_speed = self.peen_speed(paths[i][start:])
+            await self.set_peener_speed(peen_speed)  # Set Peener to peen speed
+            checkpoint.peener = peen_speed
 
             self._increment_progress(1, f"Drawing Path #{i + 1} of {num_paths}")
-            self.ser.send([
-                self.GRBL_PEEN_XY(*scale_pt(pt))  # Draw each point of the path
-                for pt in path[1:]  # Skip the first point because we're already there
-            ], True)
-            self._wait_for_idle()
+            acked = self.ser.acked_lines
+            try:
+                await self._send(peen, True)  # Draw each point of the path
+                await self._wait_for_idle()
+            except BaseException:
+                checkpoint.interrupted(start, self.ser.acked_lines - acked, PLANNER_BLOCKS)
+                raise
 
             print("  Done Path, Setting Peener to Low Speed")
-            self.set_peener_speed(self.PEEN_LOW)  # Set Peener to travel speed
+            await self.set_peener_speed(self.PEEN_LOW)  # Set Peener to travel speed
+            checkpoint.peener = self.PEEN_LOW
+        checkpoint.start_path(num_paths)
 
-        self._set_progress(prog_after_paths, "Stopping Peener")
-        self.set_peener_speed(0)  # Turn off Peener
+    async def _finish_tag(self):
+        self._set_progress(80, "Stopping Peener")
+        await self.set_peener_speed(0)  # Turn off Peener
 
+        self._phase("lift")
         self._set_progress(82, "Lifting Peener")
-        self.pulse_peener_until_up()
+        await self.pulse_peener_until_up()
+
+        # The design is on the tag, from here a fault only needs the machine cleared, not the engraving resumed
+        self.checkpoint = None
+        EngravingCheckpoint.clear(self.settings.get('checkpoint_fp'))
 
+        self._phase("park")
         self._set_progress(85, "Parking Machine")
-        self.ser.send([
+        await self._send([
             self.GRBL_TRAVEL_XY(*self.ENTRY_POINT),  # Move back to entry point
             self.GRBL_TRAVEL_XY(*self.PRE_ENTRY_POINT),  # Move out of tag area
             self.GRBL_TRAVEL_Z(self.CLAMP_PARTIAL_POS)
         ])
-        self._wait_for_idle()
+        await self._wait_for_idle()
         self._set_progress(90, "Parking Machine")
-        self.ser.send(self.GRBL_TRAVEL_XYZ(*self.GANTRY_PARK_POS))  # Park Gantry
+        await self._send(self.GRBL_TRAVEL_XYZ(*self.GANTRY_PARK_POS))  # Park Gantry
 
+        # The tray is driven by GPIO and the gantry by GRBL, so dispense while the gantry is still parking.
+        self._phase("dispense")
         self._set_progress(95, "Dispensing Tag")
-        self.dispense_tag()
-
-        self._wait_for_idle()
+        await asyncio.gather(self.dispense_tag(), self._wait_for_idle())
         self._set_progress(100, "Done")
+        return True
     
+    @machine_task
     @__with_connection
-    def ser_send(self, *lines):
+    async def ser_send(self, *lines):
         for line in lines:
-            self.ser.send(line)
+            await self._send(line)
 
+    @machine_task
+    @__with_connection
+    async def sync_settings(self, filepath=GRBL_SETTINGS_FP):
+        self._set_progress(10, "Reading GRBL Settings")
+        profile = load_profile(filepath)
+        written, failed = await self.loop.serial(self.grbl.sync_settings, profile)
+        self._set_progress(90, f"Wrote {len(written)} of {len(profile)} Settings")
+        if failed:
+            self.dialogs.notify(
+                QMessageBox.warning,
+                "GRBL Settings",
+                "These settings did not verify: " + ", ".join(format_setting(n, v[1]) for n, v in failed.items())
+            )
+        return written
+
+    def get_grbl_settings(self):
+        """The controller's last verified `$$` table (GrblSettings), or None if it hasn't been read yet."""
+        return self.grbl.settings
+
+    @machine_task
     @__as_routine("Spin Tray Routine")
     @__with_connection
-    def spin_tray_routine(self, revolutions, direction):
-        self.ser.send(self.GRBL_IDLE_HOLD_ON)
-        self.ser.send(self.GRBL_ENABLE)
-        self.ser.send(self.GRBL_HOME_Z)
-        self.spin_tray(revolutions, direction)
-        self.ser.send(self.GRBL_IDLE_HOLD_OFF)
+    async def spin_tray_routine(self, revolutions, direction):
+        await self._set_idle_hold(True)
+        await self._send(self.GRBL_HOME_Z)
+        await self.spin_tray(revolutions, direction)
+        await self._set_idle_hold(False)
 
+    @machine_task
     @__as_routine("Dispense Tag Routine")
     @__with_connection
-    def dispense_tag_routine(self):
+    async def dispense_tag_routine(self):
         # TODO: Energize steppers?
-        self.ser.send(self.GRBL_IDLE_HOLD_ON)
-        self.ser.send(self.GRBL_ENABLE)
-        self.ser.send(self.GRBL_HOME_Z)
-        self.dispense_tag()
-        self.ser.send(self.GRBL_IDLE_HOLD_OFF)
+        await self._set_idle_hold(True)
+        await self._send(self.GRBL_HOME_Z)
+        await self.dispense_tag()
+        await self._set_idle_hold(False)
 
+    @machine_task
     @__with_connection
-    def open_clamp(self):
-        self.ser.send([
-            self.GRBL_ENABLE,
-            self.GRBL_TRAVEL_Z(self.CLAMP_OPEN_POS)
-        ])
+    async def open_clamp(self):
+        await self._send(self.GRBL_TRAVEL_Z(self.CLAMP_OPEN_POS))
 
+    @machine_task
     @__with_connection
-    def close_clamp(self):
-        self.ser.send([
-            self.GRBL_ENABLE,
-            self.GRBL_TRAVEL_Z(self.CLAMP_CLOSE_POS)
-        ])
+    async def close_clamp(self):
+        await self._send(self.GRBL_TRAVEL_Z(self.CLAMP_CLOSE_POS))
 
+    @machine_task
     @__with_connection
-    def home_clamp(self):
-        self.ser.send(self.GRBL_HOME_Z)
+    async def home_clamp(self):
+        await self._send(self.GRBL_HOME_Z)
 
+    @machine_task
     @__with_connection
-    def home_x(self):
-        self.ser.send(self.GRBL_HOME_X)
+    async def home_x(self):
+        await self._send(self.GRBL_HOME_X)
 
+    @machine_task
     @__with_connection
-    def home_y(self):
-        self.ser.send(self.GRBL_HOME_Y)
+    async def home_y(self):
+        await self._send(self.GRBL_HOME_Y)
 
 class _CancelRoutineExpcetion(Exception):
     pass
+
+class MachineAlarm(Exception):
+    """GRBL went into alarm (e.g. a limit was hit) while a routine was waiting on motion."""
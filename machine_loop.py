@@ -0,0 +1,89 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class MachineLoop:
+    """
+        A single asyncio event loop, on its own thread, that runs every routine of a Machine.
+
+        Blocking serial I/O goes through a one-thread executor so lines are never interleaved,
+        GPIO bit-banging and other blocking work goes through a small shared executor.
+    """
+
+    def __init__(self, name="machine"):
+        self.loop = asyncio.new_event_loop()
+        self.serial_executor = ThreadPoolExecutor(1, thread_name_prefix=f"{name}-serial")
+        self.io_executor = ThreadPoolExecutor(2, thread_name_prefix=f"{name}-io")
+        self._tasks = set()
+        self._work = set()  # Executor work not yet returned, cancelling its awaiting task doesn't stop it
+        self._thread = threading.Thread(target=self._run, name=f"{name}-loop", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_loop_thread(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, coro):
+        """Schedule a coroutine from any thread, returns a concurrent.futures.Future for its result."""
+        async def tracked():
+            task = asyncio.current_task()
+            self._tasks.add(task)
+            try:
+                return await coro
+            finally:
+                self._tasks.discard(task)
+        return asyncio.run_coroutine_threadsafe(tracked(), self.loop)
+
+    def cancel_all(self):
+        """Cancel every running routine, safe to call from any thread."""
+        def cancel():
+            for task in list(self._tasks):
+                task.cancel()
+        self.loop.call_soon_threadsafe(cancel)
+
+    def _run_in(self, executor, func, *args, **kwargs):
+        work = executor.submit(functools.partial(func, *args, **kwargs))
+        self._work.add(work)
+        work.add_done_callback(self._work.discard)
+        return asyncio.wrap_future(work, loop=self.loop)
+
+    def serial(self, func, *args, **kwargs):
+        return self._run_in(self.serial_executor, func, *args, **kwargs)
+
+    def blocking(self, func, *args, **kwargs):
+        return self._run_in(self.io_executor, func, *args, **kwargs)
+
+    async def drain(self):
+        """Wait until all serial and blocking work submitted so far has returned, e.g. after cancelling routines."""
+        while self._work:
+            await asyncio.wait([asyncio.wrap_future(work, loop=self.loop) for work in list(self._work)])
+
+    def stop(self):
+        self.cancel_all()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(1)
+        self.serial_executor.shutdown(wait=False)
+        self.io_executor.shutdown(wait=False)
+
+def machine_task(func):
+    """
+        Decorator for Machine coroutines.
+
+        Called from the machine loop it returns the coroutine so it can be awaited, called from any
+        other thread (e.g. the GUI) it schedules the coroutine on the loop and returns a Future.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        coro = func(self, *args, **kwargs)
+        if self.loop.in_loop_thread():
+            return coro
+        # Calls from other threads are the machine's entry points, e.g. so a serial recording can replay them
+        note_call = getattr(self, "_note_call", None)
+        if note_call is not None:
+            note_call(func, args, kwargs)
+        return self.loop.submit(coro)
+    return wrapper
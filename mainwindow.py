@@ -9,21 +9,24 @@ import os
 import glob
 import json
 from typing import Union
+from concurrent.futures import Future
 
-from PyQt5 import uic
-from PyQt5.QtCore import Qt, QRunnable, QThreadPool, pyqtSignal, QObject, QSize
-from PyQt5.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QProgressDialog, QListView
+from PyQt5.QtCore import Qt, QRunnable, QThreadPool, QTimer, pyqtSignal, QObject, QSize
+from PyQt5.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QProgressDialog, QListView, QActionGroup
 from PyQt5.QtGui import QIcon
 
 from canvas import PeenerCanvas
-from machine import Machine
+from gcode_stream import GcodeFile
+from startup import load_ui, startup_timer
+from _find_overlaps import remove_overlaps
 from util import *
 
 class MainWindow(QMainWindow):
     settings_changed = pyqtSignal(object)
+    background_process_done = pyqtSignal(object, str, object)  # dialog, title, exception or None
 
     settings = {
-        '_version': 6,
+        '_version': 7,
         'port': '/dev/ttyAMA0',
         'tag_diam': 38 * 2,  # mm (engraveable area diameter)
         'line_width': 0.75,  # mm - Peener line width
@@ -32,7 +35,29 @@ class MainWindow(QMainWindow):
         'colorful_paths': False,
         'show_machine_pos': True,
         'draw_border': False,
-        'border_margin': 1
+        'border_margin': 1,
+        'gpio_backend': 'auto',  # auto, rpi or sim
+        'serial_backend': 'auto',  # auto, serial, sim, emu (GRBL emulator) or replay (of serial_replay_fp)
+        'time_scale': 1,  # Virtual time speed-up for the sim backends
+        'tracing': False,  # Record routine spans
+        'trace_dir': 'traces',  # Where each routine's Chrome trace is written while tracing
+        'metrics_port': None,  # Serve serial link metrics at http://127.0.0.1:<port>/metrics
+        'telemetry_db': 'jobs.sqlite',  # Every routine run is recorded here, None disables it
+        'checkpoint_fp': 'checkpoint.json',  # Where an interrupted engraving is saved for resuming
+        'api_port': None,  # Serve the job API at http://127.0.0.1:<port>, see job_server.py
+        'serial_record_dir': None,  # Record every serial session here, for replaying with serial_session.py
+        'serial_replay_fp': None,  # The recording the replay serial backend plays back
+        'gcode_quantize': False,  # Snap design coordinates to whole motor steps ($100/$101) instead of 0.01 mm
+        'adaptive_feed': False,  # Speed up on straights and gentle curves instead of peening everything at one feed
+        'feed_max': None,  # mm/min cap on adaptive feeds, None for the controller's $110/$111
+        'feed_corner_accel': 100,  # mm/s^2 allowed around curves with adaptive feeds, lower for crisper corners
+        'peen_scale_with_feed': False,  # Raise each path's peener speed with its mean feed to keep dots evenly spaced
+        'pwm_backend': 'auto',  # Peener PWM: 'sysfs' hardware PWM, 'gpio' RPi.GPIO's software PWM, 'auto' prefers hardware once the pin is muxed to PWM
+        'peener_pwm_freq': 1000,  # Hz
+        'peener_ramp': 0.2,  # Seconds the peener ramps over between stopped and full speed
+        'sensor_attempts': 3,  # Tag loads/peener lifts retried on the pins' switches before asking, see Machine.TAG_SENSOR_PIN
+        'lazy_startup': True,  # Show the window before setting up the machine, GPIO and design icons
+        'startup_log': 'startup.jsonl'  # Each start's time breakdown is appended here, None disables it
     }
 
     PREMADE_DESIGNS = { "Load Premade Design": None }
@@ -44,10 +69,16 @@ class MainWindow(QMainWindow):
 
     def __init__(self):
         super().__init__()
-        uic.loadUi('mainwindow.ui', self)
-        
+        self.load_settings_from_file()
+        self.save_settings_to_file()
+        startup_timer.mark("settings")
+
+        load_ui('mainwindow.ui', self)
+        startup_timer.mark("ui")
+
         self._background_process_dialog = None
         self._active_process = None
+        self.background_process_done.connect(self._on_background_process_done, Qt.QueuedConnection)
         self._settings_ui = (
             ('dry_run_only', self.actionDry_Run_Only),
             ('show_travel_lines', self.actionShow_Travel_Lines),
@@ -55,23 +86,23 @@ class MainWindow(QMainWindow):
             ('draw_border', self.drawBorderButton)
         )
 
-        self.load_settings_from_file()
-        self.save_settings_to_file()
-
         # Init Custom Path Drawing Widget
         self.canvas = PeenerCanvas(self.settings)
         self.canvas_label.parent().layout().replaceWidget(self.canvas_label, self.canvas)
         self.canvas_label.hide()
+        startup_timer.mark("canvas")
 
-        # Premade Design Select
+        # Premade Design Select, their icons are loaded with the machine in _finish_startup
         icon_size = 64
         self.designSelectBox.setView(QListView())
         self.designSelectBox.setIconSize(QSize(icon_size, icon_size))
         self.designSelectBox.setStyleSheet(f"QListView::item {{ height:{icon_size}px; }}")
-        self.refresh_premade_designs()
+        self._list_premade_designs()
+        startup_timer.mark("designs")
 
-        # Init Machine
-        self.machine = Machine(self, self.settings)
+        # The machine (and its GPIO and serial port) is made in _finish_startup
+        self.machine = None
+        self.job_server = None
 
         # File Menu Actions
         self.action_saveDesign.triggered.connect(self.save_design)
@@ -84,6 +115,19 @@ class MainWindow(QMainWindow):
         self.actionShow_Travel_Lines.toggled.connect(self.update_settings_from_ui)
         self.actionShow_Colorful_Paths.toggled.connect(self.update_settings_from_ui)
 
+        # Canvas Tools
+        self.menuEdit.addSeparator()
+        self.canvasToolGroup = QActionGroup(self)
+        for tool, title in (("draw", "Draw Tool"), ("erase", "Eraser Tool"), ("lasso", "Lasso Select Tool")):
+            action = self.menuEdit.addAction(title)
+            action.setCheckable(True)
+            action.setChecked(tool == self.canvas.tool)
+            action.triggered.connect(lambda *a, t=tool, **k: self.canvas.set_tool(t))
+            self.canvasToolGroup.addAction(action)
+        self.actionDelete_Selection = self.menuEdit.addAction("Delete Selection")
+        self.actionDelete_Selection.setShortcut(Qt.Key_Delete)
+        self.actionDelete_Selection.triggered.connect(self.canvas.delete_selection)
+
         # Machine Actions
         self.actionHome_Machine.triggered.connect(self.on_home_machine)
         self.actionPut_Machine_To_Sleep.triggered.connect(lambda *a, **k: self.machine.connect_and_sleep())
@@ -108,6 +152,11 @@ class MainWindow(QMainWindow):
             self.machine.home_clamp
         ))
 
+        self.actionResume_Engraving = self.menuMachine.addAction("Resume Engraving")
+        self.actionResume_Engraving.triggered.connect(self.on_resume_engraving)
+        self.actionRun_Gcode_File = self.menuMachine.addAction("Run G-code File...")
+        self.actionRun_Gcode_File.triggered.connect(self.on_run_gcode_file)
+
         # Clamp Actions
         self.actionOpen_Clamp.triggered.connect(lambda *a, **k: self.do_background_process(
             "Opening Clamp",
@@ -139,9 +188,9 @@ class MainWindow(QMainWindow):
         # self.actionHome_Tray.triggered.connect(self.machine.home_tray)
 
         # Peener Motor Actions
-        self.actionPulse_Peener_Once.triggered.connect(self.machine.pulse_peener)
+        self.actionPulse_Peener_Once.triggered.connect(lambda *a, **k: self.machine.pulse_peener())
         self.actionPulse_Peener_Until_Up.triggered.connect(lambda: self.machine.pulse_peener_until_up(False))
-        self.actionStop_Peener.triggered.connect(lambda: self.machine.pwm.start(0))
+        self.actionStop_Peener.triggered.connect(lambda: self.machine.stop_peener())
 
         # Machine Settings
         self.actionDry_Run_Only.triggered.connect(self.update_settings_from_ui)
@@ -152,6 +201,8 @@ class MainWindow(QMainWindow):
         self.redoButton.clicked.connect(self.canvas.redo_path)
         self.drawBorderButton.clicked.connect(self.update_settings_from_ui)
         self.smoothPathsButton.clicked.connect(self.canvas.smooth_paths)
+        self.joinPathsButton.clicked.connect(self.join_paths)
+        self.removeOverlapsButton.clicked.connect(self.remove_overlaps)
         self.autoSizeButton.clicked.connect(lambda *a, **k: self.do_background_process(
             "Auto Sizing Drawing",
             "Auto Sizing Drawing, Please Wait...",
@@ -164,11 +215,33 @@ class MainWindow(QMainWindow):
         ))
         self.designSelectBox.currentTextChanged.connect(self.load_premade_design)
 
+        # Toolpath Preview
+        self.previewSpeedBox.addItems([f"{speed}x" for speed in PeenerCanvas.PREVIEW_SPEEDS])
+        self.previewSpeedBox.setCurrentIndex(PeenerCanvas.PREVIEW_SPEEDS.index(self.canvas.preview_speed))
+        self.previewSpeedBox.currentIndexChanged.connect(lambda i: self.canvas.set_preview_speed(PeenerCanvas.PREVIEW_SPEEDS[i]))
+        self.previewButton.toggled.connect(self.toggle_preview)
+        self.previewPlayButton.clicked.connect(self.toggle_preview_playing)
+        self.previewSlider.sliderMoved.connect(lambda ms: self.canvas.set_preview_time(ms / 1000))
+        self.canvas.preview_time_changed.connect(self.on_preview_time_changed)
+        self.toggle_preview(False)
+
         # self.autoSizeButton.hide()
 
         # Control Buttons
         self.sendButton.clicked.connect(self.on_send_to_dotter)
 
+        # Everything that needs the machine stays disabled until _finish_startup has made it
+        self._machine_widgets = (
+            self.actionHome_Machine, self.actionPut_Machine_To_Sleep, self.actionWrite_Default_Settings,
+            self.actionHome_X, self.actionHome_Y, self.actionHome_Clamp, self.actionResume_Engraving,
+            self.actionRun_Gcode_File, self.actionOpen_Clamp, self.actionClose_Clamp, self.actionSpin_Tray_360_CCW,
+            self.actionSpin_Tray_360_CW, self.actionDispense_Tag, self.actionPulse_Peener_Once,
+            self.actionPulse_Peener_Until_Up, self.actionStop_Peener, self.sendButton, self.joinPathsButton,
+            self.removeOverlapsButton, self.previewButton,
+        )
+        for widget in self._machine_widgets:
+            widget.setEnabled(False)
+
         # Styling
         self.sendButton.setAutoFillBackground(True)
         self.sendButton.setStyleSheet("QPushButton { background-color: blue; }")
@@ -177,9 +250,6 @@ class MainWindow(QMainWindow):
 
         # Connect Events
         self.settings_changed.connect(self.canvas.update_settings)
-        self.settings_changed.connect(self.machine.update_settings)
-        self.machine.routine_dialog_event.connect(self.dialog_event_handler)
-        self.machine.report_machine_position.connect(lambda pos: self.canvas.update_machine_pos([e / self.settings['tag_diam'] for e in pos]))
 
         if self.FULL_SCREEN:
             if self.HIDE_TITLEBAR:
@@ -188,6 +258,40 @@ class MainWindow(QMainWindow):
             self.showMaximized()
         else:
             self.show()
+        startup_timer.mark("window")
+
+        # A lazy start lets the event loop draw the window before the hardware is set up
+        if self.settings.get('lazy_startup', True):
+            QTimer.singleShot(0, self._finish_startup)
+        else:
+            self._finish_startup()
+
+    def _finish_startup(self):
+        if self.settings.get('lazy_startup', True):
+            startup_timer.mark("first paint")
+        self._load_design_icons()
+        startup_timer.mark("design icons")
+        self._init_machine()
+        startup_timer.mark("machine")
+        print("Startup:\n" + startup_timer.report())
+        if self.settings.get('startup_log'):
+            startup_timer.save(self.settings['startup_log'])
+
+    def _init_machine(self):
+        from machine import Machine  # asyncio, pyserial and the GPIO backends come with it
+        self.machine = Machine(self, self.settings)
+
+        # Job API, jobs submitted to it queue up for this machine behind anything started from the UI
+        if self.settings.get('api_port'):
+            from farm import MachineFarm
+            from job_server import JobServer
+            self.job_server = JobServer(MachineFarm({"main": self.machine}), port=self.settings['api_port']).start()
+
+        self.settings_changed.connect(self.machine.update_settings)
+        self.machine.routine_dialog_event.connect(self.dialog_event_handler)
+        self.machine.report_machine_position.connect(lambda pos: self.canvas.update_machine_pos([e / self.settings['tag_diam'] for e in pos]))
+        for widget in self._machine_widgets:
+            widget.setEnabled(True)
 
     def load_settings_from_file(self):
         if os.path.isfile(self.SETTINGS_FP):
@@ -198,6 +302,11 @@ class MainWindow(QMainWindow):
                 if new_ver == old_ver:
                     self.settings.update(new_settings)
                     self.settings_changed.emit(self.settings)
+                elif new_ver is not None and new_ver < old_ver:
+                    # Settings added since keep their defaults, the ones the file has carry over
+                    print(f"Migrating Settings File from v{new_ver} to v{old_ver}")
+                    self.settings.update({key: value for key, value in new_settings.items() if key in self.settings and key != '_version'})
+                    self.settings_changed.emit(self.settings)
                 else:
                     print(f"Settings File Version too old, ignoring. v{new_ver} < v{old_ver}")
 
@@ -215,8 +324,8 @@ class MainWindow(QMainWindow):
             elem.setChecked(self.settings[key])
         self.settings_changed.emit(self.settings)
 
-    def dialog_event_handler(self, dialog_func, args, kwargs):
-        self.machine._dialog_resp = dialog_func(self, *args, **kwargs)
+    def dialog_event_handler(self, request):
+        request.respond(request.dialog(self, *request.args, **request.kwargs))
 
     # Canvas Functions
 
@@ -253,28 +362,44 @@ class MainWindow(QMainWindow):
             self.canvas.load_template(filepath[0])
 
     def refresh_premade_designs(self):
+        self._list_premade_designs()
+        self._load_design_icons()
+
+    def _list_premade_designs(self):
         self.designSelectBox.clear()
         self.PREMADE_DESIGNS = dict([("Load Premade Design", None)] + [
             (".".join(fp.split("\\")[-1].split("/")[-1].split(".")[:-1]).replace("_", " ").title(), fp)
             for fp in glob.glob('designs/*.json')
         ])
-        for i, (key, fp) in enumerate(self.PREMADE_DESIGNS.items()):
-            icon = QIcon(fp.replace(".json", ".png")) if fp else QIcon()
-            self.designSelectBox.addItem(icon, key)
+        self.designSelectBox.addItems(list(self.PREMADE_DESIGNS))
+
+    def _load_design_icons(self):
+        for i, fp in enumerate(self.PREMADE_DESIGNS.values()):
+            if fp:
+                self.designSelectBox.setItemIcon(i, QIcon(fp.replace(".json", ".png")))
 
     def do_background_process(self, title, msg, target, *args, **kwargs):
-        print(self._background_process_dialog)
         self._background_process_dialog = QMessageBox(
             QMessageBox.Information,
             title, 
             msg
         )
         self._background_process_dialog.setStandardButtons(QMessageBox.StandardButton.NoButton)
+        dialog = self._background_process_dialog
 
         def run():
-            target(*args, **kwargs)
-            # self._background_process_dialog.hide()
-            self._background_process_dialog = None
+            try:
+                result = target(*args, **kwargs)
+            except Exception as ex:
+                self.background_process_done.emit(dialog, title, ex)
+                return
+            # Machine actions return a Future straight away, the dialog stays up until it's done
+            if isinstance(result, Future):
+                result.add_done_callback(lambda future: self.background_process_done.emit(
+                    dialog, title, future.exception() if not future.cancelled() else None
+                ))
+            else:
+                self.background_process_done.emit(dialog, title, None)
         
         self._active_process = ProcessRunnable(run)
 
@@ -283,6 +408,15 @@ class MainWindow(QMainWindow):
 
         self._active_process.start()
 
+    def _on_background_process_done(self, dialog, title, ex):
+        # Queued to the GUI thread, the process finishes on a worker or machine thread
+        dialog.hide()
+        if self._background_process_dialog is dialog:
+            self._background_process_dialog = None
+        if ex is not None:
+            print(f"{title} failed: {ex!r}")
+            QMessageBox.critical(self, title, f"{title} failed: {ex}")
+
     # Decorators
 
     def __check_canvas(action):
@@ -361,8 +495,8 @@ class MainWindow(QMainWindow):
         self._progress_dialog.setModal(True)  # Disable main window GUI while dialog is open
         self._progress_dialog.show()
 
-        self._active_process = ProcessRunnable(target, args, kwargs)
-        self._active_process.start()
+        # Machine routines schedule themselves on the machine's event loop and return a Future.
+        self._active_process = target(*args, **kwargs)
 
     # Machine Functions
 
@@ -370,11 +504,67 @@ class MainWindow(QMainWindow):
     def clear_canvas(self, *a, **k):
         self.canvas.clear_paths()
 
+    @__check_canvas("Join Paths")
+    def join_paths(self, *a, **k):
+        before = self.machine.estimate_paths_time(self.canvas.get_paths())
+        removed = self.canvas.join_paths()
+        saved = before - self.machine.estimate_paths_time(self.canvas.get_paths())
+        QMessageBox.information(self, 'Join Paths', f'Removed {removed} peener stops, about {saved:.0f}s saved per tag.')
+
+    @__check_canvas("Remove Overlaps")
+    def remove_overlaps(self, *a, **k):
+        runs = self.canvas.find_overlaps()
+        if not runs:
+            QMessageBox.information(self, 'Remove Overlaps', 'No retraced lines found.')
+            return
+        before = self.canvas.get_paths()
+        after = remove_overlaps(before, runs)
+        saved = self.machine.estimate_paths_time(before) - self.machine.estimate_paths_time(after)
+        length = sum(
+            pt_dist(p1, p2) for segment in self.canvas.overlap_preview for p1, p2 in zip(segment, segment[1:])
+        ) * self.settings['tag_diam']
+        confirm = QMessageBox.question(
+            self, 'Remove Overlaps',
+            f'Remove the {len(runs)} retraced runs shown in red ({length:.0f} mm)? About {saved:.0f}s saved per tag.',
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes
+        )
+        if confirm == QMessageBox.Yes:
+            self.canvas.remove_overlaps()
+        else:
+            self.canvas.clear_overlap_preview()
+
+    def toggle_preview(self, on):
+        if on and not self.canvas.get_paths():
+            QMessageBox.warning(self, 'Cannot Preview', 'Cannot Preview, canvas needs at least one line.')
+            self.previewButton.setChecked(False)
+            return
+        if on:
+            timeline = self.machine.preview_timeline(self.canvas.get_paths())
+            self.previewSlider.setMaximum(int(timeline.duration * 1000))
+            self.canvas.start_preview(timeline)
+        else:
+            self.canvas.stop_preview()
+        for widget in (self.previewPlayButton, self.previewSlider, self.previewSpeedBox, self.previewTimeLabel):
+            widget.setEnabled(on)
+
+    def toggle_preview_playing(self, *a, **k):
+        if self.canvas.preview_playing:
+            self.canvas.pause_preview()
+        else:
+            self.canvas.play_preview()
+        self.on_preview_time_changed(self.canvas.preview_time)
+
+    def on_preview_time_changed(self, t):
+        if not self.previewSlider.isSliderDown():
+            self.previewSlider.setValue(int(t * 1000))
+        duration = self.canvas.preview.duration if self.canvas.preview else 0
+        self.previewTimeLabel.setText(f"{int(t // 60)}:{int(t % 60):02} / {int(duration // 60)}:{int(duration % 60):02}")
+        self.previewPlayButton.setText("Pause" if self.canvas.preview_playing else "Play")
+
     @__check_connection("Write Default Settings")
     def write_machine_defaults(self, *a, **k):
         print("Writing Default GRBL Settings")
-        with open('grbl_settings') as src:
-            self.machine.ser_send(*src.readlines())
+        return self.machine.sync_settings(self.machine.GRBL_SETTINGS_FP)
 
     @__check_connection("Home Machine")
     @__confirm_first("Home Machine", "Are you sure you want to home the machine?")
@@ -387,6 +577,16 @@ class MainWindow(QMainWindow):
     def on_send_to_dotter(self, *a, **k):
         self.do_progress_routine("Peen Design", self.machine.do_engraving_routine, self.canvas.get_paths())
 
+    @__check_connection("Resume Engraving")
+    def on_resume_engraving(self, *a, **k):
+        self.do_progress_routine("Resume Design", self.machine.resume_engraving_routine)
+
+    @__check_connection("Run G-code File")
+    def on_run_gcode_file(self, *a, **k):
+        filepath = QFileDialog.getOpenFileName(self, 'Run G-code File', './', "G-code file (*.nc *.ngc *.gcode *.tap)")[0]
+        if filepath and os.path.isfile(filepath):
+            self.do_progress_routine("Run G-code File", self.machine.do_gcode_routine, GcodeFile(filepath))
+
 class ProcessRunnable(QRunnable, QObject):
     def __init__(self, target, args=[], kwargs={}):
         QRunnable.__init__(self)
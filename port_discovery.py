@@ -0,0 +1,185 @@
+import os
+import sys
+import glob
+import time
+import fnmatch
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+from serial.tools import list_ports
+
+class PortInfo:
+    def __init__(self, device, description="", vid=None, pid=None, serial_number=None, by_id=None):
+        self.device = device
+        self.description = description
+        self.vid = vid
+        self.pid = pid
+        self.serial_number = serial_number
+        self.by_id = by_id  # Stable /dev/serial/by-id path on Linux
+        self.banner = None  # GRBL banner if the port has been probed and answered
+
+    @property
+    def is_grbl(self):
+        return self.banner is not None
+
+    @property
+    def path(self):
+        # Prefer the by-id link, it survives re-enumeration after a replug
+        return self.by_id or self.device
+
+    def __repr__(self):
+        ids = f" {self.vid:04x}:{self.pid:04x}" if self.vid is not None and self.pid is not None else ""
+        return f"<PortInfo {self.path}{ids} {self.banner or self.description}>"
+
+class PortDiscovery:
+    """
+        Finds serial ports from OS metadata (sysfs on Linux) instead of opening every /dev/tty* node,
+        probes the likely ones in parallel for a GRBL banner, and caches results until the device list changes.
+    """
+
+    BAUDRATE = 115200
+    PROBE_TIMEOUT = 2.5  # Seconds, an Uno's bootloader takes ~1.5 s after the port opens
+    PROBE_QUIET = 0.3  # Seconds to listen for the power-on banner before sending a soft reset
+    CACHE_TTL = 5  # Seconds, only used where the device list can't be watched
+
+    # USB serial adapters GRBL boards ship with (Arduino, CH340, FTDI, CP210x)
+    KNOWN_USB_IDS = {
+        (0x2341, 0x0043), (0x2341, 0x0001), (0x2341, 0x0243), (0x2a03, 0x0043),
+        (0x1a86, 0x7523), (0x0403, 0x6001), (0x10c4, 0xea60),
+    }
+    # Onboard UARTs that only show up as candidates, they carry no USB ids
+    UART_GLOBS = ("/dev/ttyAMA*", "/dev/serial0", "/dev/ttyS0")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ports = None
+        self._probed = set()  # Devices probed since the last enumeration, their PortInfo keeps the result
+        self._signature = None
+        self._cached_at = 0
+        self._claims = weakref.WeakKeyDictionary()  # owner (e.g. a Machine) -> port it holds
+        self._claim_lock = threading.Lock()
+
+    def list_ports(self, refresh=False):
+        """Enumerate ports from metadata only, never opens a device so it is safe to call from the GUI thread."""
+        with self._lock:
+            signature = self._device_signature()
+            if refresh or self._ports is None or self._is_stale(signature):
+                self._ports = self._enumerate()
+                self._probed = set()
+                self._signature = signature
+                self._cached_at = time.monotonic()
+            return list(self._ports)
+
+    def probe(self, refresh=False, exclude=()):
+        """
+            Probe every candidate port in parallel for a GRBL banner, returns the ports with `banner` filled in.
+            Each port is probed once per enumeration, an excluded one is left for a later call that doesn't exclude it.
+        """
+        ports = self.list_ports(refresh)
+        candidates = [
+            p for p in ports
+            if self._is_candidate(p) and p.device not in self._probed and p.device not in exclude and p.path not in exclude
+        ]
+        if candidates:
+            with ThreadPoolExecutor(len(candidates)) as pool:
+                for port, banner in zip(candidates, pool.map(self._probe_port, candidates)):
+                    port.banner = banner
+            self._probed.update(p.device for p in candidates)
+        return ports
+
+    def best_port(self, exclude=()):
+        """The port most likely to be the GRBL controller, or None."""
+        ports = [p for p in self.probe(exclude=exclude) if p.device not in exclude and p.path not in exclude]
+        ranked = sorted(ports, key=lambda p: (p.is_grbl, self._is_known_usb(p), self._is_candidate(p)), reverse=True)
+        return ranked[0].path if ranked and self._is_candidate(ranked[0]) else None
+
+    def held_ports(self, owner=None):
+        """Ports claimed by anyone but `owner`, opening one to probe it would reset a running controller."""
+        return {port for holder, port in list(self._claims.items()) if holder is not owner}
+
+    def claim(self, owner, port=None, exclude=()):
+        """
+            Note that `owner` holds `port`, or without a port pick the best one nobody else holds and claim that.
+            Claims go when the owner does. Returns the port, None if there wasn't one.
+        """
+        with self._claim_lock:
+            if port is None:
+                port = self.best_port(exclude=set(exclude) | self.held_ports(owner))
+            if port is not None:
+                self._claims[owner] = port
+            return port
+
+    def release(self, owner):
+        with self._claim_lock:
+            self._claims.pop(owner, None)
+
+    def _is_stale(self, signature):
+        if signature is None:
+            return time.monotonic() - self._cached_at > self.CACHE_TTL
+        return signature != self._signature
+
+    def _device_signature(self):
+        # udev adds and removes entries here whenever a serial device is plugged or unplugged
+        if not sys.platform.startswith('linux'):
+            return None
+        signature = []
+        for folder in ("/sys/class/tty", "/dev/serial/by-id"):
+            try:
+                signature.append((folder, os.stat(folder).st_mtime_ns, len(os.listdir(folder))))
+            except OSError:
+                signature.append((folder, None, 0))
+        return tuple(signature)
+
+    def _enumerate(self):
+        by_id = {}
+        for link in glob.glob("/dev/serial/by-id/*"):
+            by_id[os.path.realpath(link)] = link
+
+        ports = {}
+        for info in list_ports.comports():
+            ports[info.device] = PortInfo(
+                info.device, info.description, info.vid, info.pid, info.serial_number,
+                by_id.get(os.path.realpath(info.device))
+            )
+        for pattern in self.UART_GLOBS:
+            for device in glob.glob(pattern):
+                real = os.path.realpath(device)
+                if device not in ports and real not in ports:
+                    ports[device] = PortInfo(device, "Onboard UART")
+        return list(ports.values())
+
+    def _is_known_usb(self, port):
+        return (port.vid, port.pid) in self.KNOWN_USB_IDS
+
+    def _is_candidate(self, port):
+        return (
+            port.vid is not None
+            or port.device.startswith("COM")
+            or any(fnmatch.fnmatch(port.device, pattern) for pattern in self.UART_GLOBS)
+        )
+
+    def _probe_port(self, port):
+        try:
+            with serial.Serial(port.device, self.BAUDRATE, timeout=0.05, write_timeout=0.5) as ser:
+                deadline = time.monotonic() + self.PROBE_TIMEOUT
+                reset_at = time.monotonic() + self.PROBE_QUIET
+                reset_sent = False
+                while time.monotonic() < deadline:
+                    line = ser.readline().decode(errors="replace").strip()
+                    if line.startswith("Grbl "):
+                        return line
+                    if not reset_sent and time.monotonic() > reset_at:
+                        ser.write(b"\r\n\x18")  # No power-on banner, ask for one with a soft reset
+                        reset_sent = True
+        except (OSError, serial.SerialException):
+            pass
+        return None
+
+discovery = PortDiscovery()  # Shared instance so every caller benefits from the cache
+
+if __name__ == "__main__":
+    for port in discovery.probe():
+        print(port)
+    print(f"Best: {discovery.best_port()}")
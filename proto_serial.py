@@ -1,91 +1,232 @@
-import serial
 import time
+import threading
 
-import platform
-IS_FAKE = any([e in platform.platform().lower() for e in ["macos", "windows"]])
+from tracing import tracer as default_tracer
+from serial_metrics import SerialMetrics, RX_BUFFER_SIZE
 
-DEBUG_PRINT = True
-RX_BUFFER_SIZE = 128
+DEBUG_PRINT = False
 
 class ProtoSerial:
     INIT_STR = "\r\n\r\n"
+    RESET = chr(24)
+    STATUS = "?"
+    REALTIME_CMDS = ("?", "!", "~", RESET)  # Handled by GRBL immediately, never buffered or acknowledged
 
-    def __init__(self):
-        if not IS_FAKE:
-            self.ser = serial.Serial()
-            self.ser.baudrate = 115200
-        else:
-            self._connected = True
+    BANNER_PREFIX = "Grbl "  # e.g. "Grbl 1.1h ['$' for help]"
+    BANNER_TIMEOUT = 2.5  # Seconds to wait for the banner after opening the port or a reset
+    STATUS_TIMEOUT = 1  # Seconds to wait for a status report
+    RESP_TIMEOUT = 120  # Seconds to wait for an ack, homing cycles only ack once they're complete
+    STATUS_POLL = 0.5  # Seconds between status reports requested during a stream, for the planner metrics
+    READ_TIMEOUT = 0.05
+
+    def __init__(self, transport=None, tracer=None):
+        self.tracer = tracer or default_tracer
+        self._abort = threading.Event()
+        self._lock = threading.Lock()  # Serialize streams, realtime writes deliberately skip this
+        self._pending = []  # Character counts of lines sent to GRBL but not yet acknowledged
+        self.acked_lines = 0  # Running count of acknowledged lines, for checkpointing a stream
+        self._keep_oks = True
+        self._polled = 0  # When the last status report was requested during a stream
+        self.listeners = []  # Called with every line received from GRBL
+        self.banner = None
+        self.metrics = SerialMetrics()
+
+        # Anything with pyserial's interface works as the transport, e.g. hardware.SimulatedSerial
+        if transport is None:
+            import serial
+            transport = serial.Serial()
+        self.ser = transport
+        self.ser.baudrate = 115200
+        self.ser.timeout = self.READ_TIMEOUT
 
     def connect(self, port):
-        if IS_FAKE:
-            self._connected = True
-            return
         if self.ser.is_open:
             self.ser.close()
         self.ser.port = port
         self.ser.open()
+        self._pending = []
+        self.metrics.reset_pending()
+
+        # Boards that reset when the port opens print the banner by themselves, otherwise wake the parser and reset it.
+        if self._wait_for_banner() is None:
+            self.ser.write(self.INIT_STR.encode())
+            if self.reset() is None:
+                print(f"No GRBL banner received from {port}")
+        return self.banner
+
+    def reset(self):
+        """Soft reset GRBL and block until its banner arrives, returns the banner or None on timeout."""
+        self.ser.write(self.RESET.encode())
+        self.metrics.realtime_sent()
+        self._pending = []
+        self.metrics.reset_pending()
+        return self._wait_for_banner()
 
-        self.send(self.INIT_STR, False)
-        time.sleep(2)
-        self.ser.flushInput()
+    def _wait_for_banner(self):
+        self.banner = None
+        deadline = time.monotonic() + self.BANNER_TIMEOUT
+        while time.monotonic() < deadline and not self._abort.is_set():
+            line = self._readline()
+            if line.startswith(self.BANNER_PREFIX):
+                self.banner = line
+                # Pick up the startup messages (e.g. the unlock prompt) that follow the banner
+                while self._readline():
+                    pass
+                break
+        return self.banner
 
     def disconnect(self):
-        if IS_FAKE:
-            self._connected = False
-            return
         if self.ser.is_open:
             self.ser.close()
 
     def is_connected(self):
-        if IS_FAKE:
-            return self._connected
         return self.ser.is_open
 
-    def send(self, gcode, wait_for_resp=False):
+    def abort(self):
+        """Stop the line currently being streamed as soon as possible, safe to call from any thread."""
+        self._abort.set()
+
+    def clear_abort(self):
+        self._abort.clear()
+
+    def is_aborted(self):
+        return self._abort.is_set()
+
+    def write_realtime(self, cmd):
+        """Write a single-character realtime command (e.g. feed hold) immediately, bypassing the stream."""
+        if self.ser.is_open:
+            self.ser.write(cmd.encode())
+            self.metrics.realtime_sent()
+
+    def send(self, gcode, wait_for_resp=False, keep_oks=True):
+        """
+            Stream g-code to GRBL using character counting, returns every line received while sending.
+
+            `gcode` is a line or any iterable of lines, which is only consumed as GRBL's RX buffer makes room, so
+            a generator streams a program of any size. With `wait_for_resp` the call blocks until every line has
+            been acknowledged, otherwise it returns once the last line is written and the remaining acks are
+            collected by later calls. Without `keep_oks` plain acks and status reports are left out of the returned
+            lines. A stream running longer than STATUS_POLL asks GRBL for status reports as it goes.
+        """
         if type(gcode) is str:
             gcode = [gcode]
 
-        if IS_FAKE:
-            if DEBUG_PRINT:
-                print(f"Send: {gcode}")
-            if any(["$H" in e for e in gcode]):
-                time.sleep(5)
-            elif any(["G0" in e for e in gcode]):
-                time.sleep(0.1)
-            return ["Idle"]
-
-        grbl_buffer = []
+        with self._lock, self.tracer.span("send", "serial", wait=wait_for_resp) as span:
+            sent = self.metrics.counters["lines_tx"]
+            self._keep_oks = keep_oks
+            try:
+                resps = self._send(gcode, wait_for_resp)
+            finally:
+                self._keep_oks = True
+            span.set(lines=self.metrics.counters["lines_tx"] - sent, resps=len(resps) if resps else 0)
+            return resps
+
+    def command(self, line):
+        """
+            Send one line and wait for its own ack, returns True only if GRBL answered it with `ok` (not when the
+            abort stopped it, it timed out or GRBL answered an error).
+        """
+        resps = self.send(line, True)
+        if not resps or self._abort.is_set() or self._pending:
+            return False
+        # Acks come back in order, so once nothing is pending the last one is this line's
+        acks = [resp for resp in resps if resp == "ok" or resp.startswith("error")]
+        return bool(acks) and acks[-1] == "ok"
+
+    def _send(self, gcode, wait_for_resp):
+        if not self.ser.is_open:
+            return False
+
         resps = []
+        self._polled = time.monotonic()
         for line in gcode:
+            if self._abort.is_set():
+                break
+            if line in self.REALTIME_CMDS:
+                resps += self._send_realtime(line)
+                continue
             line = line.strip()
-            grbl_buffer.append(len(line)+1) # Track number of characters in grbl serial read buffer
-            while sum(grbl_buffer) >= RX_BUFFER_SIZE-1 or self.ser.in_waiting:
-                resps.append(self.ser.readline().decode().strip()) # Wait for grbl response
-                del grbl_buffer[0] # Delete the block character count corresponding to the last 'ok'
-            self.ser.write(line + '\n') # Send g-code block to grbl
+            if not line:
+                continue
+
+            # Wait for room in GRBL's RX buffer
+            line_len = len(line) + 1
+            while self._pending and sum(self._pending) + line_len > RX_BUFFER_SIZE - 1:
+                if not self._wait_for_ack(resps):
+                    return resps
+
+            if DEBUG_PRINT:
+                print(f'Sending: {self._escape_str(line)}')
+            self.ser.write(f'{line}\n'.encode())
+            self._pending.append(line_len)
+            self.metrics.line_sent(line_len)
+            self._poll_status()
+            while self.ser.in_waiting:
+                self._read_response(resps)
+
+        while wait_for_resp and self._pending:
+            if not self._wait_for_ack(resps):
+                break
+        return resps
+
+    def _send_realtime(self, cmd):
+        if cmd == self.RESET:
+            banner = self.reset()
+            return [banner] if banner else []
+
+        if DEBUG_PRINT:
+            print(f'Sending: {self._escape_str(cmd)}')
+        self.ser.write(cmd.encode())
+        self.metrics.realtime_sent()
+        if cmd != self.STATUS:
+            return []
 
         resps = []
-        if self.ser.is_open:
-            # Stream g-code to grbl
-            for line in gcode:
-                l = line.strip()
-                if not line:
-                    continue
-                if DEBUG_PRINT:
-                    print(f'Sending: {self._escape_str(line)}')
-                self.ser.write((f'{l}\n').encode())
-                time.sleep(0.05)
-                for _ in range(5 if not wait_for_resp else 12e3): # Wait for stray reponses or up to 2mins for real response.
-                    time.sleep(0.01)
-                    if self.ser.in_waiting:
-                        break
-                while self.ser.in_waiting:
-                    resps += [self.ser.readline().decode().strip()]
-                    if DEBUG_PRINT:
-                        print(f'  Recv: {self._escape_str(resps[-1])}')
-            return resps
-        return False
+        deadline = time.monotonic() + self.STATUS_TIMEOUT
+        while time.monotonic() < deadline and not self._abort.is_set():
+            line = self._read_response(resps)
+            if line.startswith("<"):
+                break
+        return resps
+
+    def _wait_for_ack(self, resps):
+        deadline = time.monotonic() + self.RESP_TIMEOUT
+        n_pending = len(self._pending)
+        while len(self._pending) == n_pending:
+            if self._abort.is_set() or time.monotonic() > deadline:
+                return False
+            self._poll_status()
+            self._read_response(resps)
+        return True
+
+    def _poll_status(self):
+        # GRBL only reports its planner when asked, so a long stream asks now and then. The report is read with the acks.
+        now = time.monotonic()
+        if now - self._polled >= self.STATUS_POLL:
+            self._polled = now
+            self.ser.write(self.STATUS.encode())
+            self.metrics.realtime_sent()
+
+    def _read_response(self, resps):
+        line = self._readline()
+        if line:
+            if self._keep_oks or not (line == "ok" or line.startswith("<")):
+                resps.append(line)
+            if (line == "ok" or line.startswith("error")) and self._pending:
+                del self._pending[0]  # Delete the block character count corresponding to this ack
+                self.acked_lines += 1
+        return line
+
+    def _readline(self):
+        raw = self.ser.readline()
+        line = raw.decode(errors="replace").strip()
+        if line:
+            self.metrics.line_received(line, len(raw))
+            if DEBUG_PRINT:
+                print(f'  Recv: {self._escape_str(line)}')
+            for listener in self.listeners:
+                listener(line)
+        return line
 
     def _escape_str(self, string):
-        return string.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
\ No newline at end of file
+        return string.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
@@ -1,14 +1,19 @@
+from startup import startup_timer  # First, so the start-up breakdown includes importing Qt
+
 import sys
 
 from PyQt5 import QtWidgets, QtGui
 from PyQt5.QtWidgets import QStyleFactory
+startup_timer.mark("import qt")
 
 from mainwindow import MainWindow
+startup_timer.mark("import app")
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
     app.setWindowIcon(QtGui.QIcon('img/icon.png'))
     app.setStyle(QStyleFactory.create('fusion'))
+    startup_timer.mark("qt app")
 
     window = MainWindow()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,203 @@
+"""
+Counters, ack latency histogram and buffer occupancy for the GRBL serial link.
+
+ProtoSerial feeds a SerialMetrics as it streams, each hook is a few integer updates so it stays on
+in production. `snapshot()` is the API, `to_text()` renders the same numbers in Prometheus' text
+format and `serve_metrics()` exposes that on localhost.
+
+A job is link-bound when GRBL's planner keeps running dry while the RX buffer is empty, the host
+can't feed it fast enough, and motion-bound when the planner stays full and lines wait for room.
+"""
+
+import time
+import bisect
+import threading
+import collections
+
+RX_BUFFER_SIZE = 128
+PLANNER_BLOCKS = 15  # GRBL 1.1's planner buffer on a 328p, status reports give the free count
+
+# Upper bounds of the ack latency buckets in seconds, the last bucket is everything slower
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, None without observations."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        return {
+            "buckets": dict(zip([*map(str, self.buckets), "inf"], self.counts)),
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+class SerialMetrics:
+    def __init__(self, max_samples=10_000):
+        self.start = time.monotonic()
+        self.counters = collections.Counter()
+        self.ack_latency = Histogram()
+        self.rx_samples = collections.deque(maxlen=max_samples)  # (time, estimated RX buffer bytes in use)
+        self.planner_samples = collections.deque(maxlen=max_samples)  # (time, planner blocks in use) from status reports
+        self.rx_used = 0
+        self._sent = collections.deque()  # (time, length) of every line still waiting for its ack
+        self._lock = threading.Lock()  # The serial thread appends samples while snapshot() reads them
+
+    # ProtoSerial hooks
+
+    def line_sent(self, length):
+        now = time.monotonic()
+        self.counters["lines_tx"] += 1
+        self.counters["bytes_tx"] += length
+        with self._lock:
+            self._sent.append((now, length))
+            self.rx_used += length
+            self.rx_samples.append((now, self.rx_used))
+
+    def realtime_sent(self, length=1):
+        self.counters["realtime_tx"] += 1
+        self.counters["bytes_tx"] += length
+
+    def line_received(self, line, length):
+        self.counters["lines_rx"] += 1
+        self.counters["bytes_rx"] += length
+        if line == "ok" or line.startswith("error"):
+            self._acked(line != "ok")
+        elif line.startswith("ALARM"):
+            self.counters["alarms"] += 1
+        elif line.startswith("<"):
+            self._status(line)
+
+    def _acked(self, error):
+        self.counters["errors" if error else "oks"] += 1
+        with self._lock:
+            if self._sent:
+                now = time.monotonic()
+                sent_at, length = self._sent.popleft()
+                self.ack_latency.observe(now - sent_at)
+                self.rx_used -= length
+                self.rx_samples.append((now, self.rx_used))
+
+    def _status(self, line):
+        # <Run|MPos:0.000,0.000,0.000|Bf:15,128|FS:0,0>, Bf is only reported when $10 asks for it.
+        # An idle planner is empty because there's nothing to do, so only moving samples count.
+        fields = line.strip("<>").split("|")
+        if not fields[0].startswith("Run"):
+            return
+        buffers = [field[3:] for field in fields[1:] if field.startswith("Bf:")]
+        with self._lock:
+            if buffers:
+                used = PLANNER_BLOCKS - int(buffers[0].split(",")[0])
+            else:
+                # GRBL only leaves lines unacked in its RX buffer while the planner has no room for them, so without
+                # Bf lines waiting on acks count as a full planner and none waiting as one running dry
+                used = PLANNER_BLOCKS if self._sent else 0
+            self.planner_samples.append((time.monotonic(), used))
+
+    def reset_pending(self):
+        """GRBL dropped its buffers (reset or reconnect), no more acks are coming for what was sent."""
+        with self._lock:
+            self._sent.clear()
+            self.rx_used = 0
+
+    # API
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.start
+        with self._lock:
+            rx = [used for _, used in self.rx_samples]
+            planner = [used for _, used in self.planner_samples]
+            ack_latency = self.ack_latency.snapshot()
+            rx_used = self.rx_used
+            counters = dict(self.counters)
+        return {
+            "elapsed": elapsed,
+            "counters": counters,
+            "bytes_tx_per_s": counters.get("bytes_tx", 0) / elapsed if elapsed else 0,
+            "bytes_rx_per_s": counters.get("bytes_rx", 0) / elapsed if elapsed else 0,
+            "ack_latency": ack_latency,
+            "rx_buffer_used": rx_used,
+            "rx_buffer_mean": sum(rx) / len(rx) / RX_BUFFER_SIZE if rx else None,
+            "planner_mean": sum(planner) / len(planner) / PLANNER_BLOCKS if planner else None,
+            "bound": self._bound(planner),
+        }
+
+    def bound(self):
+        """'motion' when the planner was mostly full, 'link' when it mostly ran short, None without status samples."""
+        with self._lock:
+            planner = [used for _, used in self.planner_samples]
+        return self._bound(planner)
+
+    @staticmethod
+    def _bound(planner):
+        if not planner:
+            return None
+        full = sum(1 for used in planner if used >= PLANNER_BLOCKS - 1)
+        return "motion" if full >= len(planner) / 2 else "link"
+
+    def to_text(self):
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f"grbl_serial_{name}_total {value}")
+        for name in ("bytes_tx_per_s", "bytes_rx_per_s", "rx_buffer_used", "rx_buffer_mean", "planner_mean"):
+            if snap[name] is not None:
+                lines.append(f"grbl_serial_{name} {snap[name]:g}")
+        latency = snap["ack_latency"]
+        seen = 0
+        for bound, n in latency["buckets"].items():
+            seen += n
+            lines.append(f'grbl_serial_ack_latency_seconds_bucket{{le="{"+Inf" if bound == "inf" else bound}"}} {seen}')
+        lines.append(f"grbl_serial_ack_latency_seconds_sum {latency['total']:g}")
+        lines.append(f"grbl_serial_ack_latency_seconds_count {latency['count']}")
+        if snap["bound"]:
+            lines.append(f'grbl_serial_bound{{by="{snap["bound"]}"}} 1')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        self.__init__(self.rx_samples.maxlen)
+
+def serve_metrics(metrics, port, host="127.0.0.1"):
+    """Serve `metrics.to_text()` at http://host:port/metrics on a daemon thread, returns the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Slow to import, most runs don't serve metrics
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.to_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
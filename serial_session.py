@@ -0,0 +1,303 @@
+"""
+Record the GRBL serial link during real jobs and replay it to a Machine later.
+
+RecordingSerial wraps any transport and writes every byte in both directions, with the machine clock's
+time, to a JSON lines file per port session. Machine also notes every call made into it (routines and manual
+actions, with their arguments) and every dialog answer, so a recording holds everything needed to run the same
+jobs again.
+
+ReplaySerial stands in for the port. Responses are tied to the host write they followed in the recording
+and are released the same (virtual) time after the host makes that write again, so a replay keeps its
+causality however the host's timing shifts. Status reports are the exception: the host polls them on its
+own schedule, so each `?` is answered with the last report recorded at that point of the timeline.
+
+    python serial_session.py sessions/session_20261019_101500.jsonl --time-scale 20
+"""
+
+import os
+import sys
+import json
+import time
+import pathlib
+import argparse
+import threading
+import collections
+
+from hardware import Clock
+from gcode_stream import GcodeStream, GcodeFile
+
+FORMAT = "grbl-serial-session"
+VERSION = 1
+STATUS_QUERY = b"?"
+
+class ReplayMismatch(Exception):
+    pass
+
+def encode_arg(value):
+    """A call's argument as JSON, tagged when decode_arg needs its type to rebuild it (e.g. a GcodeFile)."""
+    if isinstance(value, GcodeFile):
+        return {"__arg__": "GcodeFile", "filepath": os.fspath(value.filepath)}
+    if isinstance(value, GcodeStream):
+        # A one-shot stream would be used up by recording it, so its lines are left out and it can't be replayed
+        return {"__arg__": "GcodeStream", "lines": list(value.source) if value.reopenable else None}
+    if isinstance(value, os.PathLike):
+        return {"__arg__": "path", "path": os.fspath(value)}
+    return value
+
+def decode_arg(value):
+    if not isinstance(value, dict) or "__arg__" not in value:
+        return value
+    if value["__arg__"] == "GcodeFile":
+        return GcodeFile(value["filepath"])
+    if value["__arg__"] == "GcodeStream":
+        if value["lines"] is None:
+            raise ValueError("A one-shot G-code stream was not recorded and can't be replayed")
+        return GcodeStream.of(value["lines"])
+    if value["__arg__"] == "path":
+        return pathlib.Path(value["path"])
+    raise ValueError(f"Unknown argument type {value['__arg__']!r}")
+
+class RecordingSerial:
+    """Passes everything through to `transport`, logging it to a new file in `directory` each time the port opens."""
+
+    def __init__(self, transport, directory, clock=None):
+        self.transport = transport
+        self.directory = directory
+        self.clock = clock or Clock()
+        self.filepath = None
+        self._out = None
+        self._noted = []  # Annotations made while the port was closed, written once it opens
+        self._lock = threading.Lock()
+
+    # pyserial's settings are the wrapped transport's
+    port = property(lambda self: self.transport.port, lambda self, v: setattr(self.transport, "port", v))
+    baudrate = property(lambda self: self.transport.baudrate, lambda self, v: setattr(self.transport, "baudrate", v))
+    timeout = property(lambda self: self.transport.timeout, lambda self, v: setattr(self.transport, "timeout", v))
+    is_open = property(lambda self: self.transport.is_open)
+    in_waiting = property(lambda self: self.transport.in_waiting)
+
+    def _record(self, kind, data=b"", **extra):
+        event = {"t": self.clock.now(), "kind": kind, "data": data.decode("latin-1"), **extra}
+        with self._lock:
+            if self._out is not None:
+                self._out.write(json.dumps(event, default=str) + "\n")
+            elif kind not in ("tx", "rx", "flush"):
+                self._noted.append(event)
+
+    def annotate(self, kind, **data):
+        """Note something the host did (a routine started, a dialog answered) in the recording."""
+        self._record(kind, **data)
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.filepath = os.path.join(self.directory, time.strftime("session_%Y%m%d_%H%M%S.jsonl"))
+        self._out = open(self.filepath, "w", buffering=1)
+        self._out.write(json.dumps({"format": FORMAT, "version": VERSION, "port": self.transport.port, "recorded": time.time()}) + "\n")
+        for event in self._noted:
+            self._out.write(json.dumps(event, default=str) + "\n")
+        self._noted = []
+        self._record("open")
+        self.transport.open()
+
+    def close(self):
+        self.transport.close()
+        self._record("close")
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+    def reset_input_buffer(self):
+        self.transport.reset_input_buffer()
+        self._record("flush")
+
+    def write(self, data):
+        self._record("tx", data)
+        return self.transport.write(data)
+
+    def readline(self):
+        line = self.transport.readline()
+        if line:
+            self._record("rx", line)
+        return line
+
+def load_session(filepath):
+    """(header, events) of a recording, every event's data back in bytes."""
+    with open(filepath) as src:
+        header = json.loads(src.readline())
+        if header.get("format") != FORMAT or header.get("version") != VERSION:
+            raise ValueError(f"{filepath} is not a version {VERSION} serial session")
+        events = [json.loads(line) for line in src if line.strip()]
+    for event in events:
+        event["data"] = event["data"].encode("latin-1")
+    return header, events
+
+class _Exchange:
+    """A host write and the non-status lines GRBL sent after it, at their recorded delays."""
+
+    def __init__(self, t, data):
+        self.t = t
+        self.data = data
+        self.replies = []  # (delay, line)
+
+class ReplaySerial:
+    """
+        Plays a recording back with pyserial's interface. Timing follows `clock`, so a VirtualClock replays
+        faster than recorded. Host writes that differ from the recording are counted in `mismatches`, or
+        raise ReplayMismatch with `strict`.
+    """
+
+    def __init__(self, filepath, clock=None, strict=False):
+        self.clock = clock or Clock()
+        self.strict = strict
+        self.port = None
+        self.baudrate = 115200
+        self.timeout = None
+        self.is_open = False
+        self.mismatches = []  # (exchange index, expected, written)
+        self.header, events = load_session(filepath)
+        self.annotations = [e for e in events if e["kind"] not in ("tx", "rx", "flush")]
+
+        # Writes and what they got back, the open event stands in for a write so the boot banner has an anchor
+        self.exchanges = []
+        self.statuses = []  # (recorded time, line)
+        for event in events:
+            if event["kind"] == "open":
+                self.exchanges.append(_Exchange(event["t"], None))
+            elif event["kind"] == "tx" and event["data"] != STATUS_QUERY:
+                self.exchanges.append(_Exchange(event["t"], event["data"]))
+            elif event["kind"] == "rx" and event["data"].startswith(b"<"):
+                self.statuses.append((event["t"], event["data"]))
+            elif event["kind"] == "rx" and self.exchanges:
+                self.exchanges[-1].replies.append((event["t"] - self.exchanges[-1].t, event["data"]))
+
+        self._next = 0  # Next exchange expected
+        self._anchor = None  # (recorded time, replay time) of the last matched exchange
+        self._status_index = 0
+        self._due = collections.deque()  # (replay time, line)
+        self._lock = threading.Condition()
+
+    def _play(self, data):
+        with self._lock:
+            if self._next >= len(self.exchanges):
+                self._mismatch(None, data)
+                return
+            exchange = self.exchanges[self._next]
+            if exchange.data != data:
+                self._mismatch(exchange.data, data)
+            self._next += 1
+            now = self.clock.now()
+            self._anchor = (exchange.t, now)
+            for delay, line in exchange.replies:
+                self._due.append((now + delay, line))
+            self._lock.notify_all()
+
+    def _mismatch(self, expected, data):
+        self.mismatches.append((self._next, expected, data))
+        if self.strict:
+            raise ReplayMismatch(f"Write {self._next}: expected {expected!r}, got {data!r}")
+
+    def _status(self):
+        # The last report recorded at the point of the timeline the replay has reached
+        if not self.statuses:
+            return b"<Idle|MPos:0.000,0.000,0.000|FS:0,0>\r\n"
+        recorded_now = self._anchor[0] + self.clock.now() - self._anchor[1] if self._anchor else 0
+        while self._status_index + 1 < len(self.statuses) and self.statuses[self._status_index + 1][0] <= recorded_now:
+            self._status_index += 1
+        return self.statuses[self._status_index][1]
+
+    def open(self):
+        self.is_open = True
+        self._play(None)
+
+    def close(self):
+        self.is_open = False
+
+    @property
+    def in_waiting(self):
+        now = self.clock.now()
+        with self._lock:
+            return sum(len(line) for due, line in self._due if due <= now)
+
+    def reset_input_buffer(self):
+        now = self.clock.now()
+        with self._lock:
+            while self._due and self._due[0][0] <= now:
+                self._due.popleft()
+
+    def write(self, data):
+        if data == STATUS_QUERY:
+            with self._lock:
+                self._due.appendleft((self.clock.now(), self._status()))
+                self._lock.notify_all()
+        else:
+            self._play(data)
+        return len(data)
+
+    def readline(self):
+        deadline = time.monotonic() + (self.timeout if self.timeout is not None else float("inf"))
+        with self._lock:
+            while True:
+                if self._due and self._due[0][0] <= self.clock.now():
+                    return self._due.popleft()[1]
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    return b""
+                if self._due:
+                    wait = min(wait, (self._due[0][0] - self.clock.now()) / self.clock.scale)
+                self._lock.wait(max(wait, 0))
+
+def replay(filepath, time_scale=1, strict=False):
+    """
+        Run every routine noted in a recording against its replay, with the recorded dialog answers.
+        Returns (replay transport, [(routine, result, replay seconds, recorded seconds)]).
+    """
+    import proto_serial
+    from machine import Machine
+    from mainwindow import MainWindow
+    from dialog_channel import ScriptedResponder
+
+    proto_serial.DEBUG_PRINT = False
+    settings = dict(
+        MainWindow.settings, gpio_backend="sim", serial_backend="replay", serial_replay_fp=filepath,
+        serial_record_dir=None, time_scale=time_scale, telemetry_db=None, checkpoint_fp=None, metrics_port=None,
+    )
+    machine = Machine(None, settings)
+    transport = machine.ser.ser
+    machine.dialogs.responder = ScriptedResponder([a["answer"] for a in transport.annotations if a["kind"] == "dialog"])
+
+    routines = [a for a in transport.annotations if a["kind"] in ("call", "routine")]  # "routine" before manual actions were noted
+    ends = [a["t"] for a in routines[1:]] + [transport.exchanges[-1].t]
+    results = []
+    try:
+        for routine, recorded_end in zip(routines, ends):
+            start = machine.clock.now()
+            args = [decode_arg(arg) for arg in routine["args"]]
+            kwargs = {key: decode_arg(value) for key, value in routine.get("kwargs", {}).items()}
+            result = getattr(machine, routine["method"])(*args, **kwargs).result()
+            results.append((routine["name"], result, machine.clock.now() - start, recorded_end - routine["t"]))
+    finally:
+        machine.ser.disconnect()
+        machine.loop.stop()
+    return transport, results
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded serial session as a regression test")
+    parser.add_argument("session")
+    parser.add_argument("--time-scale", type=float, default=1, help="Replay this many times faster than recorded")
+    parser.add_argument("--strict", action="store_true", help="Stop at the first write that differs from the recording")
+    parser.add_argument("--max-slowdown", type=float, default=1.1, help="Fail when a routine takes this much longer than recorded")
+    args = parser.parse_args()
+
+    transport, results = replay(args.session, args.time_scale, args.strict)
+    failed = bool(transport.mismatches)
+    for name, result, seconds, recorded in results:
+        slow = seconds > recorded * args.max_slowdown
+        failed |= slow
+        print(f"{name:<24} {seconds:9.1f}s vs {recorded:9.1f}s recorded{'  SLOWER' if slow else ''}")
+    print(f"{transport._next} of {len(transport.exchanges)} writes replayed, {len(transport.mismatches)} mismatch(es)")
+    for index, expected, written in transport.mismatches[:10]:
+        print(f"  write {index}: expected {expected!r}, got {written!r}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
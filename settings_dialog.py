@@ -1,22 +1,38 @@
-from PyQt5 import uic
+import threading
+
+from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtWidgets import QDialog
 
-from serial_ports import serial_ports
+from port_discovery import discovery
+from startup import load_ui
 
 class SettingsDialog(QDialog):
-    def __init__(self):
+    ports_probed = pyqtSignal(object)
+
+    def __init__(self, exclude=()):
+        """:param exclude: ports not to probe, e.g. the machine's own while it's connected"""
         super().__init__()
-        uic.loadUi('settings_dialog.ui', self)
+        load_ui('settings_dialog.ui', self)
         # self.setFixedSize(self.size())
 
-        ports = serial_ports()
+        # Fill the list from cached metadata straight away, then probe for GRBL in the background.
+        # Ports a machine holds are listed but never probed, opening one would reset its controller.
         self.port_comboBox.clear()
-        for port in ports:
-            self.port_comboBox.addItem(port)
-        
+        for port in discovery.list_ports():
+            self.port_comboBox.addItem(port.path)
+        self.ports_probed.connect(self.on_ports_probed)
+        exclude = set(exclude) | discovery.held_ports()
+        threading.Thread(target=lambda: self.ports_probed.emit(discovery.best_port(exclude)), daemon=True).start()
+
         self.show()
 
+    def on_ports_probed(self, best_port):
+        if best_port is not None:
+            if self.port_comboBox.findText(best_port) < 0:
+                self.port_comboBox.addItem(best_port)
+            self.port_comboBox.setCurrentText(best_port)
+
     def get_settings(self):
         return {
-            "port": ""
-        }
\ No newline at end of file
+            "port": self.port_comboBox.currentText()
+        }
@@ -0,0 +1,74 @@
+"""
+Start-up helpers: .ui files loaded from cached compiled modules, and a timer for the start-up breakdown.
+
+Kept free of heavy imports, run.py imports it first so the breakdown starts before Qt does.
+"""
+
+import os
+import json
+import time
+import importlib.util
+
+UI_CACHE_DIR = "ui_cache"
+
+def load_ui(filepath, widget, cache_dir=UI_CACHE_DIR):
+    """
+        Like uic.loadUi(filepath, widget), but from a module compiled from the .ui once and recompiled whenever the
+        .ui is newer, so a start skips parsing the XML and importing uic. Falls back to uic.loadUi if the cache
+        can't be written.
+    """
+    name = "ui_" + os.path.splitext(os.path.basename(filepath))[0]
+    module_fp = os.path.join(cache_dir, name + ".py")
+    try:
+        if not os.path.isfile(module_fp) or os.path.getmtime(module_fp) < os.path.getmtime(filepath):
+            from PyQt5 import uic
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(module_fp + ".tmp", "w") as out:
+                uic.compileUi(filepath, out)
+            os.replace(module_fp + ".tmp", module_fp)
+    except OSError as ex:
+        print(f"Could not cache {filepath}: {ex}")
+        from PyQt5 import uic
+        return uic.loadUi(filepath, widget)
+
+    spec = importlib.util.spec_from_file_location(name, module_fp)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    ui_class = next(value for key, value in vars(module).items() if key.startswith("Ui_"))
+    ui = ui_class()
+    ui.setupUi(widget)
+    # loadUi puts the child widgets and actions on the widget itself, setupUi on the Ui object
+    for key, value in vars(ui).items():
+        setattr(widget, key, value)
+    return widget
+
+class StartupTimer:
+    """Start-up split into named stages, each timed from the end of the one before."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._last = self.start
+        self.stages = []  # [(name, seconds)]
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.stages.append((name, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.start
+
+    def report(self):
+        return "\n".join([f"  {name:<16}{seconds * 1000:8.1f} ms" for name, seconds in self.stages] + [f"  {'total':<16}{self.total * 1000:8.1f} ms"])
+
+    def save(self, filepath):
+        """Append this start's breakdown to `filepath` as a JSON line, for tracking it across versions and boots."""
+        with open(filepath, "a") as out:
+            out.write(json.dumps({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "total": round(self.total, 4),
+                "stages": {name: round(seconds, 4) for name, seconds in self.stages}
+            }) + "\n")
+
+startup_timer = StartupTimer()  # Started on first import
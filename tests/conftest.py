@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import proto_serial
+proto_serial.DEBUG_PRINT = False
+
+@pytest.fixture(scope="session")
+def qapp():
+    from PyQt5.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+@pytest.fixture
+def make_machine(qapp, tmp_path):
+    """Builds Machines on simulated GPIO and the GRBL emulator, torn down after the test."""
+    from mainwindow import MainWindow
+    from machine import Machine
+    machines = []
+
+    def make(**overrides):
+        settings = dict(
+            MainWindow.settings, gpio_backend="sim", serial_backend="emu", port="emulator", time_scale=20,
+            telemetry_db=None, checkpoint_fp=str(tmp_path / "checkpoint.json"), trace_dir=None,
+        )
+        settings.update(overrides)
+        machine = Machine(None, settings)
+        machines.append(machine)
+        return machine
+
+    yield make
+    for machine in machines:
+        machine.ser.disconnect()
+        machine.loop.stop()
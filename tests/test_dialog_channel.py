@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+import pytest
+from PyQt5.QtWidgets import QMessageBox
+
+from dialog_channel import DialogChannel, DialogCancelled, DialogTimeout, ScriptedResponder
+
+def test_scripted_answers():
+    responder = ScriptedResponder(["first", "second"], default="default")
+    channel = DialogChannel(responder=responder)
+    assert [channel.ask("question") for _ in range(3)] == ["first", "second", "default"]
+    channel.notify("info")
+    assert len(responder.requests) == 4 and not responder.requests[-1].wait
+
+def test_exhausted_script_cancels():
+    channel = DialogChannel(responder=ScriptedResponder(["only"]))
+    assert channel.ask("question") == "only"
+    with pytest.raises(DialogCancelled):
+        channel.ask("question")
+
+def test_timeout():
+    posted = []
+    channel = DialogChannel(post=posted.append)
+    with pytest.raises(DialogTimeout):
+        channel.ask("question", timeout=0.05)
+    assert posted[0].future.cancelled()
+    assert channel.cancel_all() == 0
+
+def test_answer_from_the_ui():
+    channel = DialogChannel(post=lambda request: threading.Timer(0.01, request.respond, ["yes"]).start())
+    assert asyncio.run(channel.ask_async("question", timeout=5)) == "yes"
+
+def test_estop_cancels_waiting_dialogs():
+    posted = threading.Event()
+    channel = DialogChannel(post=lambda request: posted.set())
+
+    async def ask():
+        return await channel.ask_async("question", timeout=5)
+
+    threading.Thread(target=lambda: posted.wait(5) and channel.cancel_all()).start()
+    with pytest.raises(DialogCancelled):
+        asyncio.run(ask())
+
+def test_unanswered_verification_stops_retrying(make_machine):
+    m = make_machine()
+    m.dialogs.responder = ScriptedResponder([QMessageBox.No])
+    assert m.pulse_peener_until_up(False).result(timeout=10) is False
+    assert len(m.dialogs.responder.requests) == 2
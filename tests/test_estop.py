@@ -0,0 +1,36 @@
+import time
+
+from PyQt5.QtWidgets import QMessageBox
+
+from dialog_channel import ScriptedResponder
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_estop_stops_tray(make_machine):
+    m = make_machine()
+    m.dialogs.responder = ScriptedResponder(default=QMessageBox.Yes)
+    m.spin_tray_routine(5, m.TRAY_CCW)
+    wait_until(lambda: len(m.gpio.edges(m.TRAY_STEP_PIN)) > 200)
+
+    m.e_stop().result(timeout=5)
+    edges = len(m.gpio.edges(m.TRAY_STEP_PIN))
+    time.sleep(0.3)
+    assert len(m.gpio.edges(m.TRAY_STEP_PIN)) == edges
+    assert not m.loop._work
+
+def test_estop_stops_streaming(make_machine):
+    m = make_machine()
+    m.dialogs.responder = ScriptedResponder(default=QMessageBox.Yes)
+    program = "\n".join(f"G1 X{i % 20 - 10} Y{i % 7 - 3} F500" for i in range(3000))
+    m.do_gcode_routine(program)
+    wait_until(lambda: m.ser.metrics.counters["lines_tx"] > 100)
+
+    m.e_stop().result(timeout=5)  # Hung for the whole response timeout while the serial thread was still sending
+    sent = m.ser.metrics.counters["lines_tx"]
+    time.sleep(0.3)
+    assert m.ser.metrics.counters["lines_tx"] == sent
+    assert not m.loop._work
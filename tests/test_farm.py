@@ -0,0 +1,81 @@
+import time
+
+import pytest
+from PyQt5.QtWidgets import QMessageBox
+
+from dialog_channel import ScriptedResponder
+from farm import MachineFarm
+from gcode_stream import GcodeStream
+
+PROGRAM = "G0 X0 Y0\nM3 S1\nG1 X5 Y5 F1000\nM5\n"
+
+def wait_until(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+@pytest.fixture
+def farm(qapp, tmp_path):
+    from mainwindow import MainWindow
+    base = dict(MainWindow.settings, gpio_backend="sim", serial_backend="emu", port="emulator", time_scale=100,
+                telemetry_db=None, trace_dir=None)
+    farm = MachineFarm({"emu1": {"checkpoint_fp": str(tmp_path / "checkpoint.json")}}, base,
+                       responder=ScriptedResponder(default=QMessageBox.Yes))
+    yield farm
+    farm.shutdown()
+
+def test_finished_job_is_done(farm):
+    job = farm.submit(gcode=PROGRAM, name="ok")
+    assert farm.wait(60)
+    assert job.state == "done"
+    assert farm.machines["emu1"].state == "idle"
+    assert farm.machines["emu1"].completed == 1
+
+def test_failed_job_is_failed(farm):
+    machine = farm.machines["emu1"].machine
+
+    async def broken_homing():
+        raise RuntimeError("homing failed")
+    machine._prepare_tag = broken_homing
+
+    job = farm.submit(gcode=PROGRAM, name="broken")
+    second = farm.submit(gcode=PROGRAM, name="waiting")
+    wait_until(lambda: job.state != "running")
+    assert job.state == "failed"
+    assert farm.machines["emu1"].state == "faulted"
+    assert farm.machines["emu1"].completed == 0
+    assert second.state == "queued"  # Not handed to the faulted machine
+    assert farm.resume("emu1") is None  # Nothing to resume on a failed job
+
+    del machine._prepare_tag
+    farm.clear_fault("emu1")
+    assert farm.wait(60)
+    assert job.state == "failed"
+    assert second.state == "done"
+
+def test_one_shot_program_is_not_estimated(farm):
+    stream = GcodeStream.of(line for line in PROGRAM.splitlines())
+    job = farm.submit(gcode=stream, name="generator")
+    assert job.estimate == farm.JOB_OVERHEAD
+    assert farm.wait(60)
+    assert job.state == "done"
+    assert stream.lines == 4  # All of it reached the machine
+
+def test_program_estimate(farm):
+    job = farm.submit(gcode=PROGRAM, name="text")
+    assert job.estimate > farm.JOB_OVERHEAD
+    assert farm.wait(60)
+
+def test_auto_machines_skip_other_machines_ports(qapp, tmp_path):
+    from mainwindow import MainWindow
+    base = dict(MainWindow.settings, gpio_backend="sim", serial_backend="emu", telemetry_db=None)
+    farm = MachineFarm({
+        "a": {"port": "/dev/ttyUSB0", "checkpoint_fp": str(tmp_path / "a.json")},
+        "b": {"port": "auto", "checkpoint_fp": str(tmp_path / "b.json")},
+    }, base)
+    try:
+        assert farm.machines["a"].machine.settings["port_exclude"] == []
+        assert farm.machines["b"].machine.settings["port_exclude"] == ["/dev/ttyUSB0"]
+    finally:
+        farm.shutdown()
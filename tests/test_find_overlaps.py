@@ -0,0 +1,22 @@
+from _find_overlaps import find_overlaps, remove_overlaps, overlap_segments
+
+def test_retraced_path():
+    paths = [[(0, 0), (10, 0)], [(0, 0), (10, 0)]]
+    runs = find_overlaps(paths, 0.5)
+    assert runs == [(1, 0, 0)]
+    assert remove_overlaps(paths, runs) == [paths[0]]
+    assert overlap_segments(paths, runs) == [[(0, 0), (10, 0)]]
+
+def test_retrace_in_the_middle_splits_path():
+    paths = [[(0, 0), (10, 0)], [(0, -5), (0, 0), (10, 0), (10, 5)]]
+    runs = find_overlaps(paths, 0.5)
+    assert runs == [(1, 1, 1)]
+    assert remove_overlaps(paths, runs) == [paths[0], [(0, -5), (0, 0)], [(10, 0), (10, 5)]]
+
+def test_short_and_separate_runs_are_kept():
+    paths = [[(0, 0), (10, 0)], [(0, 1), (10, 1)], [(5, -3), (5, 0), (5.5, 0), (5.5, 3)]]
+    assert find_overlaps(paths, 0.5) == []
+
+def test_own_corners_are_not_overlaps():
+    zigzag = [[(0, 0), (0.3, 0.3), (0.6, 0), (0.9, 0.3), (1.2, 0), (1.5, 0.3)]]
+    assert find_overlaps(zigzag, 0.5) == []
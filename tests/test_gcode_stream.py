@@ -0,0 +1,49 @@
+import pathlib
+
+from gcode_stream import GcodeStream, GcodeFile, clean_line
+
+PROGRAM = "%\nG0 X1 Y2 (rapid)\n\n; comment only\nG1 X3 F100 ; feed\n%\n"
+
+def test_clean_line():
+    assert clean_line("G1 X1.5 Y-2 (move) ; note") == "G1X1.5Y-2"
+    assert clean_line("%") == ""
+
+def test_text_stream():
+    stream = GcodeStream.of(PROGRAM)
+    assert list(stream) == ["G0X1Y2", "G1X3F100"]
+    assert stream.lines == 2
+    assert stream.fraction == 1
+
+def test_file_stream(tmp_path):
+    filepath = tmp_path / "tag.nc"
+    filepath.write_text(PROGRAM)
+    stream = GcodeStream.of(filepath)
+    assert isinstance(stream, GcodeFile)
+    assert list(stream) == ["G0X1Y2", "G1X3F100"]
+    assert list(stream) == ["G0X1Y2", "G1X3F100"]  # Re-read from the file
+    assert stream.fraction == 1
+
+def test_str_is_program_text(tmp_path):
+    filepath = tmp_path / "tag.nc"
+    filepath.write_text(PROGRAM)
+    stream = GcodeStream.of(str(filepath))
+    assert not isinstance(stream, GcodeFile)
+    assert list(stream) == [clean_line(str(filepath))]
+    assert isinstance(GcodeStream.of(pathlib.Path(filepath)), GcodeFile)
+
+def test_reopenable(tmp_path):
+    filepath = tmp_path / "tag.nc"
+    filepath.write_text(PROGRAM)
+    assert GcodeStream.of(PROGRAM).reopenable
+    assert GcodeStream.of(["G0 X0"]).reopenable
+    assert GcodeStream.of(filepath).reopenable
+    assert not GcodeStream.of(line for line in ["G0 X0"]).reopenable
+
+def test_spindle_speed_is_scaled_and_clamped(make_machine):
+    m = make_machine()
+    assert m._split_peener_command("M3S500", 1000) == (50, "")
+    assert m._split_peener_command("G1X1M3S1000", 1000) == (100, "G1X1")
+    assert m._split_peener_command("M3S25000", 1000)[0] == 100
+    assert m._split_peener_command("M3S-20", 1000)[0] == 0
+    assert m._split_peener_command("M5", 1000)[0] == 0
+    assert m._split_peener_command("G1X1", 1000) == (None, "G1X1")
@@ -0,0 +1,33 @@
+from _gcode_writer import GcodeWriter, format_number, step_decimals
+
+def test_format_number():
+    assert format_number(1.50, 2) == "1.5"
+    assert format_number(0.25, 2) == ".25"
+    assert format_number(-0.25, 2) == "-.25"
+    assert format_number(-0.001, 2) == "0"
+    assert format_number(12.0, 3) == "12"
+
+def test_step_decimals():
+    assert step_decimals(250) == 3
+    assert step_decimals(100) == 2
+    assert step_decimals(80) == 4
+
+def test_modal_words():
+    writer = GcodeWriter()
+    assert writer.move(1, 2) == "G0X1Y2"
+    assert writer.move(1, 3, feed=500) == "G1Y3F500"
+    assert writer.move(4, 3, feed=500) == "X4"
+    assert writer.move(4, 3, feed=500) == "X4"  # Never empty
+    assert writer.move(5, 3, feed=400) == "X5F400"
+    assert writer.bytes == sum(len(line) + 1 for line in ("G0X1Y2", "G1Y3F500", "X4", "X4", "X5F400"))
+
+def test_reset_rewrites_modal_state():
+    writer = GcodeWriter()
+    writer.move(1, 2, feed=500)
+    writer.reset()
+    assert writer.move(1, 2, feed=500) == "G1X1Y2F500"
+
+def test_snaps_to_steps():
+    writer = GcodeWriter(steps_per_mm=(250, 250))
+    assert writer.decimals == 3
+    assert writer.move(0.0021, 1.0019) == "G0X.004Y1"
@@ -0,0 +1,36 @@
+from grbl_connection import GrblConnection
+from grbl_settings_sync import GrblSettings
+from proto_serial import ProtoSerial
+from test_proto_serial import FakeGrbl
+
+def test_command_needs_its_own_ok():
+    ser = ProtoSerial(FakeGrbl(errors={"$1=300"}))
+    assert ser.command("$1=255")
+    assert not ser.command("$1=300")
+    ser.abort()
+    assert not ser.command("$1=10")
+
+def test_idle_hold_only_changes_once_written():
+    grbl = FakeGrbl()
+    conn = GrblConnection(ProtoSerial(grbl))
+    conn.settings = GrblSettings({1: 255})
+
+    conn.ser.abort()  # e.g. the routine's finally after an e-stop
+    conn.set_idle_hold(False)
+    assert conn.idle_hold is True and conn.settings[1] == 255
+    assert grbl.received == []
+
+    conn.ser.clear_abort()
+    conn.set_idle_hold(False)
+    assert grbl.received == ["$1=10"]
+    assert conn.idle_hold is False and conn.settings[1] == 10
+
+def test_idle_hold_is_written_again_after_an_estop():
+    grbl = FakeGrbl()
+    conn = GrblConnection(ProtoSerial(grbl))
+    conn.set_idle_hold(False)
+    assert grbl.received == ["$1=10"]
+
+    conn.forget_idle_hold()
+    conn.set_idle_hold(False)
+    assert grbl.received == ["$1=10", "$1=10"]
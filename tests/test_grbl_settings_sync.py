@@ -0,0 +1,35 @@
+from grbl_settings_sync import SettingsSync, format_setting
+from proto_serial import ProtoSerial
+from test_proto_serial import FakeGrbl
+
+class SettingsGrbl(FakeGrbl):
+    """FakeGrbl that keeps a `$$` table and takes `$n=` writes."""
+
+    def __init__(self, values):
+        FakeGrbl.__init__(self)
+        self.values = dict(values)
+
+    def readline(self):
+        if self.out or b"\n" not in self.rx:
+            return FakeGrbl.readline(self)
+        line = self.rx.split(b"\n", 1)[0].decode()
+        if line == "$$":
+            ok = FakeGrbl.readline(self)
+            self.out += [f"{format_setting(num, value)}\r\n".encode() for num, value in sorted(self.values.items())]
+            self.out.append(ok)
+            return self.out.pop(0)
+        if line.startswith("$") and "=" in line:
+            num, value = line[1:].split("=")
+            self.values[int(num)] = float(value)
+        return FakeGrbl.readline(self)
+
+def test_settings_are_written_one_at_a_time():
+    grbl = SettingsGrbl({0: 10, 1: 25, 110: 500.0, 111: 500.0})
+    sync = SettingsSync(ProtoSerial(grbl))
+    verified, written, failed = sync.sync({0: 10, 1: 255, 110: 800.0, 111: 800.0})
+
+    assert written == {1: 255, 110: 800.0, 111: 800.0}
+    assert not failed
+    assert verified[1] == 255 and verified[111] == 800
+    writes = [line for line in grbl.received if "=" in line]
+    assert grbl.most_buffered == max(len(line) + 1 for line in writes + ["$$"])
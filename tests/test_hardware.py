@@ -0,0 +1,15 @@
+import hardware
+from hardware import resolve_pwm_backend
+
+def test_auto_pwm_needs_the_pin_muxed_to_pwm(monkeypatch):
+    monkeypatch.setattr(hardware.os.path, "isdir", lambda path: True)  # pwmchip0 is there, e.g. for audio
+
+    monkeypatch.setattr(hardware, "pin_function", lambda pin: "12: ip pd | lo // GPIO12 = input")
+    assert resolve_pwm_backend("auto", "rpi", 12) == "gpio"
+    monkeypatch.setattr(hardware, "pin_function", lambda pin: None)
+    assert resolve_pwm_backend("auto", "rpi", 12) == "gpio"
+    monkeypatch.setattr(hardware, "pin_function", lambda pin: "12: a0 pd | lo // GPIO12 = PWM0_0")
+    assert resolve_pwm_backend("auto", "rpi", 12) == "sysfs"
+
+    assert resolve_pwm_backend("auto", "sim", 12) == "gpio"
+    assert resolve_pwm_backend("auto", "rpi", 16) == "gpio"  # No PWM channel on BCM 16
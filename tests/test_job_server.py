@@ -0,0 +1,50 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+from PyQt5.QtWidgets import QMessageBox
+
+from dialog_channel import ScriptedResponder
+from farm import MachineFarm
+from job_server import JobServer
+
+@pytest.fixture
+def server(qapp, tmp_path):
+    from mainwindow import MainWindow
+    base = dict(MainWindow.settings, gpio_backend="sim", serial_backend="emu", port="emulator", time_scale=100,
+                telemetry_db=None, trace_dir=None)
+    farm = MachineFarm({"emu1": {"checkpoint_fp": str(tmp_path / "checkpoint.json")}}, base,
+                       responder=ScriptedResponder(default=QMessageBox.Yes))
+    server = JobServer(farm, port=0).start()
+    yield server
+    server.stop()
+    farm.shutdown()
+
+def request(server, method, path, body=None):
+    port = server._server.sockets[0].getsockname()[1]
+    req = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=body, method=method,
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return resp.status, json.load(resp)
+    except urllib.error.HTTPError as ex:
+        return ex.code, json.load(ex)
+
+def test_bad_request(server):
+    status, result = request(server, "POST", "/jobs", b'{"paths": []}')
+    assert status == 400 and "error" in result
+    assert request(server, "GET", "/jobs/99")[0] == 404
+
+def test_errors_become_json(server):
+    def broken_submit(*args):
+        raise RuntimeError("estimator crashed")
+    server.farm.submit = broken_submit
+    status, result = request(server, "POST", "/jobs", b'{"gcode": "G0 X0"}')
+    assert status == 500
+    assert result == {"error": "RuntimeError: estimator crashed"}
+
+    def bad_design(*args):
+        raise ValueError("could not convert string to float: 'x'")
+    server.farm.submit = bad_design
+    assert request(server, "POST", "/jobs", b'{"gcode": "G0 X0"}')[0] == 400
@@ -0,0 +1,20 @@
+from _join_paths import join_paths
+
+def test_joins_and_reverses():
+    paths = [[(0, 0), (1, 0)], [(2, 0), (1.05, 0)], [(5, 5), (6, 6)]]
+    assert join_paths(paths, 0.1) == [[(0, 0), (1, 0), (1.05, 0), (2, 0)], [(5, 5), (6, 6)]]
+
+def test_coincident_points_are_merged():
+    paths = [[(0, 0), (1, 0)], [(1, 0), (1, 1)]]
+    assert join_paths(paths, 0.1) == [[(0, 0), (1, 0), (1, 1)]]
+
+def test_grows_both_ends():
+    paths = [[(1, 0), (2, 0)], [(0, 0), (1, 0)], [(2, 0), (3, 0)]]
+    joined, = join_paths(paths, 0.1)
+    assert sorted([joined[0], joined[-1]]) == [(0, 0), (3, 0)]
+    assert len(joined) == 4
+
+def test_no_tolerance_keeps_paths():
+    paths = [[(0, 0), (1, 0)], [(1, 0), (2, 0)]]
+    assert join_paths(paths, 0) == paths
+    assert join_paths(paths, 0.1) == [[(0, 0), (1, 0), (2, 0)]]
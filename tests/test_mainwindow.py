@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+@pytest.fixture
+def window_factory(qapp, tmp_path, monkeypatch):
+    from mainwindow import MainWindow
+    settings_fp = tmp_path / "_settings.json"
+    monkeypatch.setattr(MainWindow, "SETTINGS_FP", str(settings_fp))
+    monkeypatch.setattr(MainWindow, "settings", dict(
+        MainWindow.settings, gpio_backend="sim", serial_backend="emu", telemetry_db=None, startup_log=None,
+        checkpoint_fp=str(tmp_path / "checkpoint.json"),
+    ))
+    windows = []
+
+    def make(saved=None):
+        if saved is not None:
+            settings_fp.write_text(json.dumps(saved))
+        window = MainWindow()
+        windows.append(window)
+        return window
+
+    yield make
+    for window in windows:
+        if window.machine:
+            window.machine.loop.stop()
+        window.close()
+
+def test_machine_actions_wait_for_the_machine(window_factory, qapp):
+    window = window_factory()
+    assert window.machine is None
+    assert not window.sendButton.isEnabled()
+    assert not window.actionHome_X.isEnabled()
+    assert not window.joinPathsButton.isEnabled()
+    qapp.processEvents()
+    assert window.machine is not None
+    assert window.sendButton.isEnabled()
+    assert window.actionHome_X.isEnabled()
+
+def test_old_settings_file_migrates(window_factory, qapp):
+    from mainwindow import MainWindow
+    window = window_factory({"_version": 6, "line_width": 1, "tag_diam": 60, "gone": True})
+    assert window.settings["line_width"] == 1
+    assert window.settings["tag_diam"] == 60
+    assert "gone" not in window.settings
+    saved = json.loads(open(MainWindow.SETTINGS_FP).read())
+    assert saved["_version"] == window.settings["_version"] > 6
+    assert saved["line_width"] == 1
+    qapp.processEvents()
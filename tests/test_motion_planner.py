@@ -0,0 +1,54 @@
+import pytest
+
+from _motion_planner import GcodeError, ProgramModel, estimate_program_time, parse_words
+
+# Fast axes so the accelerations and feeds in each test decide the timing
+SETTINGS = {11: 0.01, 110: 60000, 111: 60000, 112: 60000, 120: 10, 121: 10, 122: 10}
+
+def test_parse_words():
+    assert parse_words("g1 x1.5 y-2 (move) f500 ; note") == [("G", 1), ("X", 1.5), ("Y", -2), ("F", 500)]
+
+def test_triangle_profile():
+    # Never reaches 100 mm/s over 10 mm at 10 mm/s^2, peaks at 10 mm/s halfway
+    assert estimate_program_time(["G1 X10 F6000"], SETTINGS) == pytest.approx(2)
+
+def test_trapezoid_profile():
+    # 1 s to reach 10 mm/s over 5 mm, 9 s cruising the 90 mm between, 1 s stopping
+    assert estimate_program_time(["G1 X100 F600"], SETTINGS) == pytest.approx(11)
+
+def test_straight_junction_keeps_speed():
+    split = estimate_program_time(["G1 X50 F600", "X100"], SETTINGS)
+    assert split == pytest.approx(estimate_program_time(["G1 X100 F600"], SETTINGS))
+
+def test_corner_slows_down():
+    corner = estimate_program_time(["G1 X50 F600", "Y50"], SETTINGS)
+    straight = estimate_program_time(["G1 X50 F600", "X100"], SETTINGS)
+    assert straight < corner < 2 * estimate_program_time(["G1 X50 F600"], SETTINGS) + 1e-9
+
+def test_dwell_and_offsets():
+    assert estimate_program_time(["G4 P1.5"], SETTINGS) == pytest.approx(1.5)
+    model = ProgramModel(SETTINGS, position=(5, 5, 0))
+    model.blocks_for("G92 X0 Y0")
+    block, = model.blocks_for("G1 X1 F600")
+    assert block.target[:2] == [6, 5]
+
+def test_feed_required():
+    with pytest.raises(GcodeError) as error:
+        estimate_program_time(["G1 X1"], SETTINGS)
+    assert error.value.code == 22
+
+def test_arc_is_split_into_chords():
+    blocks = ProgramModel(SETTINGS).blocks_for("G2 X20 Y0 I10 J0 F600")
+    assert len(blocks) > 10
+    assert blocks[-1].target[:2] == pytest.approx([20, 0])
+    assert sum(block.length for block in blocks) == pytest.approx(31.4159, rel=1e-3)
+
+def test_planner_window():
+    # 400 segments of .05 mm: with 15 blocks queued it must always be able to stop within .75 mm
+    lines = ["G1 X0 F600"] + [f"X{(i + 1) * 0.05:.2f}" for i in range(400)]
+    whole = estimate_program_time(lines, SETTINGS)
+    assert whole == pytest.approx(3, rel=0.01)  # 10 mm/s, with a second to accelerate and stop
+    assert estimate_program_time(lines, SETTINGS, planner_size=1000) == pytest.approx(whole)
+    windowed = estimate_program_time(lines, SETTINGS, planner_size=15)
+    speed = (2 * 10 * 0.05 * 14.5) ** 0.5  # About the speed it can stop from in the queued blocks, ~3.8 mm/s
+    assert windowed == pytest.approx(20 / speed + speed / 10, rel=0.02)
@@ -0,0 +1,57 @@
+import gc
+
+from port_discovery import PortDiscovery, PortInfo
+
+class FakeDiscovery(PortDiscovery):
+    def __init__(self, grbl_ports):
+        super().__init__()
+        self.grbl_ports = grbl_ports
+        self.probed = []
+
+    def _device_signature(self):
+        return ("fixed",)
+
+    def _enumerate(self):
+        return [PortInfo(f"/dev/ttyUSB{i}", "USB Serial", 0x1a86, 0x7523) for i in range(3)]
+
+    def _probe_port(self, port):
+        self.probed.append(port.device)
+        return "Grbl 1.1h ['$' for help]" if port.device in self.grbl_ports else None
+
+class Owner:
+    pass
+
+def test_best_port_prefers_grbl():
+    discovery = FakeDiscovery({"/dev/ttyUSB1"})
+    assert discovery.best_port() == "/dev/ttyUSB1"
+
+def test_excluded_ports_are_not_probed_or_picked():
+    discovery = FakeDiscovery({"/dev/ttyUSB1", "/dev/ttyUSB2"})
+    assert discovery.best_port() in ("/dev/ttyUSB1", "/dev/ttyUSB2")
+    discovery = FakeDiscovery({"/dev/ttyUSB1", "/dev/ttyUSB2"})
+    assert discovery.best_port(exclude={"/dev/ttyUSB1"}) == "/dev/ttyUSB2"
+    assert "/dev/ttyUSB1" not in discovery.probed
+    assert discovery.best_port(exclude={"/dev/ttyUSB2"}) != "/dev/ttyUSB2"  # Even once cached
+
+def test_freed_ports_are_probed_later():
+    discovery = FakeDiscovery({"/dev/ttyUSB1"})
+    assert discovery.best_port(exclude={"/dev/ttyUSB1"}) != "/dev/ttyUSB1"
+    assert discovery.best_port() == "/dev/ttyUSB1"  # Released by its machine, probed now
+    assert sorted(discovery.probed) == ["/dev/ttyUSB0", "/dev/ttyUSB1", "/dev/ttyUSB2"]  # The others only once
+
+def test_claims_keep_machines_apart():
+    discovery = FakeDiscovery({"/dev/ttyUSB1", "/dev/ttyUSB2"})
+    a, b, c = Owner(), Owner(), Owner()
+    first = discovery.claim(a)
+    second = discovery.claim(b)
+    assert {first, second} == {"/dev/ttyUSB1", "/dev/ttyUSB2"}
+    assert discovery.claim(a) == first  # Its own claim doesn't count against it
+    assert discovery.held_ports() == {first, second}
+    assert discovery.held_ports(a) == {second}
+    assert discovery.claim(c, "/dev/ttyUSB0") == "/dev/ttyUSB0"
+
+    discovery.release(b)
+    assert discovery.held_ports() == {first, "/dev/ttyUSB0"}
+    del c
+    gc.collect()
+    assert discovery.held_ports() == {first}
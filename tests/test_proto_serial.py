@@ -0,0 +1,105 @@
+import time
+
+from proto_serial import ProtoSerial
+from serial_metrics import RX_BUFFER_SIZE
+
+class FakeGrbl:
+    """pyserial stand-in with GRBL's RX buffer, a line is only taken out (and acked) when the host reads."""
+
+    def __init__(self, errors=()):
+        self.port = None
+        self.baudrate = None
+        self.timeout = None
+        self.is_open = True
+        self.rx = b""
+        self.most_buffered = 0
+        self.received = []
+        self.errors = set(errors)  # Lines answered with an error instead of ok
+        self.out = []
+
+    @property
+    def in_waiting(self):
+        return sum(len(line) for line in self.out)
+
+    def write(self, data):
+        if data in (b"?", b"!", b"~"):
+            if data == b"?":
+                self.out.append(b"<Idle|MPos:0.000,0.000,0.000|FS:0,0>\r\n")
+            return len(data)
+        self.rx += data
+        self.most_buffered = max(self.most_buffered, len(self.rx))
+        return len(data)
+
+    def readline(self):
+        if self.out:
+            return self.out.pop(0)
+        if b"\n" not in self.rx:
+            return b""
+        line, self.rx = self.rx.split(b"\n", 1)
+        self.received.append(line.decode())
+        return b"error:20\r\n" if line.decode() in self.errors else b"ok\r\n"
+
+    def close(self):
+        self.is_open = False
+
+def test_character_counting_fills_but_never_overflows_rx_buffer():
+    grbl = FakeGrbl()
+    ser = ProtoSerial(grbl)
+    lines = [f"G1X{i}.123Y{i}.456F500" for i in range(200)]
+    resps = ser.send(iter(lines), wait_for_resp=True)
+    assert grbl.received == lines
+    assert resps == ["ok"] * len(lines)
+    assert RX_BUFFER_SIZE - 25 < grbl.most_buffered <= RX_BUFFER_SIZE - 1
+    assert ser.acked_lines == len(lines)
+    assert not ser._pending
+
+def test_errors_free_buffer_space():
+    grbl = FakeGrbl(errors={"G5"})
+    ser = ProtoSerial(grbl)
+    resps = ser.send(["G5", "G0X1", "G0X2"], wait_for_resp=True, keep_oks=False)
+    assert resps == ["error:20"]
+    assert ser.acked_lines == 3
+
+def test_unacked_lines_are_collected_later():
+    grbl = FakeGrbl()
+    ser = ProtoSerial(grbl)
+    assert ser.send("G0X1") == []
+    assert ser._pending == [5]
+    assert ser.send("G0X2", wait_for_resp=True) == ["ok", "ok"]
+
+def test_realtime_commands_bypass_counting():
+    grbl = FakeGrbl()
+    ser = ProtoSerial(grbl)
+    resps = ser.send(["G0X1", "?"], wait_for_resp=True)
+    assert "ok" in resps and any(line.startswith("<Idle") for line in resps)
+    assert grbl.received == ["G0X1"]
+    assert ser.metrics.counters["realtime_tx"] == 1
+
+def test_abort_stops_streaming():
+    grbl = FakeGrbl()
+    ser = ProtoSerial(grbl)
+
+    def lines():
+        for i in range(100):
+            if i == 10:
+                ser.abort()
+            yield f"G0X{i}"
+
+    ser.send(lines(), wait_for_resp=True)
+    assert len(grbl.received) <= 10
+
+def test_long_streams_poll_status():
+    grbl = FakeGrbl()
+    ser = ProtoSerial(grbl)
+    ser.STATUS_POLL = 0.01
+    lines = [f"G0X{i}" for i in range(20)]
+
+    def slowly():
+        for line in lines:
+            time.sleep(0.005)
+            yield line
+
+    assert ser.send(slowly(), wait_for_resp=True, keep_oks=False) == []
+    assert grbl.received == lines
+    assert ser.metrics.counters["realtime_tx"] >= 3
+    assert ser.metrics.counters["lines_rx"] > len(lines)  # The reports were read along with the acks
@@ -0,0 +1,35 @@
+import re
+
+from PyQt5.QtWidgets import QMessageBox
+
+from dialog_channel import ScriptedResponder
+from engraving_checkpoint import EngravingCheckpoint
+
+def record_sends(machine):
+    """Lines the machine sends, with an "<enter_tag>" marker where it starts to enter the tag."""
+    sent = []
+    send, enter_tag = machine.ser.send, machine._enter_tag
+
+    def recording_send(gcode, *args, **kwargs):
+        gcode = [gcode] if isinstance(gcode, str) else list(gcode)
+        sent.extend(gcode)
+        return send(gcode, *args, **kwargs)
+
+    async def recording_enter_tag():
+        sent.append("<enter_tag>")
+        await enter_tag()
+
+    machine.ser.send = recording_send
+    machine._enter_tag = recording_enter_tag
+    return sent
+
+def test_resume_keeps_the_clamp_closed(make_machine):
+    m = make_machine()
+    m.dialogs.responder = ScriptedResponder(default=QMessageBox.Yes)
+    m.checkpoint = EngravingCheckpoint([[(0, 0), (0.1, 0.1)], [(-0.1, 0), (0, -0.1), (0.1, 0)]], path=1, border_done=True)
+    sent = record_sends(m)
+
+    assert m.resume_engraving_routine().result(timeout=60)
+    before = sent[:sent.index("<enter_tag>")]
+    assert "$HX" in before and "$HY" in before
+    assert not [line for line in before if line in ("$H", "$HZ") or re.search(r"\bZ", line)]
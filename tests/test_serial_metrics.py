@@ -0,0 +1,59 @@
+import threading
+
+from serial_metrics import SerialMetrics, PLANNER_BLOCKS
+
+def test_acks_and_buffer():
+    m = SerialMetrics()
+    m.line_sent(10)
+    m.line_sent(20)
+    assert m.rx_used == 30
+    m.line_received("ok", 2)
+    assert m.rx_used == 20
+    snap = m.snapshot()
+    assert snap["counters"]["oks"] == 1
+    assert snap["ack_latency"]["count"] == 1
+
+def test_bound_from_status_reports():
+    m = SerialMetrics()
+    assert m.bound() is None
+    for _ in range(3):
+        m.line_received("<Run|MPos:0.000,0.000,0.000|Bf:0,128|FS:0,0>", 40)
+    m.line_received("<Idle|MPos:0.000,0.000,0.000|Bf:15,128|FS:0,0>", 40)  # Idle samples don't count
+    assert m.snapshot()["planner_mean"] == 1
+    assert m.bound() == "motion"
+    m.line_received(f"<Run|Bf:{PLANNER_BLOCKS - 2},128>", 20)
+    for _ in range(3):
+        m.line_received(f"<Run|Bf:{PLANNER_BLOCKS},128>", 20)
+    assert m.bound() == "link"
+
+def test_snapshot_while_streaming():
+    m = SerialMetrics(max_samples=1000)
+    done = threading.Event()
+
+    def stream():
+        while not done.is_set():
+            m.line_sent(20)
+            m.line_received("<Run|Bf:3,100>", 14)
+            m.line_received("ok", 2)
+
+    thread = threading.Thread(target=stream)
+    thread.start()
+    try:
+        for _ in range(2000):
+            m.snapshot()
+            m.to_text()
+    finally:
+        done.set()
+        thread.join()
+    assert 'grbl_serial_ack_latency_seconds_bucket{le="+Inf"}' in m.to_text()
+
+def test_bound_without_buffer_reports():
+    m = SerialMetrics()
+    m.line_sent(20)
+    for _ in range(3):
+        m.line_received("<Run|MPos:1.000,2.000,0.000|FS:500,0>", 40)  # A line waiting for room, the planner is full
+    assert m.bound() == "motion"
+    m.line_received("ok", 2)
+    for _ in range(4):
+        m.line_received("<Run|MPos:1.000,2.000,0.000|FS:500,0>", 40)
+    assert m.bound() == "link"
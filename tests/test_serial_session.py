@@ -0,0 +1,40 @@
+from PyQt5.QtWidgets import QMessageBox
+
+from dialog_channel import ScriptedResponder
+from gcode_stream import GcodeFile
+from serial_session import encode_arg, decode_arg, load_session, replay
+
+PROGRAM = "G0 X0 Y0\nM3 S1\nG1 X5 Y5 F1000\nM5\n"
+
+def test_args_keep_their_types(tmp_path):
+    filepath = tmp_path / "tag.nc"
+    filepath.write_text(PROGRAM)
+    decoded = decode_arg(encode_arg(GcodeFile(str(filepath))))
+    assert isinstance(decoded, GcodeFile) and decoded.filepath == str(filepath)
+    assert decode_arg(encode_arg(filepath)) == filepath
+    assert decode_arg(encode_arg("G0 X0")) == "G0 X0"
+    assert decode_arg(encode_arg([[[0, 0], [1, 1]]])) == [[[0, 0], [1, 1]]]
+
+def test_record_and_replay(make_machine, tmp_path):
+    program = tmp_path / "tag.nc"
+    program.write_text(PROGRAM)
+    m = make_machine(serial_record_dir=str(tmp_path / "sessions"), time_scale=50)
+    m.dialogs.responder = ScriptedResponder(default=QMessageBox.Yes)
+    m.open_clamp().result(timeout=30)
+    m.ser_send("G0 X1 Y1").result(timeout=30)
+    assert m.do_gcode_routine(GcodeFile(str(program))).result(timeout=60) is True
+    recording = m.ser.ser.filepath
+    m.ser.disconnect()
+
+    _, events = load_session(recording)
+    calls = [e for e in events if e["kind"] == "call"]
+    assert [call["method"] for call in calls] == ["open_clamp", "ser_send", "do_gcode_routine"]
+    assert calls[2]["name"] == "G-code Routine"
+    assert isinstance(decode_arg(calls[2]["args"][0]), GcodeFile)
+
+    transport, results = replay(recording, time_scale=50)
+    assert not transport.mismatches
+    assert transport._next == len(transport.exchanges)
+    assert [(name, result) for name, result, *_ in results] == [
+        ("open_clamp", None), ("ser_send", None), ("G-code Routine", True)
+    ]
@@ -0,0 +1,30 @@
+import pytest
+
+from _toolpath_timeline import Timeline
+
+SETTINGS = {11: 0.01, 110: 60000, 111: 60000, 112: 60000, 120: 10, 121: 10, 122: 10}
+
+def test_positions_follow_the_profile():
+    timeline = Timeline(["G1 X100 F600"], SETTINGS)
+    assert len(timeline) == 1
+    assert timeline.duration == pytest.approx(11)
+    assert timeline.position(0) == pytest.approx([0, 0])
+    assert timeline.position(1) == pytest.approx([5, 0])  # End of the acceleration
+    assert timeline.position(5.5) == pytest.approx([50, 0])
+    assert timeline.position(20) == pytest.approx([100, 0])
+
+def test_dwell_holds_position():
+    timeline = Timeline(["G1 X10 F6000", "G4 P3", "G0 Y10"], SETTINGS)
+    assert timeline.duration == pytest.approx(2 + 3 + 2)
+    assert timeline.positions([2.5, 4.9]).ravel() == pytest.approx([10, 0, 10, 0])
+    assert timeline.blocks_done(4.9) == 1
+    assert timeline.position(7) == pytest.approx([10, 10])
+
+def test_peening_flags():
+    timeline = Timeline(["G0 X10", "G1 X20 F600"], SETTINGS)
+    assert list(timeline.peening) == [False, True]
+
+def test_empty_program():
+    timeline = Timeline([], SETTINGS)
+    assert timeline.duration == 0
+    assert timeline.positions([0, 1]).shape == (2, 2)
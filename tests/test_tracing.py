@@ -0,0 +1,63 @@
+import json
+
+from tracing import Tracer, traced
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    with tracer.span("send"):
+        pass
+    assert not tracer.events
+
+class ManualClock:
+    def __init__(self):
+        self.t = 0
+
+    def now(self):
+        return self.t
+
+def test_spans_on_own_clock():
+    clock = ManualClock()
+    tracer = Tracer(clock)
+    tracer.enable()
+    with tracer.span("dwell", seconds=2):
+        clock.t += 2
+    (name, cat, start, duration, track, args), = tracer.events
+    assert (name, duration, args) == ("dwell", 2, {"seconds": 2})
+
+def test_traced_uses_objects_tracer():
+    class Thing:
+        def __init__(self):
+            self.tracer = Tracer()
+            self.tracer.enable()
+
+        @traced("work")
+        def work(self):
+            return 1
+
+    a, b = Thing(), Thing()
+    a.work()
+    assert [event[0] for event in a.tracer.events] == ["work"]
+    assert not b.tracer.events
+
+def test_machines_trace_separately(make_machine, tmp_path):
+    machines = [make_machine(tracing=True, trace_dir=str(tmp_path / name)) for name in ("a", "b")]
+    assert machines[0].tracer is not machines[1].tracer
+    assert machines[0].ser.tracer is machines[0].tracer
+    futures = [m.spin_tray_routine(1, m.TRAY_CCW) for m in machines]
+    for future in futures:
+        future.result(timeout=30)
+    for name in ("a", "b"):
+        filepath, = (tmp_path / name).iterdir()
+        events = json.loads(filepath.read_text())["traceEvents"]
+        assert [e["name"] for e in events].count("Spin Tray Routine") == 1
+
+def test_engraving_traces_design_size(make_machine, tmp_path, capsys):
+    from PyQt5.QtWidgets import QMessageBox
+    from dialog_channel import ScriptedResponder
+    m = make_machine(tracing=True, trace_dir=str(tmp_path))
+    m.dialogs.responder = ScriptedResponder(default=QMessageBox.Yes)
+    assert m.do_engraving_routine([[(0, 0), (0.1, 0.1), (0.1, -0.1)]]).result(timeout=60)
+    filepath, = tmp_path.iterdir()
+    event, = [e for e in json.loads(filepath.read_text())["traceEvents"] if e["name"] == "design_gcode"]
+    assert 0 < event["args"]["bytes"] < event["args"]["verbose_bytes"]
+    assert "Design G-code" not in capsys.readouterr().out
@@ -0,0 +1,154 @@
+"""
+Lightweight span tracing for Machine routines, exported as Chrome trace-event JSON.
+
+Open the exported files in chrome://tracing or https://ui.perfetto.dev for a flame chart of a job.
+Tracing is off by default, a disabled `span()` returns a shared no-op context so instrumented code
+costs one attribute check. Coroutines get a track per asyncio task, everything else a track per thread.
+Each Machine has its own Tracer, the module-level `tracer` is the default for everything else.
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+import functools
+import collections
+
+from hardware import Clock
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start", "track")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.track = self.tracer._track()
+        self.start = self.tracer.clock.now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = self.tracer.clock.now()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.events.append((self.name, self.cat, self.start, end - self.start, self.track, self.args))
+        return False
+
+    def set(self, **args):
+        """Attach metadata found out while the span is running."""
+        self.args.update(args)
+
+class Tracer:
+    def __init__(self, clock=None, max_events=200_000):
+        self.enabled = False
+        self.clock = clock or Clock()
+        self.events = collections.deque(maxlen=max_events)  # (name, cat, start, duration, track, args)
+        self.tracks = {}  # track id -> name
+        self._job = None  # (name, start)
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, cat="machine", **args):
+        """Context manager timing the enclosed block, a no-op while disabled."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def instant(self, name, cat="machine", **args):
+        if self.enabled:
+            self.events.append((name, cat, self.clock.now(), None, self._track(), args))
+
+    def _track(self):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            key, name = id(task), task.get_name()
+        else:
+            thread = threading.current_thread()
+            key, name = thread.ident, thread.name
+        self.tracks.setdefault(key, name)
+        return key
+
+    def begin_job(self, name):
+        self._job = (name, self.clock.now())
+
+    def end_job(self, directory=None):
+        """Finish the current job, writing its trace to `directory` when given. Returns the file path or None."""
+        job, self._job = self._job, None
+        if job is None or not self.enabled or not directory:
+            return None
+        name, start = job
+        os.makedirs(directory, exist_ok=True)
+        filepath = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}_{name.lower().replace(' ', '_')}.json")
+        self.export(filepath, since=start)
+        return filepath
+
+    def to_chrome(self, since=None):
+        """The recorded events as a Chrome trace-event document."""
+        trace = []
+        used = set()
+        for name, cat, start, duration, track, args in list(self.events):
+            if since is not None and start < since:
+                continue
+            event = {"name": name, "cat": cat, "ts": start * 1e6, "pid": 1, "tid": track, "args": args}
+            if duration is None:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=duration * 1e6)
+            trace.append(event)
+            used.add(track)
+        for track in used:
+            trace.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": track, "args": {"name": self.tracks.get(track, str(track))}})
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def export(self, filepath, since=None):
+        with open(filepath, "w+") as out:
+            json.dump(self.to_chrome(since), out)
+
+    def clear(self):
+        self.events.clear()
+        self.tracks.clear()
+
+def traced(name=None, cat="machine"):
+    """Decorator spanning every call of a function or coroutine function, on its object's `tracer` if it has one."""
+    def wrapper(func):
+        span_name = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def inner(*args, **kwargs):
+                with _tracer_for(args).span(span_name, cat):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def inner(*args, **kwargs):
+                with _tracer_for(args).span(span_name, cat):
+                    return func(*args, **kwargs)
+        return inner
+    return wrapper
+
+def _tracer_for(args):
+    return getattr(args[0], "tracer", tracer) if args else tracer
+
+tracer = Tracer()
@@ -1,41 +1,15 @@
-import sys
-import glob
-import serial
 import colorsys
 import functools
 from random import randint, shuffle
 
-import numpy as np
-
 def serial_ports():
     """ Lists serial port names
 
-        :raises EnvironmentError:
-            On unsupported or unknown platforms
         :returns:
-            A list of the serial ports available on the system
-
-        https://stackoverflow.com/a/14224477
+            A list of the serial ports available on the system, from OS metadata without opening each device.
     """
-    if sys.platform.startswith('win'):
-        ports = ['COM%s' % (i + 1) for i in range(256)]
-    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-        # this excludes your current terminal "/dev/tty"
-        ports = glob.glob('/dev/tty[A-Za-z]*')
-    elif sys.platform.startswith('darwin'):
-        ports = glob.glob('/dev/tty.*')
-    else:
-        raise EnvironmentError('Unsupported platform')
-
-    result = []
-    for port in ports:
-        try:
-            s = serial.Serial(port)
-            s.close()
-            result.append(port)
-        except (OSError, serial.SerialException):
-            pass
-    return result
+    from port_discovery import discovery
+    return [port.path for port in discovery.list_ports()]
 
 
 def gen_colours(n, randomize=False, skip_wraparound=True, skip_yellow=True):
@@ -81,6 +55,9 @@ def debug_func(func):
         return value
     return wrapper_debug
 
+def pt_dist(p1, p2):
+    return ((p2[0] - p1[0])**2 + (p2[1] - p1[1])**2)**0.5
+
 def angle_between(v1, v2):
     """ Returns the angle in radians between vectors 'v1' and 'v2'::
 
@@ -92,6 +69,8 @@ def angle_between(v1, v2):
             3.141592653589793
     """
 
+    import numpy as np
+
     def unit_vector(vector):
         """ Returns the unit vector of the vector.  """
         return vector / np.linalg.norm(vector)